@@ -124,7 +124,8 @@ export const endpoints = {
     hot: "/api/courses/hot/",
     suggested: "/api/courses/suggested/",
     myCourses:"/api/courses/my-courses/",
-    chat: (id) => `/api/courses/${id}/chat/`,
+    // Endpoint async (ASGI): chờ LLM không chiếm thread dùng chung của các view đồng bộ
+    chat: (id) => `/api/courses/${id}/chat/async/`,
     history: (id) => `/api/courses/${id}/chat/history/`,
   },
   payment: {
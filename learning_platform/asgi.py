@@ -14,3 +14,7 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'learning_platform.settings')
 
 application = get_asgi_application()
+
+# Load sẵn embedding model cho worker này để request chat đầu tiên không phải chờ load model
+from learningapi.services.embedding_registry import warm_up
+warm_up()
@@ -1,8 +1,16 @@
 import os
 from celery import Celery
+from celery.signals import worker_process_init
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'learning_platform.settings')
 
 app = Celery('learning_platform')
 app.config_from_object('django.conf:settings', namespace='CELERY')
-app.autodiscover_tasks()
\ No newline at end of file
+app.autodiscover_tasks()
+
+
+@worker_process_init.connect
+def warm_up_embedding_models(**kwargs):
+    # Mỗi process con của celery worker load embedding model 1 lần trước khi nhận task
+    from learningapi.services.embedding_registry import warm_up
+    warm_up()
@@ -282,4 +282,177 @@ CELERY_RESULT_BACKEND = CELERY_BROKER_URL
 CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
-CELERY_TIMEZONE = 'Asia/Ho_Chi_Minh'
\ No newline at end of file
+CELERY_TIMEZONE = 'Asia/Ho_Chi_Minh'
+# Mỗi stage của pipeline ingest có queue riêng để scale / chỉnh concurrency, prefetch độc lập (xem render.yaml):
+# ingest_extract: tải file + chunk (chờ I/O), ingest_embed: encode (CPU, 1 process/model), ingest_persist: ghi DB
+CELERY_TASK_ROUTES = {
+    'learningapi.tasks.ingest_extract_task': {'queue': 'ingest_extract'},
+    'learningapi.tasks.ingest_embed_task': {'queue': 'ingest_embed'},
+    'learningapi.tasks.ingest_persist_task': {'queue': 'ingest_persist'},
+    'learningapi.tasks.backfill_embeddings_task': {'queue': 'ingest_embed'},
+}
+
+# Embedding model (RAG)
+# Model được load 1 lần/process và warm-up khi gunicorn/celery worker khởi động
+EMBEDDING_MODEL = env('EMBEDDING_MODEL', default='sentence-transformers/all-MiniLM-L6-v2')
+# Đổi embedding model không downtime (model của cột Chunk.embedding được ghi trong DB, xem embedding_models.py):
+# 1. đặt EMBEDDING_ACTIVE_MODEL sang model mới → embedding được backfill vào bảng ChunkEmbedding trong khi model cũ
+#    vẫn phục vụ (manage.py backfill_embeddings); query chuyển sang model mới khi mọi chunk đã có embedding
+# 2. manage.py promote_embedding_model [--resize nếu khác số chiều]: chép embedding mới vào cột Chunk.embedding
+# 3. đặt EMBEDDING_MODEL = model mới và bỏ EMBEDDING_ACTIVE_MODEL
+EMBEDDING_ACTIVE_MODEL = env('EMBEDDING_ACTIVE_MODEL', default=EMBEDDING_MODEL)
+EMBEDDING_PRELOAD_MODELS = env.list('EMBEDDING_PRELOAD_MODELS', default=list(dict.fromkeys([EMBEDDING_MODEL, EMBEDDING_ACTIVE_MODEL])))
+EMBEDDING_WARMUP = env.bool('EMBEDDING_WARMUP', default=True)
+# Runtime chạy embedding model: "sentence-transformers" (PyTorch) hoặc "onnx" (ONNX Runtime, nhanh hơn trên CPU)
+EMBEDDING_BACKEND = env('EMBEDDING_BACKEND', default='sentence-transformers')
+# Số thread cho 1 lần encode (0 = mặc định của thư viện, thường = số core)
+EMBEDDING_THREADS = env.int('EMBEDDING_THREADS', default=0)
+# Backend onnx: lượng tử hoá động trọng số sang int8 (nhỏ và nhanh hơn, cosine với bản gốc vẫn >= 0.99)
+EMBEDDING_ONNX_QUANTIZE = env.bool('EMBEDDING_ONNX_QUANTIZE', default=False)
+# Embedding server dùng chung cho mọi worker trên máy (manage.py embedding_server), vd "unix:///tmp/embedding.sock"
+# hoặc "tcp://127.0.0.1:8765". Để trống = mỗi process tự load model. Server lỗi → tự encode trong process
+EMBEDDING_SERVER_URL = env('EMBEDDING_SERVER_URL', default='')
+EMBEDDING_SERVER_TIMEOUT = env.float('EMBEDDING_SERVER_TIMEOUT', default=5.0)
+# Sau 1 lần lỗi kết nối, encode trong process bao nhiêu giây rồi mới thử lại server
+EMBEDDING_SERVER_RETRY_SECONDS = env.int('EMBEDDING_SERVER_RETRY_SECONDS', default=30)
+# Micro-batching phía server: gom request trong tối đa MAX_WAIT_MS hoặc tới khi đủ MAX_BATCH câu
+EMBEDDING_SERVER_MAX_BATCH = env.int('EMBEDDING_SERVER_MAX_BATCH', default=64)
+EMBEDDING_SERVER_MAX_WAIT_MS = env.float('EMBEDDING_SERVER_MAX_WAIT_MS', default=5.0)
+# Số chunk encode/insert mỗi batch khi ingest tài liệu
+EMBEDDING_BATCH_SIZE = env.int('EMBEDDING_BATCH_SIZE', default=64)
+# Số batch mỗi task backfill xử lý trước khi tự gửi lại task tiếp theo (không giữ worker quá lâu)
+EMBEDDING_BACKFILL_BATCHES_PER_TASK = env.int('EMBEDDING_BACKFILL_BATCHES_PER_TASK', default=50)
+
+# Vector index (pgvector) cho Chunk.embedding: "hnsw", "ivfflat" hoặc "none" (quét tuần tự)
+# migrate luôn tạo HNSW; loại khác build bằng `python manage.py vector_index` sau khi đổi biến này
+VECTOR_INDEX_TYPE = env('VECTOR_INDEX_TYPE', default='hnsw')
+VECTOR_HNSW_M = env.int('VECTOR_HNSW_M', default=16)
+VECTOR_HNSW_EF_CONSTRUCTION = env.int('VECTOR_HNSW_EF_CONSTRUCTION', default=64)
+# Tham số recall mặc định lúc query, có thể ghi đè theo từng request (giới hạn bởi *_MAX)
+VECTOR_HNSW_EF_SEARCH = env.int('VECTOR_HNSW_EF_SEARCH', default=40)
+VECTOR_HNSW_EF_SEARCH_MAX = env.int('VECTOR_HNSW_EF_SEARCH_MAX', default=400)
+VECTOR_IVFFLAT_PROBES = env.int('VECTOR_IVFFLAT_PROBES', default=10)
+VECTOR_IVFFLAT_PROBES_MAX = env.int('VECTOR_IVFFLAT_PROBES_MAX', default=100)
+# pgvector >= 0.8: "relaxed_order" / "strict_order" để index quét tiếp khi filter theo course ("off" để tắt).
+# Filter course_id chạy sau khi quét index: không có iterative scan thì khoá học nhỏ có thể nhận ít hơn k chunk.
+# Tự tắt nếu database dùng pgvector < 0.8; khi đó ef_search tối thiểu là VECTOR_HNSW_EF_SEARCH_FILTERED
+VECTOR_ITERATIVE_SCAN = env('VECTOR_ITERATIVE_SCAN', default='relaxed_order')
+VECTOR_HNSW_EF_SEARCH_FILTERED = env.int('VECTOR_HNSW_EF_SEARCH_FILTERED', default=200)
+# Lượng tử hoá index ANN của Chunk.embedding: "none", "halfvec" (float16) hoặc "binary" (1 bit/chiều)
+# Đổi giá trị thì chạy lại `python manage.py vector_index` để build index tương ứng
+VECTOR_QUANTIZATION = env('VECTOR_QUANTIZATION', default='none')
+# Re-rank bằng embedding float32: lấy VECTOR_RERANK_CANDIDATES ứng viên từ index lượng tử hoá rồi sắp xếp lại chính xác
+VECTOR_RERANK = env.bool('VECTOR_RERANK', default=True)
+VECTOR_RERANK_CANDIDATES = env.int('VECTOR_RERANK_CANDIDATES', default=40)
+
+# Semantic answer cache cho AI tutor
+ANSWER_CACHE_ENABLED = env.bool('ANSWER_CACHE_ENABLED', default=True)
+# Cosine distance tối đa giữa câu hỏi mới và câu hỏi đã cache để coi là "cùng câu hỏi"
+ANSWER_CACHE_MAX_DISTANCE = env.float('ANSWER_CACHE_MAX_DISTANCE', default=0.08)
+# Thời gian sống của 1 entry (giây), 0 = không hết hạn (vẫn bị xoá khi tài liệu khoá học thay đổi)
+ANSWER_CACHE_TTL = env.int('ANSWER_CACHE_TTL', default=7 * 24 * 3600)
+# Câu hỏi ngắn hơn số từ này khi đang có lịch sử hội thoại ("còn cái kia?", "tại sao?") được coi là câu hỏi nối tiếp:
+# giữ lịch sử trong prompt và không dùng cache. Câu hỏi độc lập trả lời chỉ từ tài liệu nên được cache / dùng chung
+ANSWER_CACHE_STANDALONE_MIN_WORDS = env.int('ANSWER_CACHE_STANDALONE_MIN_WORDS', default=4)
+
+# Django cache: dùng Redis (chia sẻ giữa các worker) nếu có CACHE_REDIS_URL, mặc định LocMemCache
+CACHE_REDIS_URL = env('CACHE_REDIS_URL', default='')
+if CACHE_REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': CACHE_REDIS_URL,
+        }
+    }
+
+# Cache embedding câu hỏi chat (key = câu hỏi đã chuẩn hoá + model): tầng trong process (LRU, tối đa SIZE câu)
+# và tầng dùng chung qua Django cache (Redis nếu có CACHE_REDIS_URL) khi bật SHARED. TTL tính bằng giây, 0 = không hết hạn
+QUERY_EMBEDDING_CACHE_ENABLED = env.bool('QUERY_EMBEDDING_CACHE_ENABLED', default=True)
+QUERY_EMBEDDING_CACHE_SIZE = env.int('QUERY_EMBEDDING_CACHE_SIZE', default=2048)
+QUERY_EMBEDDING_CACHE_TTL = env.int('QUERY_EMBEDDING_CACHE_TTL', default=24 * 3600)
+QUERY_EMBEDDING_CACHE_SHARED = env.bool('QUERY_EMBEDDING_CACHE_SHARED', default=bool(CACHE_REDIS_URL))
+
+# Index vector trong process (RETRIEVAL_MODE="vector"): khoá học tối đa MEMORY_INDEX_MAX_CHUNKS chunk được tìm trong RAM,
+# khoá học lớn hơn vẫn query pgvector. Tổng bộ nhớ các index mỗi process tối đa MEMORY_INDEX_MAX_MB (bỏ bớt theo LRU)
+MEMORY_INDEX_ENABLED = env.bool('MEMORY_INDEX_ENABLED', default=False)
+MEMORY_INDEX_MAX_CHUNKS = env.int('MEMORY_INDEX_MAX_CHUNKS', default=20000)
+MEMORY_INDEX_MAX_MB = env.int('MEMORY_INDEX_MAX_MB', default=256)
+# Version của khoá học (số chunk, id lớn nhất) đọc lại từ DB tối đa mỗi RECHECK giây; index load lại sau TTL giây
+MEMORY_INDEX_RECHECK_SECONDS = env.float('MEMORY_INDEX_RECHECK_SECONDS', default=5.0)
+MEMORY_INDEX_TTL_SECONDS = env.int('MEMORY_INDEX_TTL_SECONDS', default=600)
+
+# Retrieval cho AI tutor: "hybrid" (full-text + vector, gộp bằng RRF) hoặc "vector"
+RETRIEVAL_MODE = env('RETRIEVAL_MODE', default='hybrid')
+# Số chunk tối đa đưa vào prompt
+RAG_TOP_K = env.int('RAG_TOP_K', default=6)
+# Số chunk ứng viên lấy từ DB trước khi chọn lại bằng MMR
+RAG_CANDIDATES = env.int('RAG_CANDIDATES', default=20)
+# Ngân sách token cho phần context tài liệu trong prompt
+RAG_CONTEXT_TOKEN_BUDGET = env.int('RAG_CONTEXT_TOKEN_BUDGET', default=1500)
+# MMR: 1.0 = chỉ xét độ liên quan, 0.0 = chỉ xét độ đa dạng
+RAG_MMR_LAMBDA = env.float('RAG_MMR_LAMBDA', default=0.7)
+# Cosine similarity >= ngưỡng này với 1 chunk đã chọn thì coi là trùng lặp
+RAG_DUPLICATE_THRESHOLD = env.float('RAG_DUPLICATE_THRESHOLD', default=0.95)
+# Số ứng viên mỗi nhánh (full-text / vector) trước khi gộp
+HYBRID_CANDIDATES = env.int('HYBRID_CANDIDATES', default=20)
+# Hằng số k của reciprocal rank fusion: score = sum(1 / (k + rank))
+HYBRID_RRF_K = env.int('HYBRID_RRF_K', default=60)
+# Relevance gate: trung bình RELEVANCE_GATE_TOP_K cosine distance nhỏ nhất của ứng viên > RELEVANCE_GATE_MAX_DISTANCE
+# thì gửi thẳng prompt tìm trên internet (bỏ lần gọi LLM với context tài liệu).
+# Mặc định khá dè dặt; chạy `python manage.py calibrate_relevance_gate` để lấy ngưỡng theo dữ liệu thật
+RELEVANCE_GATE_ENABLED = env.bool('RELEVANCE_GATE_ENABLED', default=True)
+RELEVANCE_GATE_MAX_DISTANCE = env.float('RELEVANCE_GATE_MAX_DISTANCE', default=0.75)
+RELEVANCE_GATE_TOP_K = env.int('RELEVANCE_GATE_TOP_K', default=3)
+
+# Lịch sử hội thoại trong prompt AI tutor: CONVERSATION_TURNS lượt gần nhất + tóm tắt các lượt cũ hơn (theo learner + khoá học)
+CONVERSATION_TURNS = env.int('CONVERSATION_TURNS', default=4)
+# Ngân sách token cho cả phần lịch sử (tóm tắt + các lượt), lượt cũ bị bỏ trước
+CONVERSATION_TOKEN_BUDGET = env.int('CONVERSATION_TOKEN_BUDGET', default=600)
+# Câu hỏi / câu trả lời dài hơn bị rút gọn khi đưa vào prompt
+CONVERSATION_ANSWER_MAX_TOKENS = env.int('CONVERSATION_ANSWER_MAX_TOKENS', default=200)
+CONVERSATION_SUMMARY_MAX_TOKENS = env.int('CONVERSATION_SUMMARY_MAX_TOKENS', default=200)
+# Cache state trong Django cache (read-through) chỉ khi cache dùng chung giữa các worker (Redis); TTL ngắn (giây)
+CONVERSATION_CACHE_ENABLED = env.bool('CONVERSATION_CACHE_ENABLED', default=bool(CACHE_REDIS_URL))
+CONVERSATION_CACHE_TTL = env.int('CONVERSATION_CACHE_TTL', default=60)
+
+# LLM cho AI tutor: "gemini" hoặc "openai" (API tương thích OpenAI: OpenAI, LM Studio, `manage.py fake_llm_server`)
+LLM_PROVIDER = env('LLM_PROVIDER', default='gemini')
+LLM_MODEL = env('LLM_MODEL', default='gemini-2.5-flash')
+# Provider openai: để trống = api.openai.com; LM Studio: http://localhost:1234/v1
+LLM_BASE_URL = env('LLM_BASE_URL', default='')
+# Để trống = GOOGLE_API_KEY (gemini) / OPENAI_API_KEY (openai)
+LLM_API_KEY = env('LLM_API_KEY', default='')
+# Provider openai: temperature và số token tối đa của câu trả lời (gemini dùng mặc định của model)
+LLM_TEMPERATURE = env.float('LLM_TEMPERATURE', default=0.3)
+LLM_MAX_OUTPUT_TOKENS = env.int('LLM_MAX_OUTPUT_TOKENS', default=800)
+# Timeout mỗi lần gọi và tổng thời gian tối đa kể cả retry (giây)
+LLM_TIMEOUT_SECONDS = env.float('LLM_TIMEOUT_SECONDS', default=30)
+LLM_DEADLINE_SECONDS = env.float('LLM_DEADLINE_SECONDS', default=60)
+# Retry lỗi tạm thời (timeout, 429, 5xx) với backoff mũ + jitter
+LLM_MAX_RETRIES = env.int('LLM_MAX_RETRIES', default=2)
+LLM_RETRY_BASE_SECONDS = env.float('LLM_RETRY_BASE_SECONDS', default=0.5)
+# Circuit breaker: sau N lần lỗi liên tiếp, từ chối ngay trong RESET_SECONDS giây
+LLM_BREAKER_FAILURES = env.int('LLM_BREAKER_FAILURES', default=5)
+LLM_BREAKER_RESET_SECONDS = env.int('LLM_BREAKER_RESET_SECONDS', default=30)
+
+# Giới hạn số lời gọi LLM đồng thời: mỗi process và cả cụm (cần CACHE_REDIS_URL, 0 = không giới hạn cả cụm).
+# Request chờ slot tối đa LLM_QUEUE_TIMEOUT_SECONDS giây, tối đa LLM_MAX_QUEUE request chờ mỗi process; quá → 429
+LLM_MAX_CONCURRENCY = env.int('LLM_MAX_CONCURRENCY', default=8)
+LLM_MAX_CONCURRENCY_GLOBAL = env.int('LLM_MAX_CONCURRENCY_GLOBAL', default=0)
+LLM_MAX_QUEUE = env.int('LLM_MAX_QUEUE', default=32)
+LLM_QUEUE_TIMEOUT_SECONDS = env.float('LLM_QUEUE_TIMEOUT_SECONDS', default=10)
+LLM_BUSY_RETRY_AFTER_SECONDS = env.int('LLM_BUSY_RETRY_AFTER_SECONDS', default=5)
+# Các request cùng khoá học + cùng câu hỏi đang chạy dùng chung 1 lần gọi LLM
+LLM_COALESCE = env.bool('LLM_COALESCE', default=True)
+
+# Chunking khi ingest, đo bằng token của embedding model (all-MiniLM-L6-v2 chỉ encode tối đa 256 token)
+CHUNK_MAX_TOKENS = env.int('CHUNK_MAX_TOKENS', default=254)
+CHUNK_OVERLAP_TOKENS = env.int('CHUNK_OVERLAP_TOKENS', default=32)
+
+# Job ingest đang chờ/chạy quá thời gian này (giây) được coi là treo và cho phép ingest lại
+INGESTION_JOB_STALE_SECONDS = env.int('INGESTION_JOB_STALE_SECONDS', default=3600)
+# True: chạy job ingest thành chuỗi task extract → embed → persist trên các queue riêng;
+# False: cả job trong 1 task ở queue mặc định (khi chỉ có 1 celery worker)
+INGESTION_PIPELINE = env.bool('INGESTION_PIPELINE', default=True)
+# Số lần retry tối đa của mỗi stage trước khi job bị đánh dấu failed
+INGESTION_STAGE_MAX_RETRIES = env.int('INGESTION_STAGE_MAX_RETRIES', default=3)
@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+
+from learningapi.services import embedding_models
+
+
+class Command(BaseCommand):
+    help = (
+        "Backfill embedding của EMBEDDING_ACTIVE_MODEL (hoặc --model) vào bảng ChunkEmbedding. "
+        "Model cũ vẫn phục vụ query tới khi mọi chunk đã có embedding, sau đó index được build và query chuyển sang model mới."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--model", default=None, help="Tên model (mặc định: settings.EMBEDDING_ACTIVE_MODEL)")
+        parser.add_argument("--batch-size", type=int, default=None)
+        parser.add_argument("--max-batches", type=int, default=None, help="Dừng sau N batch (mặc định: tới khi xong)")
+        parser.add_argument("--queue", action="store_true", help="Gửi task Celery chạy nền thay vì chạy trong process này")
+
+    def handle(self, *args, **options):
+        model_name = options["model"] or embedding_models.secondary_model()
+        if model_name is None:
+            self.stdout.write("EMBEDDING_ACTIVE_MODEL trùng model của cột Chunk.embedding: không có gì để backfill.")
+            return
+        if options["queue"]:
+            from learningapi.tasks import backfill_embeddings_task
+            backfill_embeddings_task.delay(model_name)
+            self.stdout.write(f"Đã gửi task backfill cho {model_name}")
+            return
+
+        stats = embedding_models.backfill(model_name, max_batches=options["max_batches"], batch_size=options["batch_size"])
+        self.stdout.write(
+            f"{model_name}: +{stats['embedded']} chunks, coverage {stats['embedded_chunks']}/{stats['total_chunks']} "
+            f"({stats['coverage']:.1%})"
+        )
+        if stats["ready"]:
+            self.stdout.write(self.style.SUCCESS(f"{model_name} đã sẵn sàng và phục vụ query (nếu là EMBEDDING_ACTIVE_MODEL)"))
+            self.stdout.write("Tiếp theo: manage.py promote_embedding_model để chuyển model này vào cột Chunk.embedding.")
@@ -0,0 +1,72 @@
+import random
+import time
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from learningapi.services.chunking import ModelTokenCounter, WordTokenCounter, iter_chunks_with_tokens
+
+VOCAB = (
+    "học máy dữ liệu mô hình hàm biến vòng lặp thuật toán cấu trúc mảng danh sách đồ thị "
+    "python django vector embedding gradient descent regression softmax tensor numpy "
+    "bài giảng khoá học chương ví dụ công thức định lý chứng minh kết quả"
+).split()
+
+
+def synthetic_segments(size_bytes: int, seed: int = 0, segment_bytes: int = 64 * 1024):
+    """
+    Sinh text tổng hợp theo từng đoạn ~64 KB (giống luồng trang PDF): câu dài ngắn khác nhau, đoạn văn,
+    và cả những đoạn dài không có dấu câu như transcript.
+    """
+    rng = random.Random(seed)
+    produced = 0
+    while produced < size_bytes:
+        parts, part_bytes = [], 0
+        while part_bytes < segment_bytes:
+            if rng.random() < 0.05:
+                # transcript không có dấu câu
+                sentence = " ".join(rng.choices(VOCAB, k=rng.randint(200, 2000))) + " "
+            else:
+                sentence = " ".join(rng.choices(VOCAB, k=rng.randint(4, 60))) + rng.choice([". ", "? ", "! ", ".\n\n"])
+            parts.append(sentence)
+            part_bytes += len(sentence.encode("utf-8"))
+        segment = "".join(parts)
+        produced += part_bytes
+        yield segment
+
+
+class Command(BaseCommand):
+    help = "Benchmark chunker trên text tổng hợp 1 MB / 10 MB / 50 MB: chunks/s và phân bố kích thước chunk."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sizes-mb", nargs="+", type=int, default=[1, 10, 50])
+        parser.add_argument("--counter", choices=["model", "words"], default="model",
+                            help="model: tokenizer của embedding model, words: đếm theo từ")
+        parser.add_argument("--max-tokens", type=int, default=None)
+        parser.add_argument("--overlap-tokens", type=int, default=None)
+
+    def handle(self, *args, **options):
+        counter = ModelTokenCounter() if options["counter"] == "model" else WordTokenCounter()
+        max_tokens = options["max_tokens"] or settings.CHUNK_MAX_TOKENS
+        for size_mb in options["sizes_mb"]:
+            started = time.perf_counter()
+            sizes = [
+                tokens for _, tokens in iter_chunks_with_tokens(
+                    synthetic_segments(size_mb * 1024 * 1024),
+                    max_tokens=max_tokens,
+                    overlap_tokens=options["overlap_tokens"],
+                    counter=counter,
+                )
+            ]
+            elapsed = time.perf_counter() - started
+            sizes = np.asarray(sizes)
+            p5, p50, p95 = np.percentile(sizes, [5, 50, 95])
+            self.stdout.write(
+                f"{size_mb:>3} MB | {len(sizes)} chunks in {elapsed:.2f}s "
+                f"({len(sizes) / elapsed:.0f} chunks/s, {size_mb / elapsed:.2f} MB/s) | "
+                f"tokens min={sizes.min()} p5={p5:.0f} p50={p50:.0f} p95={p95:.0f} max={sizes.max()} "
+                f"(limit {max_tokens})"
+            )
+            if sizes.max() > max_tokens:
+                self.stdout.write(self.style.ERROR("  chunk vượt quá giới hạn token!"))
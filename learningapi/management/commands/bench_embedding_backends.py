@@ -0,0 +1,53 @@
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from learningapi.services.chunking import WordTokenCounter, iter_chunks_with_tokens
+from learningapi.services.embedding_backends import BACKENDS, create_backend
+
+from .bench_chunker import synthetic_segments
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark tốc độ encode trên CPU của các embedding backend (sentence-transformers / onnx / onnx int8) "
+        "với nhiều số thread: câu/s và câu/s trên mỗi core."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--model", default=None, help="Mặc định: settings.EMBEDDING_MODEL")
+        parser.add_argument("--backends", nargs="+", default=["sentence-transformers", "onnx", "onnx-int8"],
+                            choices=list(BACKENDS) + ["onnx-int8"])
+        parser.add_argument("--threads", nargs="+", type=int, default=[1, os.cpu_count() or 1])
+        parser.add_argument("--sentences", type=int, default=1000)
+        parser.add_argument("--batch-size", type=int, default=None)
+        parser.add_argument("--max-tokens", type=int, default=128, help="Độ dài (từ) của mỗi câu mẫu")
+
+    def handle(self, *args, **options):
+        model_name = options["model"] or settings.EMBEDDING_MODEL
+        batch_size = options["batch_size"] or settings.EMBEDDING_BATCH_SIZE
+        texts = []
+        # Câu mẫu giống chunk thật: cắt từ text tổng hợp của bench_chunker
+        for text, _ in iter_chunks_with_tokens(
+            synthetic_segments(2 * 1024 * 1024), max_tokens=options["max_tokens"], overlap_tokens=0,
+            counter=WordTokenCounter(),
+        ):
+            texts.append(text)
+            if len(texts) >= options["sentences"]:
+                break
+
+        self.stdout.write(f"{model_name} | {len(texts)} câu, batch {batch_size}")
+        for name in options["backends"]:
+            backend, quantize = ("onnx", True) if name == "onnx-int8" else (name, False)
+            for threads in options["threads"]:
+                model = create_backend(model_name, backend, threads=threads, quantize=quantize)
+                model.encode(texts[:batch_size], batch_size=batch_size)  # warm-up
+                started = time.perf_counter()
+                model.encode(texts, batch_size=batch_size)
+                elapsed = time.perf_counter() - started
+                rate = len(texts) / elapsed
+                self.stdout.write(
+                    f"  {name:<22} threads={threads:<3} | {rate:8.1f} câu/s | {rate / threads:8.1f} câu/s/core"
+                )
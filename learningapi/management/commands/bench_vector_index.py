@@ -0,0 +1,162 @@
+import io
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from learningapi.services.vector_index import create_index_sql, index_name, supports_iterative_scan
+
+BENCH_TABLE = "bench_chunk_vectors"
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark index ANN của pgvector (HNSW / IVFFlat) trên dữ liệu tổng hợp: "
+        "recall@10 so với exact search và độ trễ p50/p99 ở nhiều kích thước bảng, "
+        "cho cả query không filter và query filter theo course_id như retrieval thật (có / không iterative scan)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sizes", nargs="+", type=int, default=[10_000, 100_000, 1_000_000])
+        parser.add_argument("--dimensions", type=int, default=384)
+        parser.add_argument("--queries", type=int, default=100)
+        parser.add_argument("--k", type=int, default=10)
+        parser.add_argument("--types", nargs="+", choices=["hnsw", "ivfflat"], default=["hnsw", "ivfflat"])
+        parser.add_argument("--ef-search", nargs="+", type=int, default=[20, 40, 100, 200])
+        parser.add_argument("--probes", nargs="+", type=int, default=[1, 5, 10, 20])
+        parser.add_argument("--courses", type=int, default=200, help="Số khoá học, mỗi dòng thuộc 1 khoá học ngẫu nhiên")
+        parser.add_argument(
+            "--iterative-scan", nargs="+", choices=["off", "relaxed_order", "strict_order"],
+            default=["off", "relaxed_order"], help="Chế độ iterative scan cho query filter (pgvector >= 0.8)",
+        )
+        parser.add_argument("--seed", type=int, default=42)
+        parser.add_argument("--keep", action="store_true", help="Không xoá bảng benchmark sau khi chạy")
+
+    def handle(self, *args, **options):
+        if connection.vendor != "postgresql":
+            raise CommandError("Benchmark cần PostgreSQL có extension pgvector.")
+        self.dim = options["dimensions"]
+        self.k = options["k"]
+        self.courses = max(1, options["courses"])
+        self.rng = np.random.default_rng(options["seed"])
+        # Dữ liệu dạng cụm (gần với embedding thật hơn vector ngẫu nhiên đều)
+        self.centers = self._normalize(self.rng.standard_normal((256, self.dim)).astype(np.float32))
+
+        with connection.cursor() as cursor:
+            cursor.execute("CREATE EXTENSION IF NOT EXISTS vector")
+            cursor.execute(f"DROP TABLE IF EXISTS {BENCH_TABLE}")
+            cursor.execute(
+                f"CREATE TABLE {BENCH_TABLE} (id bigserial PRIMARY KEY, course_id integer, embedding vector({self.dim}))"
+            )
+
+        modes = options["iterative_scan"]
+        if not supports_iterative_scan():
+            if any(m != "off" for m in modes):
+                self.stdout.write("pgvector < 0.8: bỏ qua iterative scan")
+            modes = ["off"]
+
+        try:
+            loaded = 0
+            for size in sorted(options["sizes"]):
+                self._load(loaded, size)
+                loaded = size
+                queries = self._sample(options["queries"])
+                courses = self.rng.integers(0, self.courses, len(queries))
+                exact, exact_lat = self._run_queries(queries, None, None)
+                self._report(size, "exact", "-", 1.0, exact_lat)
+                exact_filtered, exact_filtered_lat = self._run_queries(queries, None, None, courses)
+                self._report(size, "exact", "course filter", 1.0, exact_filtered_lat, self._filled(exact_filtered))
+                for kind in options["types"]:
+                    build_seconds = self._build_index(kind, size)
+                    self.stdout.write(f"  build {kind}: {build_seconds:.1f}s")
+                    values = options["ef_search"] if kind == "hnsw" else options["probes"]
+                    for value in values:
+                        ids, lat = self._run_queries(queries, kind, value)
+                        recall = self._recall(ids, exact)
+                        param = f"ef_search={value}" if kind == "hnsw" else f"probes={value}"
+                        self._report(size, kind, param, recall, lat)
+                        for mode in modes:
+                            if kind == "ivfflat" and mode == "strict_order":
+                                continue
+                            ids, lat = self._run_queries(queries, kind, value, courses, mode)
+                            self._report(
+                                size, kind, f"{param} filter/{mode}", self._recall(ids, exact_filtered), lat,
+                                self._filled(ids),
+                            )
+                    with connection.cursor() as cursor:
+                        cursor.execute(f"DROP INDEX IF EXISTS {index_name(kind, BENCH_TABLE)}")
+        finally:
+            if not options["keep"]:
+                with connection.cursor() as cursor:
+                    cursor.execute(f"DROP TABLE IF EXISTS {BENCH_TABLE}")
+
+    @staticmethod
+    def _normalize(m):
+        return m / np.linalg.norm(m, axis=1, keepdims=True)
+
+    def _sample(self, n):
+        centers = self.centers[self.rng.integers(0, len(self.centers), n)]
+        noise = self.rng.standard_normal((n, self.dim)).astype(np.float32) * 0.08
+        return self._normalize(centers + noise)
+
+    def _recall(self, ids, exact):
+        # Khoá học có ít hơn k dòng: recall tính trên số dòng exact search trả về
+        return np.mean([len(set(a) & set(e)) / max(1, len(e)) for a, e in zip(ids, exact)])
+
+    def _filled(self, ids):
+        # Tỉ lệ số dòng trả về / k: < 1 khi filter loại bớt kết quả của index
+        return np.mean([len(a) / self.k for a in ids])
+
+    def _load(self, start, end, batch=20_000):
+        self.stdout.write(f"Loading rows {start}..{end}")
+        with connection.cursor() as cursor:
+            for offset in range(start, end, batch):
+                vectors = self._sample(min(batch, end - offset))
+                courses = self.rng.integers(0, self.courses, len(vectors))
+                buf = io.StringIO()
+                for course_id, row in zip(courses, vectors):
+                    buf.write(f"{course_id}\t[" + ",".join("%.6f" % x for x in row) + "]\n")
+                buf.seek(0)
+                cursor.copy_expert(f"COPY {BENCH_TABLE} (course_id, embedding) FROM STDIN", buf)
+            cursor.execute(f"ANALYZE {BENCH_TABLE}")
+
+    def _build_index(self, kind, rows):
+        started = time.perf_counter()
+        with connection.cursor() as cursor:
+            cursor.execute(create_index_sql(kind, table=BENCH_TABLE, rows=rows))
+        return time.perf_counter() - started
+
+    def _run_queries(self, queries, kind, value, courses=None, iterative_scan="off"):
+        """
+        courses: course_id cho từng query (None = không filter), giống điều kiện WHERE course_id của retrieval.
+        """
+        results, latencies = [], []
+        where = "WHERE course_id = %s" if courses is not None else ""
+        sql = f"SELECT id FROM {BENCH_TABLE} {where} ORDER BY embedding <=> %s::vector LIMIT {int(self.k)}"
+        with transaction.atomic(), connection.cursor() as cursor:
+            if kind is None:
+                # exact search: tắt index scan để chắc chắn quét tuần tự
+                cursor.execute("SET LOCAL enable_indexscan = off")
+            elif kind == "hnsw":
+                cursor.execute("SELECT set_config('hnsw.ef_search', %s, true)", [str(value)])
+            else:
+                cursor.execute("SELECT set_config('ivfflat.probes', %s, true)", [str(value)])
+            if kind is not None and iterative_scan != "off":
+                cursor.execute(f"SELECT set_config('{kind}.iterative_scan', %s, true)", [iterative_scan])
+            for i, q in enumerate(queries):
+                literal = "[" + ",".join("%.6f" % x for x in q) + "]"
+                params = [literal] if courses is None else [int(courses[i]), literal]
+                started = time.perf_counter()
+                cursor.execute(sql, params)
+                rows = cursor.fetchall()
+                latencies.append((time.perf_counter() - started) * 1000)
+                results.append([r[0] for r in rows])
+        return results, latencies
+
+    def _report(self, size, kind, param, recall, latencies, filled=None):
+        p50, p99 = np.percentile(latencies, [50, 99])
+        self.stdout.write(
+            f"{size:>9} rows | {kind:<8} {param:<40} | recall@{self.k}={recall:.3f} | "
+            f"p50={p50:.2f}ms p99={p99:.2f}ms" + (f" | filled={filled:.2f}" if filled is not None else "")
+        )
@@ -0,0 +1,117 @@
+import time
+
+import numpy as np
+from django.core.management.base import CommandError
+from django.db import connection, transaction
+
+from learningapi.services.vector_index import (
+    QUANTIZATIONS, approx_distance_sql, create_index_sql, index_name, quantized_expression,
+)
+
+from .bench_vector_index import BENCH_TABLE, Command as VectorIndexBenchCommand
+
+
+class Command(VectorIndexBenchCommand):
+    help = (
+        "Benchmark index HNSW trên embedding float32 / halfvec / binary (pgvector) với dữ liệu tổng hợp: "
+        "kích thước bảng và index, độ trễ p50/p99 và recall@10 so với exact search, có / không re-rank float32."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sizes", nargs="+", type=int, default=[100_000])
+        parser.add_argument("--dimensions", type=int, default=384)
+        parser.add_argument("--queries", type=int, default=100)
+        parser.add_argument("--k", type=int, default=10)
+        parser.add_argument("--quantizations", nargs="+", choices=QUANTIZATIONS, default=list(QUANTIZATIONS))
+        parser.add_argument("--ef-search", type=int, default=100)
+        parser.add_argument("--rerank-candidates", nargs="+", type=int, default=[40, 100])
+        parser.add_argument("--seed", type=int, default=42)
+        parser.add_argument("--keep", action="store_true", help="Không xoá bảng benchmark sau khi chạy")
+
+    def handle(self, *args, **options):
+        if connection.vendor != "postgresql":
+            raise CommandError("Benchmark cần PostgreSQL có extension pgvector.")
+        self.dim = options["dimensions"]
+        self.k = options["k"]
+        self.rng = np.random.default_rng(options["seed"])
+        self.centers = self._normalize(self.rng.standard_normal((256, self.dim)).astype(np.float32))
+
+        with connection.cursor() as cursor:
+            cursor.execute("CREATE EXTENSION IF NOT EXISTS vector")
+            cursor.execute(f"DROP TABLE IF EXISTS {BENCH_TABLE}")
+            cursor.execute(f"CREATE TABLE {BENCH_TABLE} (id bigserial PRIMARY KEY, embedding vector({self.dim}))")
+
+        try:
+            loaded = 0
+            for size in sorted(options["sizes"]):
+                self._load(loaded, size)
+                loaded = size
+                self.stdout.write(f"{size} rows | table {self._size_mb('pg_table_size(%s)', BENCH_TABLE):.1f} MB (float32)")
+                queries = self._sample(options["queries"])
+                exact, exact_lat = self._run_queries(queries, None, None)
+                self._report_quantized(size, "exact", "-", 1.0, exact_lat, None)
+                for quantization in options["quantizations"]:
+                    name, build_seconds = self._build_quantized_index(quantization, size)
+                    index_mb = self._size_mb("pg_relation_size(%s)", name)
+                    self.stdout.write(f"  build hnsw/{quantization}: {build_seconds:.1f}s, index {index_mb:.1f} MB")
+                    approx_sql = (
+                        f"SELECT id FROM {BENCH_TABLE} "
+                        f"ORDER BY {approx_distance_sql(quantization, self.dim, query='%s::vector')} LIMIT {int(self.k)}"
+                    )
+                    self._measure(size, quantization, "no re-rank", approx_sql, queries, exact, options["ef_search"], index_mb)
+                    # float32 không cần re-rank
+                    for candidates in options["rerank_candidates"] if quantization != "none" else []:
+                        rerank_sql = (
+                            f"SELECT id FROM ("
+                            f"SELECT id, embedding FROM {BENCH_TABLE} "
+                            f"ORDER BY {approx_distance_sql(quantization, self.dim, query='%s::vector')} "
+                            f"LIMIT {int(candidates)}) a "
+                            f"ORDER BY embedding <=> %s::vector LIMIT {int(self.k)}"
+                        )
+                        self._measure(
+                            size, quantization, f"re-rank {candidates}", rerank_sql, queries, exact,
+                            max(options["ef_search"], candidates), index_mb, params_per_query=2,
+                        )
+                    with connection.cursor() as cursor:
+                        cursor.execute(f"DROP INDEX IF EXISTS {name}")
+        finally:
+            if not options["keep"]:
+                with connection.cursor() as cursor:
+                    cursor.execute(f"DROP TABLE IF EXISTS {BENCH_TABLE}")
+
+    def _size_mb(self, expression, relation):
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT {expression}", [relation])
+            return cursor.fetchone()[0] / (1024 * 1024)
+
+    def _build_quantized_index(self, quantization, rows):
+        expression, opclass = quantized_expression(quantization, self.dim)
+        name = index_name("hnsw", BENCH_TABLE, quantization=quantization)
+        started = time.perf_counter()
+        with connection.cursor() as cursor:
+            cursor.execute(create_index_sql(
+                "hnsw", table=BENCH_TABLE, opclass=opclass, rows=rows, expression=expression, name=name,
+            ))
+        return name, time.perf_counter() - started
+
+    def _measure(self, size, quantization, mode, sql, queries, exact, ef_search, index_mb, params_per_query=1):
+        results, latencies = [], []
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute("SELECT set_config('hnsw.ef_search', %s, true)", [str(ef_search)])
+            for q in queries:
+                literal = "[" + ",".join("%.6f" % x for x in q) + "]"
+                started = time.perf_counter()
+                cursor.execute(sql, [literal] * params_per_query)
+                rows = cursor.fetchall()
+                latencies.append((time.perf_counter() - started) * 1000)
+                results.append([r[0] for r in rows])
+        recall = np.mean([len(set(a) & set(e)) / self.k for a, e in zip(results, exact)])
+        self._report_quantized(size, quantization, mode, recall, latencies, index_mb)
+
+    def _report_quantized(self, size, quantization, mode, recall, latencies, index_mb):
+        p50, p99 = np.percentile(latencies, [50, 99])
+        index = f"index {index_mb:>7.1f} MB" if index_mb is not None else " " * 16
+        self.stdout.write(
+            f"{size:>9} rows | {quantization:<8} {mode:<14} | {index} | recall@{self.k}={recall:.3f} | "
+            f"p50={p50:.2f}ms p99={p99:.2f}ms"
+        )
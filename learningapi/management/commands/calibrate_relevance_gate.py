@@ -0,0 +1,68 @@
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from learningapi.models import AnswerCacheEntry
+from learningapi.services.embedding_models import serving_model
+from learningapi.services.rag_service import retrieve_chunks
+from learningapi.services.relevance_gate import relevance_score
+
+
+def answered_from_web(sources) -> bool:
+    # web_sources() trả về list link hoặc ["Internet"], câu trả lời từ tài liệu có sources là tiêu đề tài liệu
+    return not sources or all(str(s).startswith(("http://", "https://")) or s == "Internet" for s in sources)
+
+
+class Command(BaseCommand):
+    help = (
+        "Tính RELEVANCE_GATE_MAX_DISTANCE từ các câu đã trả lời (answer cache): chạy lại retrieval cho từng câu hỏi, "
+        "so điểm relevance của câu trả lời từ tài liệu với câu phải tìm trên internet rồi đề xuất ngưỡng."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--limit", type=int, default=2000, help="Số câu hỏi gần nhất dùng để calibrate")
+        parser.add_argument("--course", type=int, default=None)
+        parser.add_argument(
+            "--max-miss-rate", type=float, default=0.02,
+            help="Tỉ lệ tối đa câu trả lời được từ tài liệu nhưng bị gate gửi sang internet",
+        )
+        parser.add_argument("--top-k", type=int, default=None, help="Mặc định: settings.RELEVANCE_GATE_TOP_K")
+
+    def handle(self, *args, **options):
+        model_name = serving_model()
+        qs = AnswerCacheEntry.objects.filter(model_name=model_name or settings.EMBEDDING_MODEL).select_related("course")
+        if options["course"]:
+            qs = qs.filter(course_id=options["course"])
+        entries = list(qs.order_by("-created_at")[:options["limit"]])
+        if not entries:
+            raise CommandError("Chưa có câu trả lời nào trong answer cache (ANSWER_CACHE_ENABLED) để calibrate.")
+
+        docs, web = [], []
+        for entry in entries:
+            candidates = retrieve_chunks(entry.course, np.asarray(entry.embedding, dtype=np.float32), entry.question,
+                                         model_name=model_name)
+            score = relevance_score(candidates, options["top_k"])
+            if score is None:
+                continue
+            (web if answered_from_web(entry.sources) else docs).append(score)
+        if not docs:
+            raise CommandError("Không có câu trả lời nào từ tài liệu, chưa đủ dữ liệu để chọn ngưỡng.")
+
+        docs, web = np.asarray(docs), np.asarray(web)
+        # Ngưỡng nhỏ nhất mà chỉ tối đa max_miss_rate câu trả lời từ tài liệu bị gửi sang internet
+        threshold = float(np.quantile(docs, 1 - options["max_miss_rate"]))
+        skipped = float((web > threshold).mean()) if len(web) else 0.0
+        self.stdout.write(
+            f"docs: {len(docs)} câu, score p50={np.median(docs):.4f} p95={np.quantile(docs, 0.95):.4f}\n"
+            f"web:  {len(web)} câu"
+            + (f", score p5={np.quantile(web, 0.05):.4f} p50={np.median(web):.4f}" if len(web) else "")
+        )
+        self.stdout.write(
+            f"Ngưỡng hiện tại {settings.RELEVANCE_GATE_MAX_DISTANCE}: "
+            f"{(docs > settings.RELEVANCE_GATE_MAX_DISTANCE).mean():.1%} câu từ tài liệu bị gửi sang internet, "
+            f"{(web > settings.RELEVANCE_GATE_MAX_DISTANCE).mean() if len(web) else 0:.1%} câu internet bỏ được lần gọi thứ 2"
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"RELEVANCE_GATE_MAX_DISTANCE={threshold:.4f} "
+            f"(miss {(docs > threshold).mean():.1%}, {skipped:.1%} câu internet chỉ cần 1 lần gọi LLM)"
+        ))
@@ -0,0 +1,60 @@
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from learningapi.services.embedding_backends import BACKENDS, create_backend
+
+SAMPLE_TEXTS = [
+    "Khoá học này nói về điều gì?",
+    "Giải thích thuật toán gradient descent và vai trò của learning rate.",
+    "Hàm softmax chuyển vector logits thành phân phối xác suất.",
+    "Trong Django, QuerySet được evaluate khi nào?",
+    "def split_into_chunks(text, max_tokens): return list(iter_chunks([text], max_tokens))",
+    "Chương 3: cấu trúc dữ liệu cây nhị phân, duyệt theo thứ tự trước, giữa và sau.",
+    "What is the difference between supervised and unsupervised learning?",
+    "Bài tập: chứng minh định lý Pythagore bằng phương pháp diện tích.",
+    "Vector embedding của câu hỏi được so sánh với embedding của từng đoạn tài liệu bằng cosine similarity.",
+    "ok",
+]
+
+
+class Command(BaseCommand):
+    help = (
+        "So sánh embedding của cùng 1 model giữa 2 backend (mặc định sentence-transformers vs onnx): "
+        "cosine similarity từng câu phải >= ngưỡng để có thể đổi backend mà không cần encode lại tài liệu."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--model", default=None, help="Mặc định: settings.EMBEDDING_MODEL")
+        parser.add_argument("--reference", choices=BACKENDS, default="sentence-transformers")
+        parser.add_argument("--candidate", choices=BACKENDS, default="onnx")
+        parser.add_argument("--quantize", action="store_true", help="Backend onnx dùng trọng số int8")
+        parser.add_argument("--texts-file", default=None, help="File text, mỗi dòng 1 câu (mặc định: câu mẫu)")
+        parser.add_argument("--threshold", type=float, default=0.99)
+
+    def handle(self, *args, **options):
+        model_name = options["model"] or settings.EMBEDDING_MODEL
+        texts = SAMPLE_TEXTS
+        if options["texts_file"]:
+            with open(options["texts_file"], encoding="utf-8") as f:
+                texts = [line.strip() for line in f if line.strip()]
+        reference = create_backend(model_name, options["reference"], quantize=options["quantize"]).encode(texts)
+        candidate = create_backend(model_name, options["candidate"], quantize=options["quantize"]).encode(texts)
+        reference = np.asarray(reference, dtype=np.float32)
+        candidate = np.asarray(candidate, dtype=np.float32)
+        if reference.shape != candidate.shape:
+            raise CommandError(f"Khác số chiều: {reference.shape} vs {candidate.shape}")
+
+        cos = (reference * candidate).sum(axis=1) / (
+            np.linalg.norm(reference, axis=1) * np.linalg.norm(candidate, axis=1)
+        )
+        for text, value in sorted(zip(texts, cos), key=lambda x: x[1])[:5]:
+            self.stdout.write(f"  {value:.5f}  {text[:70]}")
+        summary = (
+            f"{model_name}: {options['reference']} vs {options['candidate']}"
+            f"{' (int8)' if options['quantize'] else ''} | {len(texts)} câu | "
+            f"cosine min={cos.min():.5f} mean={cos.mean():.5f}"
+        )
+        if cos.min() < options["threshold"]:
+            raise CommandError(f"{summary} < {options['threshold']}")
+        self.stdout.write(self.style.SUCCESS(summary))
@@ -0,0 +1,41 @@
+import asyncio
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from learningapi.services.embedding_registry import get_model
+from learningapi.services.embedding_server import EmbeddingServer, parse_url
+
+
+class Command(BaseCommand):
+    help = (
+        "Chạy embedding server dùng chung cho các worker trên cùng máy (Unix socket hoặc localhost): "
+        "model chỉ load 1 lần, các request đồng thời được gom thành micro-batch. "
+        "Worker dùng server khi đặt EMBEDDING_SERVER_URL giống --url."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--url", default=None, help="unix:///path.sock hoặc tcp://127.0.0.1:8765 (mặc định: EMBEDDING_SERVER_URL)")
+        parser.add_argument("--max-batch", type=int, default=None, help="Số câu tối đa mỗi batch (mặc định: EMBEDDING_SERVER_MAX_BATCH)")
+        parser.add_argument("--max-wait-ms", type=float, default=None, help="Thời gian gom batch (mặc định: EMBEDDING_SERVER_MAX_WAIT_MS)")
+        parser.add_argument("--models", nargs="+", default=None, help="Model load sẵn (mặc định: EMBEDDING_PRELOAD_MODELS)")
+
+    def handle(self, *args, **options):
+        url = options["url"] or settings.EMBEDDING_SERVER_URL
+        if not url:
+            raise CommandError("Cần --url hoặc EMBEDDING_SERVER_URL")
+        try:
+            parse_url(url)
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        for name in options["models"] or settings.EMBEDDING_PRELOAD_MODELS:
+            handle = get_model(name)
+            handle.encode(["warm up"])
+            self.stdout.write(f"Loaded {name} ({handle.dimensions} dims)")
+
+        server = EmbeddingServer(url, max_batch=options["max_batch"], max_wait_ms=options["max_wait_ms"])
+        try:
+            asyncio.run(server.serve())
+        except KeyboardInterrupt:
+            self.stdout.write("Embedding server stopped")
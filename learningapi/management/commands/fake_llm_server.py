@@ -0,0 +1,120 @@
+import json
+import random
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from django.core.management.base import BaseCommand
+
+DEFAULT_ANSWER = (
+    "Đây là câu trả lời giả lập để load test AI tutor. Nội dung khoá học được tóm tắt ngắn gọn ở đây. "
+    "Nguồn: tài liệu khoá học."
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Server giả lập API tương thích OpenAI (/v1/chat/completions, có stream) để load test luồng chat không cần mạng. "
+        "Dùng với LLM_PROVIDER=openai LLM_BASE_URL=http://127.0.0.1:<port>/v1."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--host", default="127.0.0.1")
+        parser.add_argument("--port", type=int, default=8089)
+        parser.add_argument("--latency-ms", type=float, default=800, help="Thời gian chờ trước token đầu tiên")
+        parser.add_argument("--jitter-ms", type=float, default=200)
+        parser.add_argument("--tokens-per-sec", type=float, default=50, help="Tốc độ sinh token khi stream")
+        parser.add_argument("--error-rate", type=float, default=0.0, help="Tỉ lệ request trả về 503 (thử retry / breaker)")
+        parser.add_argument("--answer", default=DEFAULT_ANSWER)
+
+    def handle(self, *args, **options):
+        handler = type("FakeLLMHandler", (FakeLLMHandler,), {"options": options})
+        server = ThreadingHTTPServer((options["host"], options["port"]), handler)
+        server.daemon_threads = True
+        self.stdout.write(f"Fake LLM listening on http://{options['host']}:{options['port']}/v1")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            server.server_close()
+
+
+class FakeLLMHandler(BaseHTTPRequestHandler):
+    options = {}
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        # Không in mỗi request khi load test
+        pass
+
+    def _json(self, status, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/models"):
+            self._json(200, {"object": "list", "data": [{"id": "fake-llm", "object": "model", "owned_by": "local"}]})
+        else:
+            self._json(404, {"error": {"message": "Not found"}})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            request = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            self._json(400, {"error": {"message": "Invalid JSON"}})
+            return
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._json(404, {"error": {"message": "Not found"}})
+            return
+
+        opts = self.options
+        time.sleep(max(0.0, opts["latency_ms"] + random.uniform(-1, 1) * opts["jitter_ms"]) / 1000)
+        if random.random() < opts["error_rate"]:
+            self._json(503, {"error": {"message": "Simulated overload", "type": "server_error"}})
+            return
+
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+        model = request.get("model") or "fake-llm"
+        if request.get("stream"):
+            self._stream(completion_id, model, opts["answer"], opts["tokens_per_sec"])
+            return
+        self._json(200, {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": opts["answer"]}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": 0, "completion_tokens": len(opts["answer"].split()), "total_tokens": 0},
+        })
+
+    def _stream(self, completion_id, model, answer, tokens_per_sec):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+        def send(delta, finish_reason=None):
+            chunk = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+            }
+            self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+
+        send({"role": "assistant", "content": ""})
+        for word in answer.split(" "):
+            send({"content": word + " "})
+            if tokens_per_sec > 0:
+                time.sleep(1 / tokens_per_sec)
+        send({}, finish_reason="stop")
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
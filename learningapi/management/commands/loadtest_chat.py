@@ -0,0 +1,88 @@
+import asyncio
+import time
+
+import httpx
+import numpy as np
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = (
+        "Load test AI tutor: bắn nhiều request chat đồng thời và đo độ trễ của /health/ "
+        "cùng lúc, để so sánh chat sync (WSGI) với chat async (ASGI)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--base-url", default="http://localhost:8000")
+        parser.add_argument("--token", required=True, help="JWT access token của 1 học viên có quyền vào khoá học")
+        parser.add_argument("--course", type=int, required=True)
+        parser.add_argument("--mode", choices=["sync", "async", "both"], default="both",
+                            help="sync: /chat/, async: /chat/async/")
+        parser.add_argument("--concurrency", type=int, default=100)
+        parser.add_argument("--requests", type=int, default=200)
+        parser.add_argument("--message", default="Khoá học này nói về nội dung gì?")
+        parser.add_argument("--timeout", type=float, default=180)
+
+    def handle(self, *args, **options):
+        modes = ["sync", "async"] if options["mode"] == "both" else [options["mode"]]
+        for mode in modes:
+            result = asyncio.run(self._run(mode, options))
+            self._report(mode, result)
+
+    async def _run(self, mode, options):
+        path = f"/api/courses/{options['course']}/chat/" + ("async/" if mode == "async" else "")
+        headers = {"Authorization": f"Bearer {options['token']}"}
+        limits = httpx.Limits(max_connections=options["concurrency"] + 10)
+        semaphore = asyncio.Semaphore(options["concurrency"])
+        chat_latencies, health_latencies, errors = [], [], 0
+        finished = asyncio.Event()
+
+        async with httpx.AsyncClient(base_url=options["base_url"], timeout=options["timeout"], limits=limits) as client:
+            async def one_chat():
+                nonlocal errors
+                async with semaphore:
+                    started = time.perf_counter()
+                    try:
+                        resp = await client.post(path, json={"message": options["message"]}, headers=headers)
+                        if resp.status_code != 200:
+                            errors += 1
+                    except httpx.HTTPError:
+                        errors += 1
+                    chat_latencies.append(time.perf_counter() - started)
+
+            async def probe_health():
+                # Đo endpoint nhẹ trong lúc chat đang chạy: nếu worker bị chặn thì latency này tăng vọt
+                while not finished.is_set():
+                    started = time.perf_counter()
+                    try:
+                        await client.get("/health/")
+                        health_latencies.append(time.perf_counter() - started)
+                    except httpx.HTTPError:
+                        health_latencies.append(options["timeout"])
+                    await asyncio.sleep(0.5)
+
+            started = time.perf_counter()
+            prober = asyncio.create_task(probe_health())
+            await asyncio.gather(*(one_chat() for _ in range(options["requests"])))
+            finished.set()
+            await prober
+            wall = time.perf_counter() - started
+
+        return {
+            "wall": wall,
+            "requests": options["requests"],
+            "errors": errors,
+            "chat": chat_latencies,
+            "health": health_latencies,
+        }
+
+    def _report(self, mode, result):
+        chat = np.array(result["chat"]) * 1000
+        health = np.array(result["health"] or [0]) * 1000
+        self.stdout.write(
+            f"[{mode}] {result['requests']} chat requests in {result['wall']:.1f}s "
+            f"({result['requests'] / result['wall']:.1f} req/s, {result['errors']} errors)\n"
+            f"  chat   p50={np.percentile(chat, 50):.0f}ms p99={np.percentile(chat, 99):.0f}ms\n"
+            f"  health p50={np.percentile(health, 50):.0f}ms p99={np.percentile(health, 99):.0f}ms "
+            f"max={health.max():.0f}ms"
+        )
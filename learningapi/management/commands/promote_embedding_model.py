@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from learningapi.services import embedding_models
+
+
+class Command(BaseCommand):
+    help = (
+        "Bước cuối khi đổi embedding model: chép embedding của model mới (đã backfill xong) từ ChunkEmbedding vào cột "
+        "Chunk.embedding, build lại index ANN và ghi nhận model mới là model của cột, sau đó xoá embedding của nó "
+        "trong ChunkEmbedding. Từ đó ingest chỉ encode bằng 1 model."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--model", default=None, help="Tên model (mặc định: settings.EMBEDDING_ACTIVE_MODEL)")
+        parser.add_argument(
+            "--resize", action="store_true",
+            help="Model mới khác số chiều: thay cột Chunk.embedding bằng cột vector(n) mới (bảng Chunk bị khoá lúc chép)",
+        )
+        parser.add_argument(
+            "--wait", type=int, default=embedding_models.SERVING_CACHE_SECONDS,
+            help="Số giây chờ mọi process thấy model mới của cột trước khi xoá ChunkEmbedding",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            stats = embedding_models.promote(options["model"], resize=options["resize"], wait_seconds=options["wait"])
+        except ValueError as e:
+            raise CommandError(str(e))
+        self.stdout.write(self.style.SUCCESS(
+            f"{stats['model']} ({stats['dimensions']} chiều) đã thay {stats['previous_model']} trong Chunk.embedding: "
+            f"{stats['chunks']} chunks, xoá {stats['retired_embeddings']} dòng ChunkEmbedding"
+        ))
+        self.stdout.write(
+            f"Tiếp theo: đặt EMBEDDING_MODEL={stats['model']} và bỏ EMBEDDING_ACTIVE_MODEL (hoặc đặt cùng giá trị)."
+        )
+        if options["resize"]:
+            self.stdout.write(
+                f"Đổi dimensions={stats['dimensions']} của Chunk.embedding và IngestionChunk.embedding trong models.py, "
+                "tạo migration (makemigrations) và deploy: cột trong DB đã đúng kiểu nên migration không đổi dữ liệu. "
+                "Trước đó search và `manage.py vector_index` vẫn dùng đúng số chiều (đọc từ DB)."
+            )
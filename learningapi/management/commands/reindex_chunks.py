@@ -0,0 +1,199 @@
+import json
+import multiprocessing
+import os
+import threading
+import time
+import traceback
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.db.models import Q
+
+from learningapi.models import Document
+from learningapi.services import ingestion_pipeline
+from learningapi.services.ingestion_coordinator import DocumentBusy, start_reindex
+
+DEFAULT_CHECKPOINT = ".reindex_chunks.json"
+
+# Mỗi tài liệu là 1 IngestionJob loại "reindex": claim tài liệu như job của coordinator/pipeline nên không ghi chunk
+# xen kẽ với chúng (tài liệu đang ingest → lỗi DocumentBusy, chạy lại sau với --resume --retry-failed).
+# - mặc định: encode lại từ Chunk.text đã lưu, cập nhật embedding tại chỗ trong 1 transaction / tài liệu
+#   (chỉ cần Postgres + pgvector và embedding model, không tải lại file/URL/YouTube)
+# - --rechunk: tải lại nguồn và chunk lại (đổi CHUNK_MAX_TOKENS / CHUNK_OVERLAP_TOKENS) qua các stage
+#   extract → embed → persist của ingestion_pipeline; chunk mới được ghi cùng lúc với việc xoá chunk cũ trong 1 transaction
+
+# Cấu hình của process con (gán trong _init_worker)
+_worker_options = {}
+
+
+class RateLimiter:
+    """
+    Token bucket giới hạn số chunk ghi vào DB mỗi giây trong 1 process.
+    """
+
+    def __init__(self, rate: float):
+        self.rate = rate
+        self.allowance = rate
+        self.last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def __call__(self, n: int):
+        if self.rate <= 0:
+            return
+        with self._lock:
+            now = time.monotonic()
+            self.allowance = min(self.rate, self.allowance + (now - self.last) * self.rate)
+            self.last = now
+            self.allowance -= n
+            wait = -self.allowance / self.rate if self.allowance < 0 else 0
+        if wait:
+            time.sleep(wait)
+
+
+def _init_worker(options):
+    _worker_options.update(options)
+    # Mỗi process con tự mở kết nối DB, không dùng chung socket với process cha
+    connections.close_all()
+    # Chia đều giới hạn ghi cho các worker
+    _worker_options["throttle"] = RateLimiter(options["max_chunks_per_sec"] / options["workers"])
+
+
+def _reindex_one(document_id):
+    """
+    Chạy trong process con: reindex 1 tài liệu. Trả về (document_id, stats hoặc None, lỗi hoặc None).
+    """
+    try:
+        doc = Document.objects.select_related("course").filter(id=document_id).first()
+        if doc is None:
+            return document_id, None, "Document not found"
+        try:
+            job = start_reindex(doc)
+        except DocumentBusy as e:
+            return document_id, None, str(e)
+        try:
+            if _worker_options["rechunk"]:
+                _rechunk(job)
+            else:
+                ingestion_pipeline.reembed_in_place(job, throttle=_worker_options["throttle"])
+        except Exception as e:
+            ingestion_pipeline.mark_failed(job.id, str(e))
+            raise
+        job.refresh_from_db()
+        if job.state != "succeeded":
+            return document_id, None, job.error or f"Job {job.id} {job.state}"
+        return document_id, job.stats, None
+    except Exception as e:
+        print(f"[Reindex] Document {document_id} failed: {e}\n{traceback.format_exc()}")
+        return document_id, None, str(e)
+
+
+def _rechunk(job):
+    for stage in (ingestion_pipeline.run_extract, ingestion_pipeline.run_embed, ingestion_pipeline.run_persist):
+        if stage(job.id) is None:
+            break
+    job.refresh_from_db()
+    # persist ghi cả tài liệu trong 1 transaction: giới hạn tốc độ ghi tính sau mỗi tài liệu
+    _worker_options["throttle"](job.stats.get("created", 0))
+
+
+class Command(BaseCommand):
+    help = (
+        "Encode lại (hoặc chunk lại với --rechunk) toàn bộ hoặc 1 phần tài liệu, song song nhiều process, "
+        "có checkpoint để chạy tiếp sau khi bị dừng. Mặc định dùng Chunk.text đã lưu, không tải lại nguồn."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--course", type=int, action="append", default=[], help="Chỉ tài liệu của khoá học này (lặp lại được)")
+        parser.add_argument("--document", type=int, action="append", default=[], help="Chỉ tài liệu này (lặp lại được)")
+        parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 2) // 2))
+        parser.add_argument("--rechunk", action="store_true",
+                            help="Tải lại file/URL/YouTube và chunk lại (khi đổi kích thước chunk); "
+                                 "chunk không đổi nội dung giữ embedding cũ")
+        parser.add_argument("--max-chunks-per-sec", type=float, default=0,
+                            help="Giới hạn tổng số chunk ghi vào DB mỗi giây (0: không giới hạn)")
+        parser.add_argument("--checkpoint", default=DEFAULT_CHECKPOINT, help="File lưu tiến độ")
+        parser.add_argument("--resume", action="store_true", help="Bỏ qua các tài liệu đã xong trong checkpoint")
+        parser.add_argument("--retry-failed", action="store_true", help="Khi --resume: chạy lại cả tài liệu bị lỗi")
+
+    def handle(self, *args, **options):
+        if options["workers"] < 1:
+            raise CommandError("--workers phải >= 1")
+        filters = {"course": sorted(options["course"]), "document": sorted(options["document"])}
+
+        qs = Document.objects.filter(Q(file__isnull=False) & ~Q(file="") | Q(url__isnull=False) & ~Q(url=""))
+        if filters["course"]:
+            qs = qs.filter(course_id__in=filters["course"])
+        if filters["document"]:
+            qs = qs.filter(id__in=filters["document"])
+        document_ids = list(qs.order_by("id").values_list("id", flat=True))
+
+        checkpoint = self.load_checkpoint(options, filters)
+        skip = set(checkpoint["done"])
+        if not options["retry_failed"]:
+            skip |= set(int(k) for k in checkpoint["failed"])
+        todo = [doc_id for doc_id in document_ids if doc_id not in skip]
+        self.stdout.write(
+            f"{len(document_ids)} tài liệu, {len(document_ids) - len(todo)} đã xử lý (checkpoint), "
+            f"còn {len(todo)} — {options['workers']} worker"
+        )
+        if not todo:
+            return
+
+        # Đóng kết nối trước khi fork để process con không dùng chung socket DB
+        connections.close_all()
+        worker_options = {
+            "rechunk": options["rechunk"],
+            "max_chunks_per_sec": options["max_chunks_per_sec"],
+            "workers": options["workers"],
+        }
+        ctx = multiprocessing.get_context("fork")
+        started = time.perf_counter()
+        done_docs, total_chunks, failed = 0, 0, 0
+        with ctx.Pool(options["workers"], initializer=_init_worker, initargs=(worker_options,)) as pool:
+            for doc_id, stats, error in pool.imap_unordered(_reindex_one, todo):
+                done_docs += 1
+                if error:
+                    failed += 1
+                    checkpoint["failed"][str(doc_id)] = error
+                else:
+                    total_chunks += stats["chunks"]
+                    checkpoint["done"].append(doc_id)
+                    checkpoint["failed"].pop(str(doc_id), None)
+                self.save_checkpoint(options["checkpoint"], checkpoint)
+
+                elapsed = time.perf_counter() - started
+                docs_per_sec = done_docs / elapsed
+                eta = (len(todo) - done_docs) / docs_per_sec if docs_per_sec else 0
+                if error:
+                    status = f"lỗi: {error}"
+                elif "reembedded" in stats:
+                    status = f"{stats['chunks']} chunks (encode lại tại chỗ)"
+                else:
+                    status = f"{stats['chunks']} chunks (+{stats.get('created', 0)} / -{stats.get('deleted', 0)})"
+                self.stdout.write(
+                    f"[{done_docs}/{len(todo)}] doc {doc_id}: {status} | "
+                    f"{docs_per_sec:.2f} docs/s, {total_chunks / elapsed:.1f} chunks/s, ETA {eta:.0f}s"
+                )
+
+        summary = f"Xong {done_docs - failed}/{len(todo)} tài liệu, {total_chunks} chunks trong {time.perf_counter() - started:.1f}s"
+        if failed:
+            self.stdout.write(self.style.WARNING(f"{summary}; {failed} lỗi (chạy lại với --resume --retry-failed)"))
+        else:
+            self.stdout.write(self.style.SUCCESS(summary))
+
+    def load_checkpoint(self, options, filters):
+        path = options["checkpoint"]
+        if options["resume"] and os.path.exists(path):
+            with open(path) as f:
+                checkpoint = json.load(f)
+            if checkpoint.get("filters") != filters or checkpoint.get("rechunk") != options["rechunk"]:
+                raise CommandError(f"Checkpoint {path} được tạo với tham số khác: {checkpoint.get('filters')}")
+            return checkpoint
+        return {"filters": filters, "rechunk": options["rechunk"], "done": [], "failed": {}}
+
+    def save_checkpoint(self, path, checkpoint):
+        # Ghi file tạm rồi rename để checkpoint không bị hỏng nếu process chết giữa chừng
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(checkpoint, f)
+        os.replace(tmp_path, path)
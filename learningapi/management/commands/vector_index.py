@@ -0,0 +1,38 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from learningapi.services.vector_index import INDEX_TYPES, QUANTIZATIONS, ensure_vector_index
+
+
+class Command(BaseCommand):
+    help = "Tạo / đổi / build lại index ANN (HNSW hoặc IVFFlat) cho Chunk.embedding."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--type", choices=INDEX_TYPES + ("none",), default=None,
+            help="Loại index (mặc định: settings.VECTOR_INDEX_TYPE)",
+        )
+        parser.add_argument(
+            "--quantization", choices=QUANTIZATIONS, default=None,
+            help="Build index trên embedding lượng tử hoá (mặc định: settings.VECTOR_QUANTIZATION)",
+        )
+        parser.add_argument(
+            "--rebuild", action="store_true",
+            help="Xoá và build lại index (nên chạy cho IVFFlat sau khi dữ liệu thay đổi nhiều)",
+        )
+
+    def handle(self, *args, **options):
+        kind = options["type"] or settings.VECTOR_INDEX_TYPE
+        if kind != settings.VECTOR_INDEX_TYPE:
+            self.stdout.write(self.style.WARNING(
+                f"VECTOR_INDEX_TYPE={settings.VECTOR_INDEX_TYPE} nhưng đang build '{kind}'. "
+                "Hãy cập nhật biến môi trường để tham số query khớp với index."
+            ))
+        quantization = options["quantization"] or settings.VECTOR_QUANTIZATION
+        if quantization != settings.VECTOR_QUANTIZATION:
+            self.stdout.write(self.style.WARNING(
+                f"VECTOR_QUANTIZATION={settings.VECTOR_QUANTIZATION} nhưng đang build '{quantization}'. "
+                "Query chỉ dùng được index khi biến môi trường khớp."
+            ))
+        ensure_vector_index(kind, rebuild=options["rebuild"], quantization=quantization)
+        self.stdout.write(self.style.SUCCESS(f"Vector index: {kind} ({quantization})"))
@@ -0,0 +1,22 @@
+# Index ANN mặc định (HNSW, cosine) cho Chunk.embedding.
+# DDL viết sẵn trong migration để schema không phụ thuộc biến môi trường hay code service lúc migrate;
+# đổi loại index (IVFFlat, lượng tử hoá, "none") sau này bằng `python manage.py vector_index` (không cần migrate lại).
+
+from django.db import migrations
+from pgvector.django import VectorExtension
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('learningapi', '0001_initial'),
+    ]
+
+    operations = [
+        VectorExtension(),
+        migrations.RunSQL(
+            "CREATE INDEX IF NOT EXISTS learningapi_chunk_embedding_hnsw ON learningapi_chunk "
+            "USING hnsw ((embedding) vector_cosine_ops) WITH (m = 16, ef_construction = 64)",
+            "DROP INDEX IF EXISTS learningapi_chunk_embedding_hnsw",
+        ),
+    ]
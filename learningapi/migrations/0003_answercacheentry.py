@@ -0,0 +1,27 @@
+import django.db.models.deletion
+import pgvector.django.vector
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('learningapi', '0002_chunk_vector_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AnswerCacheEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('question', models.TextField()),
+                ('embedding', pgvector.django.vector.VectorField(dimensions=384)),
+                ('answer', models.TextField()),
+                ('sources', models.JSONField(blank=True, default=list)),
+                ('generation_ms', models.PositiveIntegerField(default=0)),
+                ('hit_count', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('course', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='answer_cache_entries', to='learningapi.course')),
+            ],
+        ),
+    ]
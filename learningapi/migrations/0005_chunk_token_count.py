@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('learningapi', '0004_chunk_search_vector'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chunk',
+            name='token_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
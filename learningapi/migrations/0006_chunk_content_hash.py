@@ -0,0 +1,22 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('learningapi', '0005_chunk_token_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chunk',
+            name='content_hash',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=64),
+        ),
+        # Tính hash cho chunk đã có (giống hashlib.sha256(text.encode("utf-8")).hexdigest())
+        # để lần ingest lại đầu tiên cũng dùng lại được embedding cũ
+        migrations.RunSQL(
+            "UPDATE learningapi_chunk SET content_hash = encode(sha256(convert_to(text, 'UTF8')), 'hex')",
+            migrations.RunSQL.noop,
+        ),
+    ]
@@ -0,0 +1,34 @@
+import django.db.models.deletion
+import pgvector.django.vector
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('learningapi', '0007_ingestionjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ingestionjob',
+            name='stage',
+            field=models.CharField(choices=[('queued', 'Queued'), ('extracted', 'Extracted'), ('embedded', 'Embedded'), ('persisted', 'Persisted')], default='queued', max_length=20),
+        ),
+        migrations.CreateModel(
+            name='IngestionChunk',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('position', models.PositiveIntegerField()),
+                ('text', models.TextField(blank=True, default='')),
+                ('content_hash', models.CharField(max_length=64)),
+                ('token_count', models.PositiveIntegerField(default=0)),
+                ('embedding', pgvector.django.vector.VectorField(blank=True, dimensions=384, null=True)),
+                ('reused_chunk_id', models.BigIntegerField(blank=True, null=True)),
+                ('job', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='staged_chunks', to='learningapi.ingestionjob')),
+            ],
+            options={
+                'unique_together': {('job', 'position')},
+            },
+        ),
+    ]
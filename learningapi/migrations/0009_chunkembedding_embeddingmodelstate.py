@@ -0,0 +1,49 @@
+import django.db.models.deletion
+import pgvector.django.vector
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('learningapi', '0008_ingestionjob_stage_ingestionchunk'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChunkEmbedding',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model_name', models.CharField(max_length=200)),
+                ('embedding', pgvector.django.vector.VectorField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('chunk', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='embeddings', to='learningapi.chunk')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['model_name', 'chunk'], name='chunkembedding_model_chunk')],
+                'unique_together': {('chunk', 'model_name')},
+            },
+        ),
+        migrations.CreateModel(
+            name='EmbeddingModelState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=200, unique=True)),
+                ('dimensions', models.PositiveIntegerField()),
+                ('embedded_chunks', models.PositiveIntegerField(default=0)),
+                ('total_chunks', models.PositiveIntegerField(default=0)),
+                ('ready_at', models.DateTimeField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='answercacheentry',
+            name='model_name',
+            field=models.CharField(blank=True, default='', max_length=200),
+        ),
+        migrations.AlterField(
+            model_name='answercacheentry',
+            name='embedding',
+            field=pgvector.django.vector.VectorField(),
+        ),
+    ]
@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('learningapi', '0010_conversationstate'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ingestionjob',
+            name='content_fingerprint',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+    ]
@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('learningapi', '0011_ingestionjob_content_fingerprint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='embeddingmodelstate',
+            name='in_column',
+            field=models.BooleanField(default=False),
+        ),
+    ]
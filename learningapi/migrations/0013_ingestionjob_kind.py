@@ -0,0 +1,24 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('learningapi', '0012_embeddingmodelstate_in_column'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ingestionjob',
+            name='kind',
+            field=models.CharField(choices=[('ingest', 'Ingest'), ('reindex', 'Reindex')], default='ingest', max_length=20),
+        ),
+        migrations.RemoveConstraint(
+            model_name='ingestionjob',
+            name='unique_active_ingestion_job',
+        ),
+        migrations.AddConstraint(
+            model_name='ingestionjob',
+            constraint=models.UniqueConstraint(condition=models.Q(('state__in', ['pending', 'running'])), fields=('document', 'version', 'kind'), name='unique_active_ingestion_job'),
+        ),
+    ]
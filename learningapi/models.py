@@ -1,4 +1,7 @@
 from django.db import models
+from django.db.models import Case, Count, OuterRef, Subquery, Value, When
+from django.db.models.functions import Cast, Coalesce
+from django.db.models.lookups import GreaterThanOrEqual
 from cloudinary.models import CloudinaryField
 from cloudinary.uploader import upload
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager, PermissionsMixin
@@ -8,6 +11,7 @@ from django.core.validators import MinValueValidator, MaxValueValidator
 import uuid
 
 from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVector, SearchVectorField
 from pgvector.django import VectorField
 
 # User Manager
@@ -82,12 +86,8 @@ class Course(models.Model):
 	created_at = models.DateTimeField(auto_now_add=True)
 	updated_at = models.DateTimeField(auto_now=True)
 
-		
-	#ghi đè update đễ mỗi lần update cập nhật lại tất cả courseprogress
-	def save(self, *args, **kwargs):
-		super().save(*args, **kwargs)
-		CourseProgress.update_all_progress(self)
-
+	# Progress của learner chỉ phụ thuộc tập tài liệu của khoá học: được tính lại trong signals khi thêm / xoá Document,
+	# không tính lại mỗi lần Course.save (đổi is_active, giá... không ảnh hưởng progress)
 
 	def __str__(self):
 		return self.title
@@ -128,10 +128,48 @@ class CourseProgress(models.Model):
 
 	@classmethod
 	def update_all_progress(cls, course):
-		learners = cls.objects.filter(course=course).values_list('learner', flat=True)
-		for learner_id in learners:
-			learner = User.objects.get(id=learner_id)
-			cls.update_progress_for_user(learner, course)
+		"""
+		Tính lại progress của mọi learner trong khoá học bằng 1 câu UPDATE (subquery đếm tài liệu đã hoàn thành),
+		thay vì get + count + save cho từng learner. Gọi khi tập tài liệu của khoá học thay đổi (xem signals).
+		course: Course hoặc id. Learner vừa chuyển sang hoàn thành nhận notification như update_progress_for_user.
+		"""
+		course_id = getattr(course, 'pk', course)
+		progresses = cls.objects.filter(course_id=course_id)
+		total_docs = Document.objects.filter(course_id=course_id).count()
+		if total_docs == 0:
+			return progresses.update(progress=0, is_completed=False, updated_at=timezone.now())
+
+		completed_docs = Coalesce(Subquery(
+			DocumentCompletion.objects.filter(user=OuterRef('learner_id'), document__course_id=course_id, is_complete=True)
+			.values('user').annotate(n=Count('id')).values('n')[:1]
+		), 0)
+		done = GreaterThanOrEqual(completed_docs, total_docs)
+		newly_completed = list(progresses.filter(done, is_completed=False).values_list('learner_id', flat=True))
+		updated = progresses.update(
+			# numeric(5, 2) để làm tròn 2 chữ số như update_progress_for_user
+			progress=Cast(completed_docs * Value(100.0) / Value(total_docs), models.DecimalField(max_digits=5, decimal_places=2)),
+			is_completed=Case(When(done, then=Value(True)), default=Value(False)),
+			updated_at=timezone.now(),
+		)
+		if newly_completed:
+			cls._notify_completed(Course.objects.get(pk=course_id), User.objects.filter(id__in=newly_completed))
+		print(f"[CourseProgress] Recomputed {updated} learners of course {course_id}, {len(newly_completed)} newly completed")
+		return updated
+
+	@staticmethod
+	def _notify_completed(course, learners):
+		notification = Notification.objects.create(
+			course=course,
+			notification_type='course_enrollment',
+			title='Chúc mừng bạn đã hoàn thành khoá học!',
+			message=f'Bạn đã hoàn thành khoá học "{course.title}". Hãy tiếp tục học các khoá học khác nhé!'
+		)
+		learners = list(learners)
+		UserNotification.objects.bulk_create(
+			[UserNotification(user=learner, notification=notification) for learner in learners], ignore_conflicts=True
+		)
+		for learner in learners:
+			notification._send_email_to_user(learner)
 
 	def update_progress(self):
 		CourseProgress.update_progress_for_user(self.learner, self.course)
@@ -163,6 +201,73 @@ class Document(models.Model):
 		return self.title
 	
 
+# Mỗi lần yêu cầu ingest 1 phiên bản nguồn (file/url) của Document là 1 IngestionJob;
+# content_fingerprint cho biết nội dung thực tế đã ingest (cùng url/public_id vẫn có thể đổi nội dung)
+class IngestionJob(models.Model):
+	STATE_CHOICES = (
+		('pending', 'Pending'),
+		('running', 'Running'),
+		('succeeded', 'Succeeded'),
+		('failed', 'Failed'),
+		('superseded', 'Superseded'),  # có phiên bản mới hơn của tài liệu trước khi job kịp chạy
+	)
+	ACTIVE_STATES = ('pending', 'running')
+	# Stage cuối cùng đã hoàn thành khi chạy theo pipeline Celery (extract → embed → persist)
+	STAGE_CHOICES = (
+		('queued', 'Queued'),
+		('extracted', 'Extracted'),
+		('embedded', 'Embedded'),
+		('persisted', 'Persisted'),
+	)
+	KIND_CHOICES = (
+		('ingest', 'Ingest'),  # request_ingestion: file/url mới hoặc kiểm tra lại nội dung
+		('reindex', 'Reindex'),  # manage.py reindex_chunks
+	)
+
+	document = models.ForeignKey(Document, on_delete=models.CASCADE, related_name='ingestion_jobs')
+	version = models.CharField(max_length=64)  # hash của file/url tại thời điểm yêu cầu ingest
+	kind = models.CharField(max_length=20, choices=KIND_CHOICES, default='ingest')
+	content_fingerprint = models.CharField(max_length=64, blank=True, default='')  # sha256 của nội dung đã tải về (file/web/transcript)
+	state = models.CharField(max_length=20, choices=STATE_CHOICES, default='pending', db_index=True)
+	stage = models.CharField(max_length=20, choices=STAGE_CHOICES, default='queued')
+	stage_timings = models.JSONField(default=dict, blank=True)  # giây cho từng stage: extract, embed, persist...
+	chunk_count = models.PositiveIntegerField(default=0)
+	stats = models.JSONField(default=dict, blank=True)
+	error = models.TextField(null=True, blank=True)
+	created_at = models.DateTimeField(auto_now_add=True)
+	started_at = models.DateTimeField(null=True, blank=True)
+	finished_at = models.DateTimeField(null=True, blank=True)
+
+	class Meta:
+		ordering = ['-created_at']
+		constraints = [
+			# Cùng 1 phiên bản chỉ có tối đa 1 job (mỗi loại) đang chờ/chạy → trigger lặp lại gộp thành 1
+			models.UniqueConstraint(
+				fields=['document', 'version', 'kind'],
+				condition=models.Q(state__in=['pending', 'running']),
+				name='unique_active_ingestion_job',
+			),
+		]
+
+	def __str__(self):
+		return f"Ingest {self.document_id}@{self.version[:8]} ({self.state})"
+
+
+# Chunk trung gian giữa các stage của pipeline ingest: stage extract ghi text, stage embed điền embedding,
+# stage persist chuyển sang Chunk rồi xoá. Retry 1 stage chỉ làm lại phần chưa xong của stage đó.
+class IngestionChunk(models.Model):
+	job = models.ForeignKey(IngestionJob, on_delete=models.CASCADE, related_name='staged_chunks')
+	position = models.PositiveIntegerField()
+	text = models.TextField(blank=True, default='')  # rỗng nếu dùng lại chunk cũ
+	content_hash = models.CharField(max_length=64)
+	token_count = models.PositiveIntegerField(default=0)
+	embedding = VectorField(dimensions=384, null=True, blank=True)
+	reused_chunk_id = models.BigIntegerField(null=True, blank=True)  # chunk đang có với cùng content hash
+
+	class Meta:
+		unique_together = ('job', 'position')
+
+
 class DocumentCompletion(models.Model):
 	user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='document_completions')
 	document = models.ForeignKey(Document, on_delete=models.CASCADE, related_name='completions')
@@ -340,10 +445,87 @@ class Chunk(models.Model):
 	course = models.ForeignKey(Course, on_delete=models.CASCADE, related_name='chunks')
 	document = models.ForeignKey(Document, on_delete=models.CASCADE, related_name='chunks')
 	text = models.TextField()
+	content_hash = models.CharField(max_length=64, blank=True, default='', db_index=True)  # sha256 của text, dùng khi ingest lại
 	embedding = VectorField(dimensions=384)
 	meta = models.JSONField(default=dict, blank=True)
+	token_count = models.PositiveIntegerField(default=0)  # số token của text, tính 1 lần lúc ingest
+	# tsvector sinh tự động từ text (config 'simple': giữ nguyên dấu tiếng Việt, tên hàm/biến trong code)
+	search_vector = models.GeneratedField(
+		expression=SearchVector('text', config='simple'),
+		output_field=SearchVectorField(),
+		db_persist=True,
+	)
+
+	class Meta:
+		# Index ANN cho embedding được quản lý bởi migration 0002 / lệnh vector_index
+		indexes = [GinIndex(fields=["search_vector"], name="chunk_search_vector_gin")]
+
+
+
+# Embedding của chunk theo từng model khác model của cột Chunk.embedding (embedding_models.column_model()).
+# Dùng khi đổi embedding model không downtime: backfill model mới trong khi model cũ vẫn phục vụ,
+# chuyển sang model mới khi đã phủ 100% chunk (xem services/embedding_models.py).
+class ChunkEmbedding(models.Model):
+	chunk = models.ForeignKey(Chunk, on_delete=models.CASCADE, related_name='embeddings')
+	model_name = models.CharField(max_length=200)
+	embedding = VectorField()  # số chiều tuỳ model; index ANN là partial index theo model_name (ép kiểu vector(n))
+	created_at = models.DateTimeField(auto_now_add=True)
 
 	class Meta:
-		indexes = []
-		# indexes = [GinIndex(fields=["embedding"])]
+		unique_together = ('chunk', 'model_name')
+		indexes = [models.Index(fields=['model_name', 'chunk'], name='chunkembedding_model_chunk')]
+
+
+# Trạng thái backfill của 1 embedding model: ready_at được set khi mọi chunk đã có embedding và index đã build,
+# từ lúc đó model này phục vụ query (nếu là EMBEDDING_ACTIVE_MODEL).
+# in_column: model có embedding nằm trong cột Chunk.embedding (đúng 1 dòng, đổi bằng lệnh promote_embedding_model).
+class EmbeddingModelState(models.Model):
+	name = models.CharField(max_length=200, unique=True)
+	dimensions = models.PositiveIntegerField()
+	embedded_chunks = models.PositiveIntegerField(default=0)
+	total_chunks = models.PositiveIntegerField(default=0)
+	ready_at = models.DateTimeField(null=True, blank=True)
+	in_column = models.BooleanField(default=False)
+	updated_at = models.DateTimeField(auto_now=True)
+
+	@property
+	def coverage(self):
+		return self.embedded_chunks / self.total_chunks if self.total_chunks else 1.0
+
+	def __str__(self):
+		return f"{self.name} ({self.embedded_chunks}/{self.total_chunks})"
+
 
+
+# Cache câu trả lời của AI tutor theo ngữ nghĩa: câu hỏi mới đủ gần (cosine) với câu hỏi đã trả lời
+# trong cùng khoá học sẽ dùng lại câu trả lời mà không gọi LLM.
+class AnswerCacheEntry(models.Model):
+	course = models.ForeignKey(Course, on_delete=models.CASCADE, related_name='answer_cache_entries')
+	question = models.TextField()
+	model_name = models.CharField(max_length=200, blank=True, default='')  # embedding model của câu hỏi
+	embedding = VectorField()
+	answer = models.TextField()
+	sources = models.JSONField(default=list, blank=True)
+	generation_ms = models.PositiveIntegerField(default=0)  # thời gian sinh câu trả lời gốc, dùng tính latency tiết kiệm được
+	hit_count = models.PositiveIntegerField(default=0)
+	created_at = models.DateTimeField(auto_now_add=True)
+
+	def __str__(self):
+		return f"Cache[{self.course_id}]: {self.question[:30]}..."
+
+
+# Trạng thái hội thoại của 1 learner trong 1 khoá học cho AI tutor: tóm tắt các lượt cũ + N lượt gần nhất,
+# prompt không phải gửi lại toàn bộ lịch sử chat (xem services/conversation.py).
+class ConversationState(models.Model):
+	user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='conversation_states')
+	course = models.ForeignKey(Course, on_delete=models.CASCADE, related_name='conversation_states')
+	summary = models.TextField(blank=True, default='')  # tóm tắt các lượt đã ra khỏi cửa sổ turns
+	turns = models.JSONField(default=list, blank=True)  # [{"question": ..., "answer": ...}], cũ → mới
+	turn_count = models.PositiveIntegerField(default=0)
+	updated_at = models.DateTimeField(auto_now=True)
+
+	class Meta:
+		unique_together = ('user', 'course')
+
+	def __str__(self):
+		return f"Conversation[{self.user_id}/{self.course_id}]: {self.turn_count} turns"
@@ -143,6 +143,12 @@ class UserNotificationSerializer(serializers.ModelSerializer):
 
 
 
+class IngestionJobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = IngestionJob
+        fields = ['id', 'document', 'version', 'kind', 'content_fingerprint', 'state', 'stage', 'stage_timings', 'chunk_count', 'stats', 'error', 'created_at', 'started_at', 'finished_at']
+
+
 class ChunkSerializer(serializers.ModelSerializer):
     class Meta:
         model = Chunk
@@ -151,6 +157,9 @@ class ChunkSerializer(serializers.ModelSerializer):
 class ChatRequestSerializer(serializers.Serializer):
     message = serializers.CharField()
     allow_web = serializers.BooleanField(default=False)
+    # Tham số recall của index ANN (tuỳ chọn), bị giới hạn bởi VECTOR_*_MAX trong settings
+    ef_search = serializers.IntegerField(required=False, min_value=1)
+    probes = serializers.IntegerField(required=False, min_value=1)
 
 class ChatResponseSerializer(serializers.Serializer):
     answer = serializers.CharField()
@@ -0,0 +1,138 @@
+import re
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+from pgvector.django import CosineDistance
+
+from ..models import AnswerCacheEntry
+from . import metrics
+from .query_embedding_cache import normalize
+
+# --- Semantic answer cache ---
+# Key = (course, embedding model, embedding câu hỏi). Câu hỏi mới có cosine distance <= ANSWER_CACHE_MAX_DISTANCE
+# so với 1 câu hỏi đã cache trong cùng khoá học thì trả lại answer + sources đã lưu.
+# Lịch sử hội thoại: ConversationState không hết hạn nên sau câu hỏi đầu tiên learner luôn có lịch sử. Cache lưu câu trả lời
+# chỉ dựa trên tài liệu (không kèm lịch sử) và dùng được cho mọi learner:
+# - câu hỏi độc lập (relevant_history trả về None): prompt không đưa lịch sử vào → câu trả lời không phụ thuộc hội thoại,
+#   được tra / lưu cache như câu hỏi đầu tiên (và được gộp bởi llm_concurrency.flight_key)
+# - câu hỏi nối tiếp (depends_on_history: câu quá ngắn hoặc có từ tham chiếu "nó", "đó", "ví dụ khác", "it"...): giữ lịch
+#   sử trong prompt và bỏ qua cache. Không key theo digest của lịch sử vì lịch sử của từng learner gần như không bao giờ
+#   trùng nhau, entry như vậy chỉ tốn chỗ.
+
+# Từ / cụm từ cho thấy câu hỏi tham chiếu tới lượt trước (so trên câu hỏi đã normalize, theo ranh giới từ)
+FOLLOW_UP_MARKERS = [normalize(marker) for marker in (
+    "nó", "chúng", "đó", "đấy", "ấy", "này", "kia", "nãy", "vừa rồi", "ở trên", "phía trên", "câu trước",
+    "ví dụ khác", "cách khác", "giải thích thêm", "nói thêm", "chi tiết hơn", "tiếp tục", "thế còn", "vậy còn",
+    "it", "its", "that", "this", "these", "those", "they", "them", "above", "previous", "earlier", "again",
+    "another", "else",
+)]
+
+METRIC_NAMES = [
+    "answer_cache.hits",
+    "answer_cache.misses",
+    "answer_cache.saved.count",
+    "answer_cache.saved.total_ms",
+    "answer_cache.invalidations",
+]
+
+
+def depends_on_history(question: str, history) -> bool:
+    """
+    True nếu câu hỏi cần lịch sử hội thoại để hiểu (câu hỏi nối tiếp / có đại từ tham chiếu). Không có lịch sử → False.
+    """
+    if not history:
+        return False
+    words = re.findall(r"\w+", normalize(question))
+    if len(words) < settings.ANSWER_CACHE_STANDALONE_MIN_WORDS:
+        return True
+    padded = f" {' '.join(words)} "
+    return any(f" {marker} " in padded for marker in FOLLOW_UP_MARKERS)
+
+
+def relevant_history(question: str, history):
+    """
+    Lịch sử đưa vào prompt: giữ nguyên cho câu hỏi nối tiếp, None cho câu hỏi độc lập (trả lời chỉ từ tài liệu, cache được).
+    """
+    return history if depends_on_history(question, history) else None
+
+
+def lookup(course, q_emb, model_name: str = None, history=None):
+    """
+    Tìm câu trả lời đã cache gần nhất với câu hỏi. Trả về (answer, sources) hoặc None.
+    model_name: embedding model đã encode q_emb (chỉ so với câu hỏi được encode bằng cùng model).
+    history: lịch sử hội thoại đưa vào prompt (sau relevant_history); có lịch sử thì không dùng cache.
+    """
+    if not settings.ANSWER_CACHE_ENABLED or history:
+        return None
+    qs = AnswerCacheEntry.objects.filter(course=course, model_name=model_name or settings.EMBEDDING_MODEL)
+    if settings.ANSWER_CACHE_TTL:
+        qs = qs.filter(created_at__gte=timezone.now() - timedelta(seconds=settings.ANSWER_CACHE_TTL))
+    entry = (
+        qs.annotate(distance=CosineDistance("embedding", q_emb))
+        .filter(distance__lte=settings.ANSWER_CACHE_MAX_DISTANCE)
+        .order_by("distance")
+        .only("id", "answer", "sources", "generation_ms")
+        .first()
+    )
+    if entry is None:
+        metrics.incr("answer_cache.misses")
+        return None
+    AnswerCacheEntry.objects.filter(pk=entry.pk).update(hit_count=F("hit_count") + 1)
+    metrics.incr("answer_cache.hits")
+    metrics.observe_ms("answer_cache.saved", entry.generation_ms)
+    print(f"[AnswerCache] Hit course={course.id} distance={entry.distance:.4f}")
+    return entry.answer, entry.sources
+
+
+def store(course, question: str, q_emb, answer: str, sources, generation_ms: float, model_name: str = None,
+          history=None):
+    if not settings.ANSWER_CACHE_ENABLED or history:
+        return
+    AnswerCacheEntry.objects.create(
+        course=course,
+        question=question,
+        model_name=model_name or settings.EMBEDDING_MODEL,
+        embedding=list(q_emb),
+        answer=answer,
+        sources=list(sources),
+        generation_ms=int(generation_ms),
+    )
+
+
+def invalidate_course(course_id):
+    """
+    Xoá toàn bộ cache của khoá học (gọi khi tài liệu của khoá học được ingest lại hoặc bị xoá).
+    """
+    deleted, _ = AnswerCacheEntry.objects.filter(course_id=course_id).delete()
+    if deleted:
+        metrics.incr("answer_cache.invalidations")
+        print(f"[AnswerCache] Invalidated {deleted} entries for course {course_id}")
+
+
+def invalidate_all():
+    """
+    Xoá toàn bộ cache (gọi khi đổi embedding model phục vụ query).
+    """
+    deleted, _ = AnswerCacheEntry.objects.all().delete()
+    if deleted:
+        metrics.incr("answer_cache.invalidations")
+        print(f"[AnswerCache] Invalidated all {deleted} entries")
+
+
+def cache_stats() -> dict:
+    values = metrics.snapshot(METRIC_NAMES)
+    hits, misses = values["answer_cache.hits"], values["answer_cache.misses"]
+    lookups = hits + misses
+    return {
+        "hits": hits,
+        "misses": misses,
+        "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+        "saved_latency_ms_total": values["answer_cache.saved.total_ms"],
+        "saved_latency_ms_avg": (
+            round(values["answer_cache.saved.total_ms"] / values["answer_cache.saved.count"], 1)
+            if values["answer_cache.saved.count"] else 0.0
+        ),
+        "invalidations": values["answer_cache.invalidations"],
+    }
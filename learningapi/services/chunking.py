@@ -0,0 +1,139 @@
+import re
+from collections import deque
+
+from django.conf import settings
+
+# --- Chunking ---
+# Chunk được đo bằng token của embedding model (MiniLM chỉ encode tối đa 256 token, phần dư bị cắt bỏ
+# khi embed) và không bao giờ vượt CHUNK_MAX_TOKENS. Câu được gom vào 1 deque và chỉ join 1 lần khi
+# xuất chunk → thời gian tuyến tính theo độ dài text. Overlap giữa 2 chunk là các câu trọn vẹn cuối chunk trước.
+
+# Kết thúc câu: dấu câu + khoảng trắng, hoặc dòng trống (hết đoạn)
+SENTENCE_SPLIT = re.compile(r'(?<=[.!?…])\s+|\n\s*\n')
+WHITESPACE = re.compile(r'\s+')
+COUNT_BATCH = 256
+
+
+class ModelTokenCounter:
+    """
+    Đếm / cắt token bằng tokenizer của embedding model đang cấu hình.
+    Mặc định chỉ load tokenizer (không load model) → worker extract không tốn RAM cho trọng số model.
+    """
+
+    def __init__(self, handle=None):
+        if handle is None:
+            from .embedding_registry import get_tokenizer
+            handle = get_tokenizer()
+        self.handle = handle
+
+    def count(self, texts) -> list:
+        return self.handle.count_tokens(texts)
+
+    def split(self, text: str, max_tokens: int) -> list:
+        """
+        Cắt 1 câu quá dài thành các đoạn <= max_tokens token, cắt tại ranh giới token.
+        """
+        offsets = self.handle.token_offsets(text)
+        pieces = []
+        for start in range(0, len(offsets), max_tokens):
+            window = offsets[start:start + max_tokens]
+            end = offsets[start + max_tokens][0] if start + max_tokens < len(offsets) else len(text)
+            piece = text[window[0][0]:end].strip()
+            if piece:
+                pieces.append((piece, len(window)))
+        return pieces
+
+
+class WordTokenCounter:
+    """
+    Đếm theo số từ (khi không muốn load model, ví dụ benchmark nhanh).
+    """
+
+    def count(self, texts) -> list:
+        return [len(t.split()) for t in texts]
+
+    def split(self, text: str, max_tokens: int) -> list:
+        words = text.split()
+        return [
+            (" ".join(words[i:i + max_tokens]), len(words[i:i + max_tokens]))
+            for i in range(0, len(words), max_tokens)
+        ]
+
+
+def iter_sentences(segments, max_pending: int = 20_000):
+    """
+    Tách luồng text thành câu (đã chuẩn hoá khoảng trắng). Phần cuối chưa hết câu được giữ lại để ghép với
+    đoạn sau; nếu quá max_pending ký tự vẫn chưa có dấu câu (transcript, PDF lỗi...) thì cắt tại khoảng trắng.
+    """
+    pending = ""
+    for segment in segments:
+        if not segment:
+            continue
+        parts = SENTENCE_SPLIT.split(pending + segment)
+        pending = parts.pop()
+        for part in parts:
+            part = WHITESPACE.sub(" ", part).strip()
+            if part:
+                yield part
+        while len(pending) > max_pending:
+            cut = pending.rfind(" ", 0, max_pending)
+            cut = cut if cut > 0 else max_pending
+            part = WHITESPACE.sub(" ", pending[:cut]).strip()
+            if part:
+                yield part
+            pending = pending[cut:]
+    pending = WHITESPACE.sub(" ", pending).strip()
+    if pending:
+        yield pending
+
+
+def iter_counted_sentences(sentences, counter, max_tokens: int):
+    """
+    Yield (câu, số token), đếm token theo batch; câu dài hơn max_tokens được cắt nhỏ.
+    """
+    batch = []
+
+    def flush():
+        for sent, n in zip(batch, counter.count(batch)):
+            if n > max_tokens:
+                yield from counter.split(sent, max_tokens)
+            elif n:
+                yield sent, n
+
+    for sent in sentences:
+        batch.append(sent)
+        if len(batch) >= COUNT_BATCH:
+            yield from flush()
+            batch = []
+    if batch:
+        yield from flush()
+
+
+def iter_chunks_with_tokens(segments, max_tokens: int = None, overlap_tokens: int = None, counter=None):
+    """
+    Gom câu thành chunk <= max_tokens token. Yield (text, số token).
+    """
+    max_tokens = max_tokens or settings.CHUNK_MAX_TOKENS
+    overlap_tokens = settings.CHUNK_OVERLAP_TOKENS if overlap_tokens is None else overlap_tokens
+    counter = counter or ModelTokenCounter()
+
+    window, window_tokens = deque(), 0
+    for sent, n in iter_counted_sentences(iter_sentences(segments), counter, max_tokens):
+        if window and window_tokens + n > max_tokens:
+            yield " ".join(s for s, _ in window), window_tokens
+            # overlap: giữ lại các câu trọn vẹn cuối chunk, tổng <= overlap_tokens
+            keep, keep_tokens = deque(), 0
+            for s, t in reversed(window):
+                if keep_tokens + t > overlap_tokens:
+                    break
+                keep.appendleft((s, t))
+                keep_tokens += t
+            window, window_tokens = keep, keep_tokens
+            # bỏ bớt overlap nếu câu mới không còn chỗ
+            while window and window_tokens + n > max_tokens:
+                window_tokens -= window.popleft()[1]
+        window.append((sent, n))
+        window_tokens += n
+
+    if window:
+        yield " ".join(s for s, _ in window), window_tokens
@@ -0,0 +1,69 @@
+import numpy as np
+from django.conf import settings
+
+# --- Context builder ---
+# Chọn chunk đưa vào prompt từ danh sách ứng viên đã retrieve:
+# - MMR (maximal marginal relevance): cân bằng giữa độ liên quan với câu hỏi và độ khác biệt với các chunk đã chọn
+# - bỏ chunk gần như trùng lặp (các chunk liền nhau có overlap, cùng 1 đoạn được upload 2 lần...)
+# - dừng khi tổng số token vượt ngân sách (token_count được tính 1 lần lúc ingest)
+
+
+def estimate_tokens(text: str) -> int:
+    # Ước lượng cho chunk cũ chưa có token_count
+    return max(1, len(text) // 4)
+
+
+def chunk_tokens(chunk) -> int:
+    return getattr(chunk, "token_count", 0) or estimate_tokens(chunk.text)
+
+
+def _relevance(chunks) -> np.ndarray:
+    """
+    Độ liên quan trong [0, 1]: theo điểm RRF nếu là kết quả hybrid, ngược lại theo cosine similarity.
+    """
+    rrf = [getattr(c, "rrf_score", None) for c in chunks]
+    if all(r is not None for r in rrf):
+        rrf = np.asarray(rrf, dtype=np.float32)
+        return rrf / rrf.max() if rrf.max() > 0 else rrf
+    return np.asarray([1.0 - float(getattr(c, "distance", 0.0) or 0.0) for c in chunks], dtype=np.float32)
+
+
+def build_context(chunks, token_budget: int = None, max_chunks: int = None,
+                  mmr_lambda: float = None, duplicate_threshold: float = None):
+    """
+    Trả về list chunk đã chọn theo thứ tự MMR, không vượt token_budget và max_chunks.
+    """
+    if not chunks:
+        return []
+    token_budget = token_budget or settings.RAG_CONTEXT_TOKEN_BUDGET
+    max_chunks = max_chunks or settings.RAG_TOP_K
+    mmr_lambda = settings.RAG_MMR_LAMBDA if mmr_lambda is None else mmr_lambda
+    duplicate_threshold = duplicate_threshold or settings.RAG_DUPLICATE_THRESHOLD
+
+    relevance = _relevance(chunks)
+    embs = np.asarray([np.asarray(c.embedding, dtype=np.float32) for c in chunks])
+    embs = embs / np.maximum(np.linalg.norm(embs, axis=1, keepdims=True), 1e-12)
+    similarity = embs @ embs.T
+
+    selected, used_tokens = [], 0
+    remaining = list(range(len(chunks)))
+    while remaining and len(selected) < max_chunks:
+        if selected:
+            max_sim = similarity[np.ix_(remaining, selected)].max(axis=1)
+        else:
+            max_sim = np.zeros(len(remaining), dtype=np.float32)
+        scores = mmr_lambda * relevance[remaining] - (1 - mmr_lambda) * max_sim
+        pos = int(np.argmax(scores))
+        idx = remaining.pop(pos)
+        if max_sim[pos] >= duplicate_threshold:
+            # gần như trùng với 1 chunk đã chọn → bỏ qua
+            continue
+        tokens = chunk_tokens(chunks[idx])
+        if used_tokens + tokens > token_budget:
+            # chunk đầu tiên luôn được giữ để prompt không bị rỗng khi chunk lớn hơn ngân sách
+            if selected:
+                break
+        selected.append(idx)
+        used_tokens += tokens
+
+    return [chunks[i] for i in selected]
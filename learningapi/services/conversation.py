@@ -0,0 +1,145 @@
+import re
+from dataclasses import dataclass, field
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from ..models import Answer, ConversationState
+from .context_builder import estimate_tokens
+
+# --- Trạng thái hội thoại cho prompt của AI tutor ---
+# Trước đây mỗi lượt chat đọc 5 câu hỏi gần nhất + 1 query / câu để lấy câu trả lời AI, rồi dán nguyên văn vào prompt:
+# prompt (và latency) tăng theo độ dài hội thoại.
+# Giờ mỗi (learner, khoá học) có 1 ConversationState: CONVERSATION_TURNS lượt gần nhất + tóm tắt các lượt cũ hơn,
+# cập nhật dần sau mỗi lượt (không gọi thêm LLM: giữ câu hỏi và câu đầu của câu trả lời).
+# - đọc: 1 query ConversationState (learner chưa có state: 1 query Answer join Question). Django cache chỉ là lớp
+#   read-through TTL ngắn khi cache dùng chung giữa các worker (CONVERSATION_CACHE_ENABLED, mặc định khi có Redis):
+#   LocMemCache của từng worker sẽ giữ bản cũ và prompt thiếu các lượt được ghi ở worker khác
+# - ghi: record_turn đọc state từ DB dưới row lock rồi mới thêm lượt / gộp vào tóm tắt, cache cập nhật sau khi commit
+# - prompt: tóm tắt + các lượt gần nhất, cắt theo CONVERSATION_TOKEN_BUDGET (bỏ lượt cũ trước)
+
+CACHE_PREFIX = "conversation:"
+SENTENCE_END = re.compile(r"(?<=[.!?])\s")
+
+
+@dataclass
+class ConversationHistory:
+    summary: str = ""
+    turns: list = field(default_factory=list)  # [{"question": ..., "answer": ...}], cũ → mới
+
+    def __bool__(self):
+        return bool(self.summary or self.turns)
+
+    def __len__(self):
+        return len(self.turns)
+
+
+def _cache_key(course_id, user_id) -> str:
+    return f"{CACHE_PREFIX}{user_id}:{course_id}"
+
+
+def _truncate(text: str, max_tokens: int) -> str:
+    # estimate_tokens ~ 4 ký tự / token
+    max_chars = max_tokens * 4
+    return text if len(text) <= max_chars else text[:max_chars].rstrip() + "…"
+
+
+def _recent_turns(course, user, limit: int) -> list:
+    """
+    N lượt hỏi-đáp AI gần nhất từ Question/Answer (1 query), dùng khi learner chưa có ConversationState.
+    """
+    rows = (
+        Answer.objects.filter(question__course=course, question__asked_by=user, is_ai=True)
+        .order_by("-question__created_at", "-created_at")
+        .values("question_id", "question__content", "content")[:limit * 2]
+    )
+    turns, seen = [], set()
+    for row in rows:
+        # câu hỏi có nhiều câu trả lời AI: giữ câu trả lời mới nhất
+        if row["question_id"] in seen:
+            continue
+        seen.add(row["question_id"])
+        turns.append({"question": row["question__content"], "answer": row["content"]})
+    return list(reversed(turns[:limit]))
+
+
+def _load_state(course, user) -> dict:
+    key = _cache_key(course.id, user.id)
+    state = cache.get(key) if settings.CONVERSATION_CACHE_ENABLED else None
+    if state is None:
+        state = ConversationState.objects.filter(course=course, user=user).values("summary", "turns").first()
+        if state is None:
+            state = {"summary": "", "turns": _recent_turns(course, user, settings.CONVERSATION_TURNS)}
+        if settings.CONVERSATION_CACHE_ENABLED:
+            cache.set(key, state, settings.CONVERSATION_CACHE_TTL)
+    return state
+
+
+def fit_budget(summary: str, turns, token_budget: int = None) -> ConversationHistory:
+    """
+    Cắt tóm tắt + các lượt theo ngân sách token: câu trả lời dài bị rút gọn, lượt cũ bị bỏ trước.
+    """
+    token_budget = token_budget or settings.CONVERSATION_TOKEN_BUDGET
+    summary = _truncate(summary, settings.CONVERSATION_SUMMARY_MAX_TOKENS) if summary else ""
+    remaining = token_budget - (estimate_tokens(summary) if summary else 0)
+    kept = []
+    for turn in reversed(turns):
+        turn = {
+            "question": _truncate(turn["question"], settings.CONVERSATION_ANSWER_MAX_TOKENS),
+            "answer": _truncate(turn["answer"], settings.CONVERSATION_ANSWER_MAX_TOKENS),
+        }
+        cost = estimate_tokens(turn["question"]) + estimate_tokens(turn["answer"])
+        if cost > remaining:
+            break
+        remaining -= cost
+        kept.append(turn)
+    return ConversationHistory(summary=summary, turns=list(reversed(kept)))
+
+
+def get_history(course, user) -> ConversationHistory:
+    """
+    Lịch sử hội thoại của learner trong khoá học để đưa vào prompt (đã cắt theo CONVERSATION_TOKEN_BUDGET).
+    """
+    if not user.is_authenticated:
+        return ConversationHistory()
+    state = _load_state(course, user)
+    return fit_budget(state["summary"], state["turns"])
+
+
+def _fold(summary: str, turn) -> str:
+    """
+    Thêm 1 lượt đã ra khỏi cửa sổ vào tóm tắt: câu hỏi + câu đầu tiên của câu trả lời.
+    Tóm tắt vượt CONVERSATION_SUMMARY_MAX_TOKENS thì bỏ các dòng cũ nhất.
+    """
+    first_sentence = SENTENCE_END.split(turn["answer"].strip(), maxsplit=1)[0]
+    line = f"- Học viên hỏi: {_truncate(turn['question'], 60)} → {_truncate(first_sentence, 80)}"
+    lines = [l for l in summary.splitlines() if l] + [line]
+    while len(lines) > 1 and estimate_tokens("\n".join(lines)) > settings.CONVERSATION_SUMMARY_MAX_TOKENS:
+        lines.pop(0)
+    return "\n".join(lines)
+
+
+def record_turn(course, user, question: str, answer: str):
+    """
+    Cập nhật ConversationState sau 1 lượt chat (gọi sau khi Question/Answer của lượt này đã được lưu).
+    """
+    if not user.is_authenticated:
+        return
+    with transaction.atomic():
+        state, created = ConversationState.objects.select_for_update().get_or_create(course=course, user=user)
+        if created:
+            # learner đã chat trước khi có ConversationState: lấy các lượt gần nhất (gồm lượt vừa lưu) từ Question/Answer
+            state.turns = _recent_turns(course, user, settings.CONVERSATION_TURNS)
+        else:
+            state.turns = list(state.turns) + [{"question": question, "answer": answer}]
+        while len(state.turns) > settings.CONVERSATION_TURNS:
+            state.summary = _fold(state.summary, state.turns.pop(0))
+        state.turn_count += 1
+        state.save()
+        if settings.CONVERSATION_CACHE_ENABLED:
+            # Chỉ ghi cache khi state đã commit (record_turn có thể chạy trong transaction của view)
+            cached = {"summary": state.summary, "turns": state.turns}
+            transaction.on_commit(
+                lambda: cache.set(_cache_key(course.id, user.id), cached, settings.CONVERSATION_CACHE_TTL)
+            )
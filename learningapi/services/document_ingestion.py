@@ -1,69 +1,125 @@
-import os,tempfile,re
+import os,tempfile,hashlib,time
+from itertools import islice
 import fitz  # PyMuPDF cho PDF
 import docx
 import requests
 from django.conf import settings
+from django.db import transaction
 from youtube_transcript_api import YouTubeTranscriptApi
 from ..models import Chunk, Document
-from .rag_service import get_embedding
+from .rag_service import get_embeddings
+from .chunking import iter_chunks_with_tokens
+from .embedding_models import column_model, embed_document
+from . import answer_cache, memory_index
 
 # --- Extractor ---
-def extract_text(doc: Document) -> str:
+# Trích xuất dạng generator: tải file về disk theo từng khối, yield text theo trang (PDF) / đoạn (DOCX) /
+# khối (TXT, web) để chunker và batch embedder xử lý dần → bộ nhớ không tăng theo kích thước tài liệu.
+# Nội dung tải về được băm (sha256) trong lúc stream: fingerprint này được lưu vào IngestionJob. Cùng file/url vẫn có thể
+# đổi nội dung (trang web sửa, upload đè cùng public_id) nên mỗi lần yêu cầu ingest đều tải lại; file trùng fingerprint
+# với lần ingest hiện tại thì không cần tách text/chunk lại (SourceUnchanged).
+DOWNLOAD_CHUNK_BYTES = 1024 * 1024
+TEXT_READ_CHARS = 64 * 1024
+
+
+class SourceUnchanged(Exception):
+    """
+    File tải về có cùng fingerprint với lần ingest hiện tại của tài liệu → bỏ qua bước tách text/chunk.
+    """
+
+
+def download_to_tempfile(url: str, suffix: str = "", timeout: int = 30, hasher=None):
+    """
+    Stream file từ URL xuống file tạm. Trả về đường dẫn file hoặc None nếu tải lỗi.
+    hasher (hashlib): được update với từng khối bytes tải về.
     """
-    Trích xuất text từ file Supabase/S3 hoặc URL của Document.
+    with requests.get(url, stream=True, timeout=timeout) as response:
+        if response.status_code != 200:
+            print(f"[Ingest] Failed to download file from Supabase: {response.status_code}")
+            return None
+        with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp_file:
+            for block in response.iter_content(chunk_size=DOWNLOAD_CHUNK_BYTES):
+                tmp_file.write(block)
+                if hasher is not None:
+                    hasher.update(block)
+            return tmp_file.name
+
+
+def iter_text(doc: Document, hasher=None, unchanged_if: str = None):
+    """
+    Yield từng đoạn text của file Supabase/S3 hoặc URL của Document.
+    hasher: nhận bytes của file (hoặc text của web/transcript) để tính content fingerprint.
+    unchanged_if: fingerprint của lần ingest hiện tại; file tải về trùng fingerprint thì raise SourceUnchanged.
     """
-    text = ""
     print(f"[Ingest] Extracting text from document {doc.id}")
 
     # Nếu có file trên Supabase/S3
     if doc.file:
         file_url = doc.get_url()
         print(f"[Ingest] Downloading file from {file_url}")
-        response = requests.get(file_url, timeout=30)
-        if response.status_code == 200:
-            file_ext = doc.file.lower()
-            # Tạo file tạm đúng cách
-            with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(doc.file)[-1]) as tmp_file:
-                tmp_file.write(response.content)
-                temp_path = tmp_file.name
-            try:
-                if file_ext.endswith(".pdf"):
-                    text = extract_text_from_pdf(temp_path)
-                elif file_ext.endswith(".docx"):
-                    text = extract_text_from_docx(temp_path)
-                elif file_ext.endswith(".txt"):
-                    with open(temp_path, "r", encoding="utf-8") as f:
-                        text = f.read()
-            finally:
-                os.remove(temp_path)
-        else:
-            print(f"[Ingest] Failed to download file from Supabase: {response.status_code}")
+        temp_path = download_to_tempfile(file_url, suffix=os.path.splitext(doc.file)[-1], hasher=hasher)
+        if temp_path is None:
+            return
+        if unchanged_if and hasher is not None and hasher.hexdigest() == unchanged_if:
+            os.remove(temp_path)
+            print(f"[Ingest] Document {doc.id} content unchanged ({unchanged_if[:8]}) → skip extraction")
+            raise SourceUnchanged(unchanged_if)
+        file_ext = doc.file.lower()
+        try:
+            if file_ext.endswith(".pdf"):
+                yield from iter_text_from_pdf(temp_path)
+            elif file_ext.endswith(".docx"):
+                yield from iter_text_from_docx(temp_path)
+            elif file_ext.endswith(".txt"):
+                yield from iter_text_from_txt(temp_path)
+        finally:
+            os.remove(temp_path)
     # Nếu có URL (ví dụ YouTube hoặc web link)
     elif doc.url:
+        # Web/transcript: chỉ biết nội dung có đổi sau khi đọc hết → vẫn chunk, chunk trùng content hash không bị encode lại
         if "youtube.com" in doc.url or "youtu.be" in doc.url:
-            text = extract_youtube_transcript(doc.url)
+            yield from _hashed([extract_youtube_transcript(doc.url)], hasher)
         else:
-            text = requests.get(doc.url, timeout=20).text
+            with requests.get(doc.url, stream=True, timeout=20) as response:
+                response.encoding = response.encoding or "utf-8"
+                yield from _hashed(response.iter_content(chunk_size=TEXT_READ_CHARS, decode_unicode=True), hasher)
 
-    return text
 
+def _hashed(blocks, hasher):
+    for block in blocks:
+        if hasher is not None:
+            hasher.update(block.encode("utf-8"))
+        yield block
 
-def extract_text_from_pdf(file_path):
+
+def extract_text(doc: Document) -> str:
+    """
+    Trích xuất toàn bộ text của Document (giữ lại cho code cần cả chuỗi; ingest dùng iter_text).
+    """
+    return "".join(iter_text(doc))
+
+
+def iter_text_from_pdf(file_path):
     print(f"[Ingest] Extracting text from PDF {file_path}")
-    text = ""
     with fitz.open(file_path) as pdf:
         for page in pdf:
-            text += page.get_text()
-    return text
+            yield page.get_text()
 
 
-def extract_text_from_docx(file_path):
+def iter_text_from_docx(file_path):
     print(f"[Ingest] Extracting text from DOCX {file_path}")
-    text = ""
     doc = docx.Document(file_path)
     for para in doc.paragraphs:
-        text += para.text + "\n"
-    return text
+        yield para.text + "\n"
+
+
+def iter_text_from_txt(file_path):
+    with open(file_path, "r", encoding="utf-8") as f:
+        while True:
+            block = f.read(TEXT_READ_CHARS)
+            if not block:
+                break
+            yield block
 
 
 def extract_youtube_transcript(url: str):
@@ -95,44 +151,102 @@ def extract_youtube_transcript(url: str):
         return ""
 
 
-# --- Chunking ---
-def split_into_chunks(text, chunk_size=1200, overlap=100):
-    sentences = re.split(r'(?<=[.!?]) +', text)  # tách theo câu đơn giản
-    chunks, current = [], ""
-
-    for sent in sentences:
-        if len(current) + len(sent) <= chunk_size:
-            current += " " + sent
-        else:
-            chunks.append(current.strip())
-            # tạo overlap bằng cách lấy phần cuối chunk trước
-            current = current[-overlap:] + " " + sent
-
-    if current.strip():
-        chunks.append(current.strip())
-
-    return chunks
+# --- Ingestion main ---
+def chunk_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
 
 
-# --- Ingestion main ---
-def ingest_document(doc: Document):
+def ingest_document(doc: Document, unchanged_if: str = None):
+    """
+    Ingest (hoặc ingest lại) 1 tài liệu theo kiểu incremental:
+    chunk có content hash không đổi được giữ nguyên (không encode lại), chỉ encode chunk mới/đã sửa
+    và chỉ xoá chunk không còn trong tài liệu. Trả về thống kê số chunk giữ/tạo/xoá và thời gian từng stage.
+    unchanged_if: content fingerprint của lần ingest hiện tại → file không đổi thì dừng ngay sau khi tải về.
+    stats["content_fingerprint"] là sha256 của nội dung đã tải.
+    Không gọi trực tiếp từ view/signal: dùng ingestion_coordinator.request_ingestion.
+    """
+    timings = {"extract_chunk": 0.0, "embed": 0.0, "persist": 0.0}
     print(f"[Ingest] Start ingesting document {doc.id} - {doc.title}")
-    text = extract_text(doc)
-    if not text.strip():
+
+    # Hash của chunk đang có (1 hash có thể xuất hiện nhiều lần trong tài liệu)
+    existing = {}
+    for chunk_id, h in Chunk.objects.filter(document=doc).values_list("id", "content_hash"):
+        existing.setdefault(h, []).append(chunk_id)
+
+    # Text → chunk → batch embedding → bulk_create chạy nối tiếp theo từng batch, không giữ cả tài liệu trong RAM.
+    # Mỗi batch ghi trong transaction riêng; chunk cũ không còn dùng được xoá ở cuối.
+    batch_size = settings.EMBEDDING_BATCH_SIZE
+    total, kept, created = 0, 0, 0
+    hasher = hashlib.sha256()
+    chunk_iter = iter_chunks_with_tokens(iter_text(doc, hasher, unchanged_if))
+    while True:
+        started = time.perf_counter()
+        try:
+            batch = list(islice(chunk_iter, batch_size))
+        except SourceUnchanged:
+            chunks = sum(len(ids) for ids in existing.values())
+            return {"chunks": chunks, "kept": chunks, "created": 0, "deleted": 0, "unchanged": True,
+                    "content_fingerprint": unchanged_if, "timings": {}}
+        timings["extract_chunk"] += time.perf_counter() - started
+        if not batch:
+            break
+        total += len(batch)
+        new_chunks = []
+        for ch, tokens in batch:
+            h = chunk_hash(ch)
+            if existing.get(h):
+                existing[h].pop()
+                kept += 1
+            else:
+                new_chunks.append((ch, h, tokens))
+        if not new_chunks:
+            continue
+        started = time.perf_counter()
+        embs = get_embeddings([ch for ch, _, _ in new_chunks], batch_size=batch_size, model_name=column_model())
+        timings["embed"] += time.perf_counter() - started
+        started = time.perf_counter()
+        with transaction.atomic():
+            Chunk.objects.bulk_create([
+                Chunk(
+                    course=doc.course,
+                    document=doc,
+                    text=ch,
+                    content_hash=h,
+                    embedding=emb.tolist(),
+                    token_count=tokens,
+                    meta={"source": doc.title}
+                )
+                for (ch, h, tokens), emb in zip(new_chunks, embs)
+            ], batch_size=batch_size)
+        timings["persist"] += time.perf_counter() - started
+        created += len(new_chunks)
+
+    if total == 0:
+        # Không đụng tới chunk cũ: có thể chỉ là lỗi tải file tạm thời
         print("[Ingest] No text extracted")
-        return
-
-    chunks = split_into_chunks(text)
-    print(f"[Ingest] {len(chunks)} chunks generated")
-
-    for ch in chunks:
-        emb = get_embedding(ch)
-        Chunk.objects.create(
-            course=doc.course,
-            document=doc,
-            text=ch,
-            embedding=emb.tolist(),
-            meta={"source": doc.title}
-        )
-
-    print(f"[Ingest] Done ingesting document {doc.id}")
+        return None
+
+    stale_ids = [chunk_id for ids in existing.values() for chunk_id in ids]
+    if stale_ids:
+        started = time.perf_counter()
+        Chunk.objects.filter(id__in=stale_ids).delete()
+        timings["persist"] += time.perf_counter() - started
+
+    stats = {
+        "chunks": total,
+        "kept": kept,
+        "created": created,
+        "deleted": len(stale_ids),
+        "embeddings_saved": kept,
+        "content_fingerprint": hasher.hexdigest(),
+        "timings": {stage: round(seconds, 3) for stage, seconds in timings.items()},
+    }
+    if created:
+        # Chunk mới cũng cần embedding của model đang backfill / phục vụ ngoài cột Chunk.embedding
+        embed_document(doc.id)
+    if created or stale_ids:
+        # Tài liệu của khoá học đã đổi → câu trả lời đã cache không còn đáng tin
+        answer_cache.invalidate_course(doc.course_id)
+        memory_index.invalidate_course(doc.course_id)
+    print(f"[Ingest] Done ingesting document {doc.id}: {stats}")
+    return stats
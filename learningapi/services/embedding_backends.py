@@ -0,0 +1,137 @@
+import json
+import os
+
+import numpy as np
+from django.conf import settings
+
+# --- Embedding backends ---
+# Cùng 1 model (tên trên HuggingFace) có thể chạy bằng nhiều runtime; registry chọn theo settings.EMBEDDING_BACKEND.
+# Mỗi backend cần: encode(texts, batch_size) → np.ndarray float32, tokenizer (HF), dimensions.
+# - "sentence-transformers": PyTorch, giống hành vi cũ
+# - "onnx": ONNX Runtime trên CPU (file onnx/model.onnx của model), tuỳ chọn lượng tử hoá int8 động, đặt số thread
+
+BACKENDS = ("sentence-transformers", "onnx")
+
+
+class SentenceTransformerBackend:
+    name = "sentence-transformers"
+
+    def __init__(self, model_name: str, threads: int = 0):
+        from sentence_transformers import SentenceTransformer
+
+        if threads:
+            import torch
+            torch.set_num_threads(threads)
+        self.model = SentenceTransformer(model_name)
+        self.tokenizer = self.model.tokenizer
+        self.dimensions = self.model.get_sentence_embedding_dimension()
+
+    def encode(self, texts, batch_size: int = 32):
+        return self.model.encode(texts, batch_size=batch_size)
+
+
+class OnnxBackend:
+    """
+    Chạy model sentence-transformers đã export sang ONNX: tokenizer HF → ONNX Runtime → pooling (mean/CLS)
+    → normalize nếu model gốc có bước Normalize. Cấu hình pooling đọc từ repo của model.
+    """
+    name = "onnx"
+
+    def __init__(self, model_name: str, threads: int = 0, quantize: bool = False):
+        try:
+            import onnxruntime as ort
+        except ImportError as e:
+            raise RuntimeError("EMBEDDING_BACKEND=onnx cần cài onnxruntime") from e
+        from huggingface_hub import hf_hub_download
+        from transformers import AutoTokenizer
+
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+        config = self._hub_json(model_name, "sentence_bert_config.json") or {}
+        self.max_seq_length = config.get("max_seq_length") or min(self.tokenizer.model_max_length, 512)
+        pooling = self._hub_json(model_name, "1_Pooling/config.json") or {}
+        self.pooling = "cls" if pooling.get("pooling_mode_cls_token") else "mean"
+        modules = self._hub_json(model_name, "modules.json") or []
+        self.normalize = any(m.get("type", "").endswith("Normalize") for m in modules)
+
+        path = hf_hub_download(model_name, "onnx/model.onnx")
+        if quantize:
+            path = self._quantized(path)
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = threads
+            options.inter_op_num_threads = 1
+        self.session = ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+        self.dimensions = 0
+        self.dimensions = int(self.encode(["dimension probe"]).shape[1])
+
+    @staticmethod
+    def _hub_json(model_name: str, filename: str):
+        from huggingface_hub import hf_hub_download
+        try:
+            with open(hf_hub_download(model_name, filename)) as f:
+                return json.load(f)
+        except Exception:
+            return None
+
+    @staticmethod
+    def _quantized(path: str) -> str:
+        """
+        Lượng tử hoá động trọng số sang int8 (1 lần, lưu cạnh file gốc). Không phụ thuộc tập lệnh CPU như
+        các file *_avx512.onnx có sẵn trên HuggingFace.
+        """
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        target = os.path.join(os.path.dirname(os.path.realpath(path)), "model_int8_dynamic.onnx")
+        if not os.path.exists(target):
+            print(f"[Embedding] Quantizing {path} → {target}")
+            quantize_dynamic(path, target, weight_type=QuantType.QInt8)
+        return target
+
+    def _encode_batch(self, texts):
+        encoded = self.tokenizer(
+            texts, padding=True, truncation=True, max_length=self.max_seq_length, return_tensors="np"
+        )
+        feeds = {k: v.astype(np.int64) for k, v in encoded.items() if k in self.input_names}
+        if "token_type_ids" in self.input_names and "token_type_ids" not in feeds:
+            feeds["token_type_ids"] = np.zeros_like(feeds["input_ids"])
+        hidden = self.session.run(None, feeds)[0]
+        if self.pooling == "cls":
+            embs = hidden[:, 0]
+        else:
+            mask = encoded["attention_mask"][..., None].astype(np.float32)
+            embs = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        if self.normalize:
+            embs = embs / np.maximum(np.linalg.norm(embs, axis=1, keepdims=True), 1e-12)
+        return embs.astype(np.float32)
+
+    def encode(self, texts, batch_size: int = 32):
+        single = isinstance(texts, str)
+        texts = [texts] if single else list(texts)
+        if not texts:
+            return np.zeros((0, self.dimensions), dtype=np.float32)
+        # Xếp theo độ dài để mỗi batch ít padding (như sentence-transformers), trả về đúng thứ tự ban đầu
+        order = np.argsort([-len(t) for t in texts], kind="stable")
+        result = None
+        for start in range(0, len(texts), batch_size):
+            idx = order[start:start + batch_size]
+            embs = self._encode_batch([texts[i] for i in idx])
+            if result is None:
+                result = np.zeros((len(texts), embs.shape[1]), dtype=np.float32)
+            result[idx] = embs
+        return result[0] if single else result
+
+
+def create_backend(model_name: str, backend: str = None, threads: int = None, quantize: bool = None):
+    """
+    Tạo backend cho model; tham số None lấy theo settings (EMBEDDING_BACKEND, EMBEDDING_THREADS, EMBEDDING_ONNX_QUANTIZE).
+    """
+    backend = backend or settings.EMBEDDING_BACKEND
+    threads = settings.EMBEDDING_THREADS if threads is None else threads
+    if backend == "onnx":
+        quantize = settings.EMBEDDING_ONNX_QUANTIZE if quantize is None else quantize
+        return OnnxBackend(model_name, threads=threads, quantize=quantize)
+    if backend == "sentence-transformers":
+        return SentenceTransformerBackend(model_name, threads=threads)
+    raise ValueError(f"Unknown embedding backend: {backend}")
@@ -0,0 +1,300 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection, transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from ..models import Chunk, ChunkEmbedding, EmbeddingModelState, IngestionJob
+from .vector_index import (
+    CHUNK_TABLE, chunk_dimensions, column_dimensions, ensure_vector_index, reset_chunk_dimensions,
+)
+
+# --- Đổi embedding model không downtime ---
+# Cột Chunk.embedding chứa embedding của column_model(): model được ghi nhận trong DB (EmbeddingModelState.in_column),
+# không suy ra từ biến môi trường, nên đổi EMBEDDING_MODEL không bao giờ làm query đọc nhầm vector của model khác.
+# Khi EMBEDDING_ACTIVE_MODEL (hoặc EMBEDDING_MODEL) trỏ sang model khác model của cột:
+# 1. backfill() encode dần mọi chunk bằng model mới vào bảng ChunkEmbedding, model cũ vẫn phục vụ query
+# 2. khi đã phủ 100% chunk: build partial index ANN cho model mới, đánh dấu ready → serving_model() chuyển sang model mới
+# 3. promote() (manage.py promote_embedding_model): chép embedding của model mới vào cột Chunk.embedding, ghi nhận
+#    model mới là model của cột, rồi xoá các dòng ChunkEmbedding của nó → ingest chỉ còn encode bằng 1 model
+# Câu hỏi luôn được encode bằng đúng model của embedding tài liệu mà nó được so sánh (serving_model()).
+
+EMBEDDING_TABLE = "learningapi_chunkembedding"
+SERVING_CACHE_SECONDS = 30
+
+_serving = {"target": None, "name": None, "checked_at": 0.0}
+_column = {"name": None, "checked_at": 0.0}
+
+
+def column_model() -> str:
+    """
+    Model có embedding trong cột Chunk.embedding. Chưa promote lần nào thì ghi nhận settings.EMBEDDING_MODEL
+    (model đã dùng để ingest từ trước). Kết quả được nhớ trong process SERVING_CACHE_SECONDS giây.
+    """
+    now = time.monotonic()
+    if _column["name"] is None or now - _column["checked_at"] > SERVING_CACHE_SECONDS:
+        name = EmbeddingModelState.objects.filter(in_column=True).values_list("name", flat=True).first()
+        if name is None:
+            name = settings.EMBEDDING_MODEL
+            state, created = EmbeddingModelState.objects.get_or_create(
+                name=name, defaults={"dimensions": chunk_dimensions(), "in_column": True, "ready_at": timezone.now()}
+            )
+            if not created and not state.in_column:
+                # Model này đang được backfill vào ChunkEmbedding → cột vẫn chứa model cũ, không đoán được là model nào
+                raise ImproperlyConfigured(
+                    f"EMBEDDING_MODEL={name} is a backfilled model, not the model stored in Chunk.embedding. "
+                    "Set EMBEDDING_MODEL back to the column's model and run `manage.py promote_embedding_model`."
+                )
+        _column.update(name=name, checked_at=now)
+    return _column["name"]
+
+
+def secondary_model():
+    """
+    Model được cấu hình để thay cho cột Chunk.embedding, hoặc None nếu cấu hình trùng model của cột.
+    """
+    active = settings.EMBEDDING_ACTIVE_MODEL or settings.EMBEDDING_MODEL
+    return active if active != column_model() else None
+
+
+def uses_chunk_column(model_name: str) -> bool:
+    return not model_name or model_name == column_model()
+
+
+def serving_model() -> str:
+    """
+    Model dùng cho query lúc này: model mới nếu đã backfill xong, ngược lại model của cột Chunk.embedding.
+    Kết quả được nhớ trong process SERVING_CACHE_SECONDS giây.
+    """
+    target = secondary_model()
+    if target is None:
+        return column_model()
+    now = time.monotonic()
+    if _serving["target"] != target or now - _serving["checked_at"] > SERVING_CACHE_SECONDS:
+        ready = EmbeddingModelState.objects.filter(name=target, ready_at__isnull=False).exists()
+        _serving.update(target=target, name=target if ready else column_model(), checked_at=now)
+    return _serving["name"]
+
+
+def index_prefix(model_name: str) -> str:
+    # Tên index Postgres tối đa 63 ký tự → dùng hash của tên model
+    return f"chunkemb_{hashlib.sha1(model_name.encode('utf-8')).hexdigest()[:12]}"
+
+
+def index_where(model_name: str) -> str:
+    return "model_name = '{}'".format(model_name.replace("'", "''"))
+
+
+def ensure_model_index(model_name: str, dimensions: int):
+    """
+    Partial index ANN trên (embedding::vector(n)) cho riêng 1 model. Query phải ép kiểu giống hệt để dùng được index.
+    """
+    ensure_vector_index(
+        table=EMBEDDING_TABLE,
+        column="embedding",
+        expression=f"embedding::vector({int(dimensions)})",
+        name_prefix=index_prefix(model_name),
+        where=index_where(model_name),
+    )
+
+
+def missing_chunks(model_name: str):
+    return Chunk.objects.filter(
+        ~Exists(ChunkEmbedding.objects.filter(chunk=OuterRef("pk"), model_name=model_name))
+    )
+
+
+def embed_chunks(chunks, model_name: str) -> int:
+    from . import memory_index
+    from .rag_service import get_embeddings
+
+    chunks = list(chunks)
+    if not chunks:
+        return 0
+    embs = get_embeddings([c.text for c in chunks], model_name=model_name)
+    ChunkEmbedding.objects.bulk_create(
+        [ChunkEmbedding(chunk_id=c.id, model_name=model_name, embedding=emb.tolist()) for c, emb in zip(chunks, embs)],
+        ignore_conflicts=True,
+    )
+    # Khoá học có index trong process của model này phải load lại
+    for course_id in Chunk.objects.filter(id__in=[c.id for c in chunks]).values_list("course_id", flat=True).distinct():
+        memory_index.invalidate_course(course_id)
+    return len(chunks)
+
+
+def embed_document(document_id) -> int:
+    """
+    Gọi sau khi ingest: encode chunk mới của tài liệu bằng model đang backfill/phục vụ ngoài cột Chunk.embedding.
+    """
+    model_name = secondary_model()
+    if model_name is None:
+        return 0
+    batch_size = settings.EMBEDDING_BATCH_SIZE
+    created = 0
+    while True:
+        rows = list(missing_chunks(model_name).filter(document_id=document_id).only("id", "text").order_by("id")[:batch_size])
+        if not rows:
+            return created
+        created += embed_chunks(rows, model_name)
+
+
+def backfill(model_name: str = None, max_batches: int = None, batch_size: int = None):
+    """
+    Encode các chunk chưa có embedding của model (mặc định EMBEDDING_ACTIVE_MODEL), tối đa max_batches batch.
+    Khi đã phủ 100%: build index và chuyển model sang ready. Trả về thống kê, hoặc None nếu không có gì để backfill.
+    """
+    from . import answer_cache
+    from .embedding_registry import get_model
+
+    model_name = model_name or secondary_model()
+    if model_name is None:
+        return None
+    dimensions = get_model(model_name).dimensions
+    state, _ = EmbeddingModelState.objects.get_or_create(name=model_name, defaults={"dimensions": dimensions})
+    batch_size = batch_size or settings.EMBEDDING_BATCH_SIZE
+
+    started = time.perf_counter()
+    embedded, batches = 0, 0
+    while max_batches is None or batches < max_batches:
+        rows = list(missing_chunks(model_name).only("id", "text").order_by("id")[:batch_size])
+        if not rows:
+            break
+        embedded += embed_chunks(rows, model_name)
+        batches += 1
+    elapsed = time.perf_counter() - started
+
+    state.embedded_chunks = ChunkEmbedding.objects.filter(model_name=model_name).count()
+    state.total_chunks = Chunk.objects.count()
+    complete = not missing_chunks(model_name).exists()
+    if complete and state.ready_at is None:
+        ensure_model_index(model_name, dimensions)
+        state.ready_at = timezone.now()
+        # Câu trả lời đã cache được so khớp bằng embedding câu hỏi của model cũ
+        answer_cache.invalidate_all()
+        print(f"[Embedding] {model_name} covers all {state.total_chunks} chunks → now serving queries")
+    state.save()
+
+    rate = embedded / elapsed if elapsed > 0 else 0.0
+    print(f"[Embedding] Backfill {model_name}: +{embedded} chunks in {elapsed:.1f}s ({rate:.1f} chunks/s), "
+          f"coverage {state.embedded_chunks}/{state.total_chunks}")
+    return {
+        "model": model_name,
+        "embedded": embedded,
+        "embedded_chunks": state.embedded_chunks,
+        "total_chunks": state.total_chunks,
+        "coverage": round(state.coverage, 4),
+        "complete": complete,
+        "ready": state.ready_at is not None,
+    }
+
+
+def promote(model_name: str = None, resize: bool = False, wait_seconds: int = SERVING_CACHE_SECONDS) -> dict:
+    """
+    Kết thúc việc đổi model: chép embedding của model (phải đã ready) từ ChunkEmbedding vào cột Chunk.embedding,
+    build lại index ANN của cột và ghi nhận model là model của cột. Đợi wait_seconds để mọi process thấy model mới
+    của cột rồi mới xoá các dòng ChunkEmbedding và partial index của model.
+    resize=True: model mới khác số chiều → thay cột bằng cột vector(n) mới (khoá bảng Chunk trong lúc chép).
+    """
+    model_name = model_name or secondary_model()
+    old_model = column_model()
+    if model_name is None or model_name == old_model:
+        raise ValueError(f"{model_name or old_model} is already the model of Chunk.embedding")
+    state = EmbeddingModelState.objects.filter(name=model_name).first()
+    if state is None or state.ready_at is None:
+        raise ValueError(f"{model_name} is not ready: run backfill_embeddings until it covers every chunk")
+    current_dims = column_dimensions() or chunk_dimensions()
+    if state.dimensions != current_dims and not resize:
+        raise ValueError(
+            f"{model_name} has {state.dimensions} dimensions but Chunk.embedding has {current_dims}: use --resize"
+        )
+    if resize and IngestionJob.objects.filter(state__in=IngestionJob.ACTIVE_STATES).exists():
+        # Embedding đã lưu tạm ở IngestionChunk có số chiều của model cũ
+        raise ValueError("Ingestion jobs are running: wait for them to finish before resizing Chunk.embedding")
+
+    started = time.perf_counter()
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            # Chặn ingest ghi Chunk trong lúc chép (query đọc vẫn chạy); chunk mới nhất có thể chưa có embedding mới
+            cursor.execute(f"LOCK TABLE {CHUNK_TABLE} IN SHARE ROW EXCLUSIVE MODE")
+            embed_chunks(missing_chunks(model_name).only("id", "text"), model_name)
+            source = (
+                f"SELECT chunk_id, embedding::vector({int(state.dimensions)}) AS embedding FROM {EMBEDDING_TABLE} "
+                f"WHERE model_name = %s"
+            )
+            if state.dimensions == current_dims:
+                cursor.execute(
+                    f"UPDATE {CHUNK_TABLE} c SET embedding = e.embedding FROM ({source}) e WHERE e.chunk_id = c.id",
+                    [model_name],
+                )
+                copied = cursor.rowcount
+            else:
+                # Đổi kiểu cột cần khoá ghi lẫn đọc: query chờ tới khi transaction commit
+                cursor.execute(f"ALTER TABLE {CHUNK_TABLE} ADD COLUMN embedding_next vector({int(state.dimensions)})")
+                cursor.execute(
+                    f"UPDATE {CHUNK_TABLE} c SET embedding_next = e.embedding FROM ({source}) e WHERE e.chunk_id = c.id",
+                    [model_name],
+                )
+                copied = cursor.rowcount
+                # Index ANN trên cột cũ bị xoá cùng cột
+                cursor.execute(f"ALTER TABLE {CHUNK_TABLE} DROP COLUMN embedding")
+                cursor.execute(f"ALTER TABLE {CHUNK_TABLE} RENAME COLUMN embedding_next TO embedding")
+                cursor.execute(f"ALTER TABLE {CHUNK_TABLE} ALTER COLUMN embedding SET NOT NULL")
+                cursor.execute(
+                    f"ALTER TABLE learningapi_ingestionchunk ALTER COLUMN embedding TYPE vector({int(state.dimensions)}) "
+                    f"USING NULL"
+                )
+        ensure_vector_index(rebuild=True, dimensions=state.dimensions)
+        EmbeddingModelState.objects.filter(in_column=True).update(in_column=False)
+        state.in_column = True
+        state.save(update_fields=["in_column", "updated_at"])
+    _column.update(name=model_name, checked_at=time.monotonic())
+    # hybrid_search / vector_index đọc lại số chiều của cột (process khác: sau CHUNK_DIMENSIONS_CACHE_SECONDS)
+    reset_chunk_dimensions()
+    print(f"[Embedding] {model_name} promoted to Chunk.embedding (was {old_model}) in {time.perf_counter() - started:.1f}s")
+
+    # Process khác còn nhớ model cũ của cột tối đa SERVING_CACHE_SECONDS giây và vẫn đọc ChunkEmbedding của model mới
+    time.sleep(wait_seconds)
+    retired = retire_embeddings(model_name)
+    return {"model": model_name, "previous_model": old_model, "chunks": copied, "retired_embeddings": retired,
+            "dimensions": state.dimensions}
+
+
+def retire_embeddings(model_name: str) -> int:
+    """
+    Xoá embedding trong ChunkEmbedding và partial index ANN của 1 model (sau khi đã promote vào cột).
+    """
+    from .vector_index import INDEX_TYPES
+
+    deleted, _ = ChunkEmbedding.objects.filter(model_name=model_name).delete()
+    if connection.vendor == "postgresql":
+        with connection.cursor() as cursor:
+            for kind in INDEX_TYPES:
+                cursor.execute(f"DROP INDEX IF EXISTS {index_prefix(model_name)}_{kind}")
+    print(f"[Embedding] Retired {deleted} ChunkEmbedding rows of {model_name}")
+    return deleted
+
+
+def status() -> dict:
+    """
+    Model đang phục vụ query và tiến độ backfill của các model (cho trang metrics của admin).
+    """
+    return {
+        "column_model": column_model(),
+        "active_model": settings.EMBEDDING_ACTIVE_MODEL,
+        "serving_model": serving_model(),
+        "models": [
+            {
+                "name": state.name,
+                "dimensions": state.dimensions,
+                "embedded_chunks": state.embedded_chunks,
+                "total_chunks": state.total_chunks,
+                "coverage": round(state.coverage, 4),
+                "ready_at": state.ready_at,
+                "in_column": state.in_column,
+            }
+            for state in EmbeddingModelState.objects.order_by("name")
+        ],
+    }
@@ -0,0 +1,195 @@
+import os
+import resource
+import threading
+import time
+
+from django.conf import settings
+
+# --- Embedding model registry ---
+# Mỗi process (gunicorn worker / celery worker) chỉ load mỗi model đúng 1 lần.
+# Trước đây get_embedding() tạo SentenceTransformer mới cho mỗi lần gọi → mỗi câu hỏi
+# và mỗi chunk đều phải load lại model từ disk.
+# Model chạy bằng backend chọn theo settings.EMBEDDING_BACKEND (xem embedding_backends.py).
+
+_registry = {}
+_tokenizers = {}
+_registry_lock = threading.Lock()
+
+
+def _current_rss_mb() -> float:
+    """
+    Bộ nhớ resident hiện tại của process (MB). Đọc /proc nếu có, nếu không thì dùng peak RSS.
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        # ru_maxrss tính bằng KB trên Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class TokenizerHandle:
+    """
+    Chỉ tokenizer của 1 embedding model (vài MB), cho code chỉ cần đếm/cắt token như chunker ở stage extract:
+    không load trọng số model. Cùng lock như EmbeddingModelHandle vì tokenizer HF không an toàn khi nhiều thread gọi.
+    """
+
+    def __init__(self, name: str, tokenizer):
+        self.name = name
+        self.tokenizer = tokenizer
+        self._lock = threading.Lock()
+
+    def count_tokens(self, texts) -> list:
+        """
+        Số token của từng text, không tính token đặc biệt.
+        """
+        with self._lock:
+            encoded = self.tokenizer(list(texts), add_special_tokens=False)["input_ids"]
+        return [len(ids) for ids in encoded]
+
+    def token_offsets(self, text: str) -> list:
+        """
+        Vị trí (start, end) trong text của từng token.
+        """
+        with self._lock:
+            encoded = self.tokenizer(text, add_special_tokens=False, return_offsets_mapping=True)
+        return encoded["offset_mapping"]
+
+
+class EmbeddingModelHandle:
+    """
+    Handle thread-safe cho 1 embedding model đã load.
+    Tokenizer của HuggingFace không an toàn khi nhiều thread cùng encode,
+    nên mọi lời gọi encode() đều đi qua lock riêng của model.
+    """
+
+    def __init__(self, name: str, model, load_seconds: float, rss_delta_mb: float):
+        self.name = name
+        self.model = model  # backend: encode(), tokenizer, dimensions
+        self.load_seconds = load_seconds
+        self.rss_delta_mb = rss_delta_mb
+        self.loaded_at = time.time()
+        self.encode_calls = 0
+        self._lock = threading.Lock()
+
+    @property
+    def dimensions(self) -> int:
+        return self.model.dimensions
+
+    def encode(self, texts, **kwargs):
+        with self._lock:
+            self.encode_calls += 1
+            return self.model.encode(texts, **kwargs)
+
+    def count_tokens(self, texts) -> list:
+        """
+        Số token (theo tokenizer của model) của từng text, không tính token đặc biệt.
+        """
+        with self._lock:
+            encoded = self.model.tokenizer(list(texts), add_special_tokens=False)["input_ids"]
+        return [len(ids) for ids in encoded]
+
+    def token_offsets(self, text: str) -> list:
+        """
+        Vị trí (start, end) trong text của từng token, dùng để cắt câu dài đúng ranh giới token.
+        """
+        with self._lock:
+            encoded = self.model.tokenizer(text, add_special_tokens=False, return_offsets_mapping=True)
+        return encoded["offset_mapping"]
+
+    def stats(self) -> dict:
+        return {
+            "model": self.name,
+            "backend": self.model.name,
+            "dimensions": self.dimensions,
+            "load_seconds": round(self.load_seconds, 3),
+            "rss_delta_mb": round(self.rss_delta_mb, 1),
+            "encode_calls": self.encode_calls,
+            "loaded_at": self.loaded_at,
+        }
+
+
+def _load_model(name: str, backend: str) -> EmbeddingModelHandle:
+    from .embedding_backends import create_backend
+
+    rss_before = _current_rss_mb()
+    started = time.perf_counter()
+    model = create_backend(name, backend)
+    load_seconds = time.perf_counter() - started
+    rss_delta = _current_rss_mb() - rss_before
+    print(f"[Embedding] Loaded {name} ({backend}) in {load_seconds:.2f}s (+{rss_delta:.0f} MB RSS, pid {os.getpid()})")
+    return EmbeddingModelHandle(name, model, load_seconds, rss_delta)
+
+
+def get_model(name: str = None, backend: str = None) -> EmbeddingModelHandle:
+    """
+    Lấy handle của model (mặc định settings.EMBEDDING_MODEL, backend settings.EMBEDDING_BACKEND),
+    load nếu chưa có trong process.
+    """
+    name = name or settings.EMBEDDING_MODEL
+    backend = backend or settings.EMBEDDING_BACKEND
+    key = (name, backend)
+    handle = _registry.get(key)
+    if handle is not None:
+        return handle
+    with _registry_lock:
+        # Kiểm tra lại sau khi có lock để 2 thread không cùng load 1 model
+        handle = _registry.get(key)
+        if handle is None:
+            handle = _load_model(name, backend)
+            _registry[key] = handle
+    return handle
+
+
+def get_tokenizer(name: str = None) -> TokenizerHandle:
+    """
+    Tokenizer của model (mặc định settings.EMBEDDING_MODEL), load 1 lần mỗi process bằng AutoTokenizer.
+    Model đã load sẵn trong process thì dùng lại tokenizer của nó.
+    """
+    from transformers import AutoTokenizer
+
+    name = name or settings.EMBEDDING_MODEL
+    handle = _tokenizers.get(name)
+    if handle is not None:
+        return handle
+    with _registry_lock:
+        handle = _tokenizers.get(name)
+        if handle is None:
+            loaded = next((h for (n, _), h in _registry.items() if n == name), None)
+            tokenizer = loaded.model.tokenizer if loaded else AutoTokenizer.from_pretrained(name)
+            handle = TokenizerHandle(name, tokenizer)
+            _tokenizers[name] = handle
+    return handle
+
+
+def warm_up(names=None):
+    """
+    Load và chạy thử 1 lần encode cho các model cấu hình sẵn.
+    Gọi khi gunicorn worker / celery worker khởi động để request đầu tiên không phải chờ load model.
+    """
+    if not getattr(settings, "EMBEDDING_WARMUP", True):
+        return
+    if settings.EMBEDDING_SERVER_URL:
+        # Model nằm ở embedding server; worker chỉ load model khi server không trả lời (fallback)
+        return
+    names = names or settings.EMBEDDING_PRELOAD_MODELS
+    for name in names:
+        try:
+            handle = get_model(name)
+            handle.encode(["warm up"])
+        except Exception as e:
+            # Không để lỗi warm-up làm chết worker, lần gọi thật sẽ thử load lại
+            print(f"[Embedding] Warm-up failed for {name}: {e}")
+
+
+def registry_stats() -> dict:
+    """
+    Thông tin các model đang load trong process hiện tại (dùng để ước lượng RAM cho worker).
+    """
+    return {
+        "pid": os.getpid(),
+        "rss_mb": round(_current_rss_mb(), 1),
+        "models": [h.stats() for h in _registry.values()],
+        "tokenizers": sorted(_tokenizers),
+    }
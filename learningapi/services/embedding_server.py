@@ -0,0 +1,256 @@
+import asyncio
+import json
+import os
+import socket
+import struct
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+import numpy as np
+from django.conf import settings
+
+# --- Embedding server (sidecar) ---
+# 1 process giữ embedding model và phục vụ mọi gunicorn/celery worker trên cùng máy qua Unix socket hoặc localhost:
+# - RAM: model chỉ load 1 lần thay vì 1 lần/worker
+# - micro-batching: các request tới gần nhau (trong EMBEDDING_SERVER_MAX_WAIT_MS) được encode chung 1 batch
+# Giao thức: mỗi message = 4 byte độ dài (big-endian) + JSON. Response thành công kèm ngay sau đó
+# n*d số float32 (little-endian) của ma trận embedding.
+# Chạy server: `python manage.py embedding_server`; bật phía client bằng settings.EMBEDDING_SERVER_URL.
+
+HEADER = struct.Struct("!I")
+
+
+def parse_url(url: str):
+    """
+    "unix:///path/to.sock" → ("unix", path); "tcp://127.0.0.1:8765" → ("tcp", (host, port)).
+    """
+    parsed = urlparse(url)
+    if parsed.scheme == "unix":
+        return "unix", parsed.path
+    if parsed.scheme == "tcp":
+        return "tcp", (parsed.hostname or "127.0.0.1", parsed.port or 8765)
+    raise ValueError(f"Unsupported EMBEDDING_SERVER_URL: {url}")
+
+
+def _pack(obj) -> bytes:
+    payload = json.dumps(obj).encode("utf-8")
+    return HEADER.pack(len(payload)) + payload
+
+
+# --- Server ---
+class MicroBatcher:
+    """
+    Gom các request của 1 model: đợi tối đa max_wait giây sau request đầu tiên hoặc tới khi đủ max_batch câu,
+    encode 1 lần trong thread riêng rồi chia kết quả về cho từng request.
+    """
+
+    def __init__(self, model_name: str, max_batch: int, max_wait: float):
+        self.model_name = model_name
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.queue = asyncio.Queue()
+        # 1 thread: model encode tuần tự, song song hoá nằm trong torch/onnxruntime
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.batches = 0
+        self.requests = 0
+        self.texts = 0
+
+    async def submit(self, texts):
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((texts, future))
+        return await future
+
+    def _encode(self, texts):
+        from .embedding_registry import get_model
+
+        embs = get_model(self.model_name).encode(texts, batch_size=max(len(texts), 1))
+        return np.asarray(embs, dtype=np.float32).reshape(len(texts), -1)
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            items = [await self.queue.get()]
+            count = len(items[0][0])
+            deadline = loop.time() + self.max_wait
+            while count < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                items.append(item)
+                count += len(item[0])
+
+            texts = [t for batch, _ in items for t in batch]
+            try:
+                embs = await loop.run_in_executor(self.executor, self._encode, texts)
+            except Exception as e:
+                for _, future in items:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            offset = 0
+            for batch, future in items:
+                if not future.done():
+                    future.set_result(embs[offset:offset + len(batch)])
+                offset += len(batch)
+
+            self.batches += 1
+            self.requests += len(items)
+            self.texts += len(texts)
+            if self.batches % 100 == 0:
+                print(f"[EmbeddingServer] {self.model_name}: {self.batches} batches, "
+                      f"{self.requests / self.batches:.1f} requests/batch, {self.texts / self.batches:.1f} texts/batch")
+
+
+class EmbeddingServer:
+    def __init__(self, url: str = None, max_batch: int = None, max_wait_ms: float = None):
+        self.url = url or settings.EMBEDDING_SERVER_URL
+        self.max_batch = max_batch or settings.EMBEDDING_SERVER_MAX_BATCH
+        self.max_wait = (settings.EMBEDDING_SERVER_MAX_WAIT_MS if max_wait_ms is None else max_wait_ms) / 1000
+        self.batchers = {}
+
+    def batcher(self, model_name: str) -> MicroBatcher:
+        batcher = self.batchers.get(model_name)
+        if batcher is None:
+            batcher = MicroBatcher(model_name, self.max_batch, self.max_wait)
+            self.batchers[model_name] = batcher
+            asyncio.get_running_loop().create_task(batcher.run())
+        return batcher
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                try:
+                    (length,) = HEADER.unpack(await reader.readexactly(HEADER.size))
+                    request = json.loads(await reader.readexactly(length))
+                except asyncio.IncompleteReadError:
+                    break
+                if request.get("op") == "stats":
+                    writer.write(_pack({"ok": True, "stats": self.stats()}))
+                    await writer.drain()
+                    continue
+                try:
+                    model_name = request.get("model") or settings.EMBEDDING_MODEL
+                    embs = await self.batcher(model_name).submit(list(request["texts"]))
+                except Exception as e:
+                    writer.write(_pack({"ok": False, "error": str(e)}))
+                else:
+                    writer.write(_pack({"ok": True, "shape": list(embs.shape)}))
+                    writer.write(np.ascontiguousarray(embs, dtype="<f4").tobytes())
+                await writer.drain()
+        finally:
+            writer.close()
+
+    def stats(self) -> dict:
+        return {
+            name: {"batches": b.batches, "requests": b.requests, "texts": b.texts}
+            for name, b in self.batchers.items()
+        }
+
+    async def serve(self):
+        kind, address = parse_url(self.url)
+        if kind == "unix":
+            if os.path.exists(address):
+                os.unlink(address)
+            server = await asyncio.start_unix_server(self.handle, path=address)
+        else:
+            server = await asyncio.start_server(self.handle, host=address[0], port=address[1])
+        print(f"[EmbeddingServer] Listening on {self.url} (max batch {self.max_batch}, "
+              f"max wait {self.max_wait * 1000:.1f}ms, pid {os.getpid()})")
+        async with server:
+            await server.serve_forever()
+
+
+# --- Client ---
+class ServerDown(ConnectionError):
+    """
+    Server vừa lỗi kết nối, chưa hết thời gian chờ trước khi thử lại.
+    """
+
+
+class EmbeddingServerClient:
+    """
+    Client đồng bộ, mỗi thread giữ 1 kết nối. Lỗi kết nối → đánh dấu server down trong
+    EMBEDDING_SERVER_RETRY_SECONDS giây để các request sau encode trong process ngay, không chờ timeout.
+    """
+
+    def __init__(self, url: str, timeout: float):
+        self.url = url
+        self.kind, self.address = parse_url(url)
+        self.timeout = timeout
+        self._local = threading.local()
+        self._down_until = 0.0
+
+    def _connect(self):
+        if self.kind == "unix":
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            sock.connect(self.address)
+        else:
+            sock = socket.create_connection(self.address, timeout=self.timeout)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return sock
+
+    @staticmethod
+    def _recv_exact(sock, n: int) -> bytes:
+        buf = bytearray()
+        while len(buf) < n:
+            part = sock.recv(n - len(buf))
+            if not part:
+                raise ConnectionError("Embedding server closed the connection")
+            buf.extend(part)
+        return bytes(buf)
+
+    def _call(self, request):
+        if time.monotonic() < self._down_until:
+            raise ServerDown(f"Embedding server {self.url} marked down")
+        sock = getattr(self._local, "sock", None)
+        try:
+            if sock is None:
+                sock = self._local.sock = self._connect()
+            sock.sendall(_pack(request))
+            (length,) = HEADER.unpack(self._recv_exact(sock, HEADER.size))
+            response = json.loads(self._recv_exact(sock, length))
+            if not response.get("ok"):
+                # lỗi phía model (không phải lỗi kết nối): giữ kết nối
+                raise RuntimeError(response.get("error") or "Embedding server error")
+            if "shape" in response:
+                n, d = response["shape"]
+                data = self._recv_exact(sock, n * d * 4)
+                return np.frombuffer(data, dtype="<f4").reshape(n, d).astype(np.float32)
+            return response
+        except (OSError, ConnectionError, ValueError):
+            if sock is not None:
+                sock.close()
+            self._local.sock = None
+            self._down_until = time.monotonic() + settings.EMBEDDING_SERVER_RETRY_SECONDS
+            raise
+
+    def encode(self, texts, model_name: str) -> np.ndarray:
+        return self._call({"model": model_name, "texts": list(texts)})
+
+    def stats(self) -> dict:
+        return self._call({"op": "stats"})["stats"]
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """
+    Client dùng chung trong process, hoặc None nếu không cấu hình EMBEDDING_SERVER_URL.
+    """
+    global _client
+    if not settings.EMBEDDING_SERVER_URL:
+        return None
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = EmbeddingServerClient(settings.EMBEDDING_SERVER_URL, settings.EMBEDDING_SERVER_TIMEOUT)
+    return _client
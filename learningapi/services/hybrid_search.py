@@ -0,0 +1,148 @@
+from django.conf import settings
+
+from .embedding_models import uses_chunk_column
+from .retrieval import SELECT_COLUMNS, fetch_chunks, to_db_vector
+from .vector_index import approx_distance_sql, chunk_dimensions
+
+# --- Hybrid retrieval: full-text (tsvector) + vector, gộp bằng reciprocal rank fusion ---
+# Embedding MiniLM yếu với thuật ngữ tiếng Việt chính xác, tên hàm/biến trong code, tên công thức...
+# Nhánh full-text bắt được các từ khoá đó; RRF gộp 2 danh sách theo thứ hạng nên không cần chuẩn hoá điểm.
+# Cả 2 nhánh chạy trong 1 câu SQL (1 round-trip).
+
+HYBRID_SQL = """
+WITH vec AS (
+    SELECT id, row_number() OVER (ORDER BY dist) AS rank
+    FROM (
+        {vec_candidates}
+    ) v
+),
+lex AS (
+    SELECT id, row_number() OVER (ORDER BY score DESC) AS rank
+    FROM (
+        -- plainto_tsquery nối các từ bằng AND, đổi thành OR để câu hỏi dài vẫn khớp được
+        SELECT c.id, ts_rank_cd(c.search_vector, query) AS score
+        FROM learningapi_chunk c,
+            to_tsquery('simple', replace(plainto_tsquery('simple', %(question)s)::text, ' & ', ' | ')) query
+        WHERE c.course_id = %(course_id)s AND c.search_vector @@ query
+        ORDER BY score DESC
+        LIMIT %(candidates)s
+    ) l
+)
+SELECT {columns},
+    {distance} AS distance,
+    COALESCE(1.0 / (%(rrf_k)s + vec.rank), 0) + COALESCE(1.0 / (%(rrf_k)s + lex.rank), 0) AS rrf_score
+FROM vec
+FULL OUTER JOIN lex ON lex.id = vec.id
+JOIN learningapi_chunk c ON c.id = COALESCE(vec.id, lex.id)
+JOIN learningapi_document d ON d.id = c.document_id
+ORDER BY rrf_score DESC
+LIMIT %(limit)s
+"""
+
+# Nhánh vector trên cột Chunk.embedding (EMBEDDING_MODEL): lấy approx_candidates ứng viên theo khoảng cách trên index
+# (có thể lượng tử hoá, xem VECTOR_QUANTIZATION) rồi xếp lại bằng cosine distance float32
+COLUMN_CANDIDATES = """SELECT id, embedding <=> %(q_emb)s::vector AS dist
+        FROM (
+            SELECT id, embedding
+            FROM learningapi_chunk
+            WHERE course_id = %(course_id)s
+            ORDER BY {approx_distance}
+            LIMIT %(approx_candidates)s
+        ) a
+        ORDER BY dist
+        LIMIT %(candidates)s"""
+COLUMN_DISTANCE = "c.embedding <=> %(q_emb)s::vector"
+
+# Nhánh vector trên bảng ChunkEmbedding cho model khác; ép kiểu vector(n) giống partial index của model đó
+MODEL_CANDIDATES = """SELECT e.chunk_id AS id, (e.embedding::vector({dims})) <=> %(q_emb)s::vector AS dist
+        FROM learningapi_chunkembedding e
+        JOIN learningapi_chunk ch ON ch.id = e.chunk_id
+        WHERE e.model_name = %(model_name)s AND ch.course_id = %(course_id)s
+        ORDER BY (e.embedding::vector({dims})) <=> %(q_emb)s::vector
+        LIMIT %(candidates)s"""
+MODEL_DISTANCE = """(SELECT (e.embedding::vector({dims})) <=> %(q_emb)s::vector
+        FROM learningapi_chunkembedding e WHERE e.chunk_id = c.id AND e.model_name = %(model_name)s)"""
+
+
+def hybrid_search(course, question: str, q_emb, limit: int = None, candidates: int = None, model_name: str = None):
+    """
+    Trả về list RetrievedChunk (kèm .distance, .rrf_score) xếp theo điểm RRF.
+    model_name: embedding model của q_emb (mặc định EMBEDDING_MODEL, tức cột Chunk.embedding).
+    Phải gọi bên trong vector_search_session để tham số ef_search/probes có hiệu lực.
+    """
+    candidates = candidates or settings.HYBRID_CANDIDATES
+    if uses_chunk_column(model_name):
+        sql = HYBRID_SQL.format(
+            vec_candidates=COLUMN_CANDIDATES.format(approx_distance=chunk_approx_distance()),
+            distance=COLUMN_DISTANCE,
+            columns=SELECT_COLUMNS,
+        )
+    else:
+        dims = int(len(q_emb))
+        sql = HYBRID_SQL.format(
+            vec_candidates=MODEL_CANDIDATES.format(dims=dims),
+            distance=MODEL_DISTANCE.format(dims=dims),
+            columns=SELECT_COLUMNS,
+        )
+    params = {
+        "course_id": course.id,
+        "q_emb": to_db_vector(q_emb),
+        "question": question,
+        "candidates": candidates,
+        "approx_candidates": approx_candidate_count(candidates),
+        "rrf_k": settings.HYBRID_RRF_K,
+        "limit": limit or settings.RAG_CANDIDATES,
+        "model_name": model_name,
+    }
+    return fetch_chunks(sql, params)
+
+
+# --- Vector search trên index lượng tử hoá + re-rank float32 ---
+VECTOR_SQL = """
+SELECT {columns},
+    c.embedding <=> %(q_emb)s::vector AS distance
+FROM (
+    SELECT id, {approx_distance} AS approx_dist
+    FROM learningapi_chunk
+    WHERE course_id = %(course_id)s
+    ORDER BY {approx_distance}
+    LIMIT %(approx_candidates)s
+) a
+JOIN learningapi_chunk c ON c.id = a.id
+JOIN learningapi_document d ON d.id = c.document_id
+ORDER BY {order_by}
+LIMIT %(limit)s
+"""
+
+
+def chunk_approx_distance() -> str:
+    return approx_distance_sql(settings.VECTOR_QUANTIZATION, chunk_dimensions())
+
+
+def approx_candidate_count(limit: int) -> int:
+    """
+    Số ứng viên lấy từ index: nhiều hơn limit khi re-rank để bù sai số của index lượng tử hoá.
+    """
+    if settings.VECTOR_QUANTIZATION != "none" and settings.VECTOR_RERANK:
+        return max(limit, settings.VECTOR_RERANK_CANDIDATES)
+    return limit
+
+
+def quantized_vector_search(course, q_emb, limit: int = None):
+    """
+    Top-k theo cosine distance dùng index lượng tử hoá (VECTOR_QUANTIZATION != "none").
+    VECTOR_RERANK=True: các ứng viên được xếp lại bằng embedding float32; .distance luôn là cosine distance thật.
+    """
+    limit = limit or settings.RAG_CANDIDATES
+    sql = VECTOR_SQL.format(
+        approx_distance=chunk_approx_distance(),
+        order_by="distance" if settings.VECTOR_RERANK else "a.approx_dist",
+        columns=SELECT_COLUMNS,
+    )
+    params = {
+        "course_id": course.id,
+        "q_emb": to_db_vector(q_emb),
+        "approx_candidates": approx_candidate_count(limit),
+        "limit": limit,
+    }
+    return fetch_chunks(sql, params)
@@ -0,0 +1,204 @@
+import hashlib
+import os
+import threading
+import time
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.utils import timezone
+
+from ..models import Document, IngestionJob
+
+# --- Ingestion coordinator ---
+# Điểm vào duy nhất để ingest tài liệu (view, signal, admin đều gọi request_ingestion):
+# - signal chỉ gọi khi file/url đổi; kiểm tra lại nội dung ở cùng file/url là endpoint riêng POST /documents/<id>/reingest/
+# - mỗi phiên bản nguồn (file/url) của Document có tối đa 1 job đang chờ/chạy → trigger lặp lại gộp thành 1
+# - job đã xong KHÔNG chặn lần ingest sau: cùng url/public_id vẫn có thể đổi nội dung (trang web sửa, upload đè,
+#   quay lại file cũ). Job mới so content fingerprint với lần ingest hiện tại (current_job) và dừng sớm nếu không đổi;
+#   nội dung đổi 1 phần thì chỉ encode các chunk có content hash mới
+# - job chạy trên Celery theo pipeline extract → embed → persist (hoặc cả job trong 1 thread khi dev không có broker),
+#   không bao giờ chạy trong request
+# - mọi tiến trình ghi Chunk của 1 tài liệu (run_job, pipeline, reindex_chunks) phải claim tài liệu trước
+#   (claim_document): job ở trạng thái running là khoá theo tài liệu, giữ từ extract tới persist kể cả khi các stage
+#   chạy trên nhiều worker; job khác của cùng tài liệu nhận DocumentBusy và chạy lại sau
+
+BUSY_RETRY_SECONDS = 30
+
+
+class DocumentBusy(Exception):
+    """
+    Đang có job khác (ingest, pipeline hoặc reindex) của cùng tài liệu chạy → job này phải đợi (gọi lại sau).
+    """
+
+
+def document_version(doc: Document) -> str:
+    return hashlib.sha256(f"{doc.file or ''}|{doc.url or ''}".encode("utf-8")).hexdigest()
+
+
+def current_job(doc) -> IngestionJob:
+    """
+    Job đã ingest nội dung đang có trong Chunk của tài liệu (job succeeded mới nhất), None nếu chưa ingest lần nào.
+    """
+    return IngestionJob.objects.filter(document=doc, state='succeeded').order_by('-finished_at').first()
+
+
+def request_ingestion(doc: Document):
+    """
+    Yêu cầu ingest nội dung hiện tại của tài liệu. Trả về IngestionJob (mới hoặc job đang chờ/chạy cho cùng phiên bản),
+    hoặc None nếu tài liệu chưa có file/url.
+    """
+    if not (doc.file or doc.url):
+        return None
+    version = document_version(doc)
+    _expire_stale_jobs(doc.id)
+    active = IngestionJob.objects.filter(
+        document=doc, version=version, kind='ingest', state__in=IngestionJob.ACTIVE_STATES
+    ).first()
+    if active:
+        print(f"[Ingest] Document {doc.id}@{version[:8]} already {active.state} → skip")
+        return active
+    try:
+        with transaction.atomic():
+            job = IngestionJob.objects.create(document=doc, version=version)
+    except IntegrityError:
+        # Request khác vừa tạo job cho cùng phiên bản
+        return IngestionJob.objects.filter(
+            document=doc, version=version, kind='ingest', state__in=IngestionJob.ACTIVE_STATES
+        ).first()
+    # Chỉ gửi job sau khi transaction hiện tại commit để worker chắc chắn thấy job
+    transaction.on_commit(lambda: dispatch(job.id))
+    print(f"[Ingest] Queued ingestion job {job.id} for document {doc.id}@{version[:8]}")
+    return job
+
+
+def _expire_stale_jobs(document_id, keep=None):
+    # Job treo quá lâu (worker chết, message bị mất) không được chặn các lần ingest sau; keep: job đang chạy chính nó
+    cutoff = timezone.now() - timedelta(seconds=settings.INGESTION_JOB_STALE_SECONDS)
+    IngestionJob.objects.filter(
+        document_id=document_id, state__in=IngestionJob.ACTIVE_STATES, created_at__lt=cutoff
+    ).exclude(id=keep).update(state='failed', error='Stale job expired', finished_at=timezone.now())
+
+
+def claim_document(job):
+    """
+    Chuyển job sang running nếu không có job nào khác của cùng tài liệu đang chạy, ngược lại raise DocumentBusy.
+    Job đã running (stage được Celery chạy lại) giữ nguyên claim của nó.
+    """
+    with transaction.atomic():
+        # Khoá dòng Document để 2 job của cùng tài liệu không cùng chuyển sang running
+        Document.objects.select_for_update().filter(id=job.document_id).first()
+        _expire_stale_jobs(job.document_id, keep=job.id)
+        if IngestionJob.objects.filter(document_id=job.document_id, state='running').exclude(id=job.id).exists():
+            raise DocumentBusy(f"Document {job.document_id} is being ingested by another job")
+        if job.state == 'pending':
+            job.state = 'running'
+            job.started_at = timezone.now()
+            job.save(update_fields=['state', 'started_at'])
+
+
+def holds_document(job) -> bool:
+    """
+    Gọi trong transaction ngay trước khi ghi Chunk: khoá dòng Document và xác nhận job vẫn giữ tài liệu
+    (chưa bị expire vì treo quá INGESTION_JOB_STALE_SECONDS rồi nhường cho job khác).
+    """
+    Document.objects.select_for_update().filter(id=job.document_id).first()
+    return IngestionJob.objects.filter(id=job.id, state='running').exists()
+
+
+def start_reindex(doc) -> IngestionJob:
+    """
+    Job reindex (manage.py reindex_chunks) cho phiên bản hiện tại của tài liệu, đã claim tài liệu.
+    Raise DocumentBusy nếu tài liệu đang có job chạy.
+    """
+    try:
+        with transaction.atomic():
+            job = IngestionJob.objects.create(document=doc, version=document_version(doc), kind='reindex')
+    except IntegrityError:
+        raise DocumentBusy(f"Document {doc.id} is already being reindexed")
+    try:
+        claim_document(job)
+    except DocumentBusy:
+        job.delete()
+        raise
+    return job
+
+
+def dispatch(job_id):
+    try:
+        # Nếu có Celery broker, gọi task Celery
+        from learningapi.tasks import run_ingestion_job_task, start_ingestion_pipeline
+        broker_url = os.environ.get("CELERY_BROKER_URL", "")
+        if broker_url and broker_url.startswith("redis://"):
+            if settings.INGESTION_PIPELINE:
+                # extract / embed / persist chạy trên các worker riêng (xem ingestion_pipeline)
+                start_ingestion_pipeline(job_id)
+            else:
+                run_ingestion_job_task.delay(job_id)
+            return
+        raise RuntimeError("No Celery broker configured")
+    except Exception:
+        # Nếu không có Celery hoặc lỗi, fallback sang thread cho dev
+        threading.Thread(target=_run_in_thread, args=(job_id,), daemon=True).start()
+
+
+def _run_in_thread(job_id):
+    try:
+        while True:
+            try:
+                run_job(job_id)
+                return
+            except DocumentBusy:
+                time.sleep(BUSY_RETRY_SECONDS)
+    finally:
+        connection.close()
+
+
+def run_job(job_id):
+    """
+    Chạy cả job trong 1 lần (không qua pipeline). Raise DocumentBusy nếu job khác của cùng tài liệu đang chạy:
+    job vẫn pending, caller gọi lại sau.
+    """
+    from .document_ingestion import ingest_document
+
+    try:
+        job = IngestionJob.objects.select_related('document', 'document__course').get(id=job_id)
+    except IngestionJob.DoesNotExist:
+        return None
+    if job.state != 'pending':
+        return job
+
+    # Có thể đã có phiên bản mới hơn (kể cả trong lúc chờ job khác) → bỏ job này, job mới sẽ ingest
+    doc = Document.objects.filter(id=job.document_id).first()
+    if doc is None or document_version(doc) != job.version:
+        _finish(job, 'superseded')
+        return job
+
+    claim_document(job)
+    started = time.perf_counter()
+    current = current_job(doc)
+    try:
+        stats = ingest_document(doc, unchanged_if=current.content_fingerprint if current else None)
+    except Exception as e:
+        job.error = str(e)
+        _finish(job, 'failed')
+        print(f"[Ingest] Job {job.id} failed: {e}\n{traceback.format_exc()}")
+        return job
+
+    if stats is None:
+        job.error = "No text extracted"
+        _finish(job, 'failed')
+        return job
+    job.content_fingerprint = stats.pop("content_fingerprint", "")
+    job.stats = stats
+    job.chunk_count = stats["chunks"]
+    job.stage_timings = dict(stats["timings"], total=round(time.perf_counter() - started, 3))
+    _finish(job, 'succeeded')
+    return job
+
+
+def _finish(job, state):
+    job.state = state
+    job.finished_at = timezone.now()
+    job.save()
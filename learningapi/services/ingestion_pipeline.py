@@ -0,0 +1,287 @@
+import hashlib
+import time
+from itertools import islice
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from ..models import Chunk, Document, IngestionChunk, IngestionJob
+from . import answer_cache, memory_index, metrics
+from .embedding_models import column_model, secondary_model
+from .ingestion_coordinator import claim_document, holds_document
+
+# --- Ingestion pipeline theo stage ---
+# Mỗi stage là 1 task Celery riêng, chạy trên queue riêng (xem CELERY_TASK_ROUTES):
+#   extract (tải file, tách text, chunk, so hash) → embed (encode theo batch) → persist (ghi Chunk, xoá chunk cũ)
+# Kết quả trung gian nằm ở bảng IngestionChunk và job.stage ghi stage đã xong, nên khi 1 stage lỗi
+# Celery chỉ retry stage đó: extract không tải lại file khi embed lỗi, embed chỉ encode các chunk chưa có embedding.
+# Extract claim tài liệu (ingestion_coordinator.claim_document): job giữ trạng thái running tới khi persist xong nên
+# run_job / reindex_chunks không ghi Chunk của tài liệu xen vào giữa các stage (họ nhận DocumentBusy và chạy lại sau).
+
+
+def _load_job(job_id, stage):
+    """
+    Lấy job nếu nó đang chờ đúng stage này; None nếu job đã xong/lỗi/bị thay thế hoặc stage đã chạy rồi
+    (message bị giao lại sau khi stage đã commit).
+    """
+    job = IngestionJob.objects.select_related('document', 'document__course').filter(id=job_id).first()
+    if job is None or job.state not in IngestionJob.ACTIVE_STATES or job.stage != stage:
+        return None
+    return job
+
+
+def _superseded(job):
+    from .ingestion_coordinator import document_version
+
+    doc = Document.objects.filter(id=job.document_id).first()
+    return doc is None or document_version(doc) != job.version
+
+
+def _record_stage(job, stage, items, seconds):
+    """
+    Ghi thời gian và throughput (item/s) của stage vào job và metrics.
+    """
+    rate = items / seconds if seconds > 0 else 0.0
+    job.stage_timings[stage] = round(seconds, 3)
+    job.stats.setdefault("throughput", {})[stage] = round(rate, 1)
+    metrics.observe_ms(f"ingest.{stage}", seconds * 1000)
+    metrics.incr(f"ingest.{stage}.items", items)
+    print(f"[Ingest:{stage}] Job {job.id}: {items} chunks in {seconds:.2f}s ({rate:.1f} chunks/s)")
+
+
+def finish_job(job, state, error=None):
+    if error is not None:
+        job.error = error
+    job.state = state
+    job.finished_at = timezone.now()
+    if job.started_at:
+        job.stage_timings["total"] = round((job.finished_at - job.started_at).total_seconds(), 3)
+    job.save()
+    # Dữ liệu trung gian không còn dùng (kể cả khi lỗi: lần ingest sau bắt đầu lại từ extract)
+    IngestionChunk.objects.filter(job=job).delete()
+
+
+def mark_failed(job_id, error):
+    job = IngestionJob.objects.filter(id=job_id, state__in=IngestionJob.ACTIVE_STATES).first()
+    if job is not None:
+        finish_job(job, 'failed', error=error)
+
+
+def run_extract(job_id):
+    """
+    Stage 1: stream text → chunk → so content hash với chunk đang có, ghi kết quả vào IngestionChunk.
+    Chunk có hash không đổi chỉ lưu id chunk cũ để dùng lại (không encode lại).
+    File tải về trùng content fingerprint của lần ingest hiện tại → job xong luôn, không qua embed/persist
+    (trừ job reindex: luôn chunk lại, ví dụ sau khi đổi CHUNK_MAX_TOKENS).
+    """
+    from .chunking import iter_chunks_with_tokens
+    from .document_ingestion import SourceUnchanged, chunk_hash, iter_text
+    from .ingestion_coordinator import current_job
+
+    job = _load_job(job_id, 'queued')
+    if job is None:
+        return None
+    if _superseded(job):
+        finish_job(job, 'superseded')
+        return None
+
+    # DocumentBusy: Celery chạy lại stage này sau (xem tasks.ingest_extract_task)
+    claim_document(job)
+
+    # Lần chạy lại sau lỗi giữa chừng: bỏ phần đã ghi dở của lần trước
+    IngestionChunk.objects.filter(job=job).delete()
+
+    doc = job.document
+    existing = {}
+    for chunk_id, h in Chunk.objects.filter(document=doc).values_list("id", "content_hash"):
+        existing.setdefault(h, []).append(chunk_id)
+
+    batch_size = settings.EMBEDDING_BATCH_SIZE
+    started = time.perf_counter()
+    total, kept = 0, 0
+    current = current_job(doc)
+    hasher = hashlib.sha256()
+    unchanged_if = current.content_fingerprint if current and job.kind == 'ingest' else None
+    chunk_iter = iter_chunks_with_tokens(iter_text(doc, hasher, unchanged_if))
+    while True:
+        try:
+            batch = list(islice(chunk_iter, batch_size))
+        except SourceUnchanged:
+            job.content_fingerprint = current.content_fingerprint
+            job.chunk_count = current.chunk_count
+            job.stats.update({"chunks": current.chunk_count, "kept": current.chunk_count, "unchanged": True})
+            _record_stage(job, "extract", 0, time.perf_counter() - started)
+            finish_job(job, 'succeeded')
+            return None
+        if not batch:
+            break
+        rows = []
+        for ch, tokens in batch:
+            h = chunk_hash(ch)
+            reused = existing[h].pop() if existing.get(h) else None
+            kept += reused is not None
+            rows.append(IngestionChunk(
+                job=job,
+                position=total + len(rows),
+                text="" if reused else ch,
+                content_hash=h,
+                token_count=tokens,
+                reused_chunk_id=reused,
+            ))
+        IngestionChunk.objects.bulk_create(rows, batch_size=batch_size)
+        total += len(rows)
+
+    if total == 0:
+        # Không đụng tới chunk cũ: có thể chỉ là lỗi tải file tạm thời
+        finish_job(job, 'failed', error="No text extracted")
+        return None
+
+    _record_stage(job, "extract", total, time.perf_counter() - started)
+    job.chunk_count = total
+    job.content_fingerprint = hasher.hexdigest()
+    job.stats.update({"chunks": total, "kept": kept, "embeddings_saved": kept})
+    job.stage = 'extracted'
+    job.save(update_fields=['stage', 'chunk_count', 'content_fingerprint', 'stats', 'stage_timings'])
+    return job
+
+
+def run_embed(job_id):
+    """
+    Stage 2: encode các chunk mới theo batch. Mỗi batch được ghi ngay nên retry chỉ encode phần còn thiếu.
+    """
+    from .rag_service import get_embeddings
+
+    job = _load_job(job_id, 'extracted')
+    if job is None:
+        return None
+
+    batch_size = settings.EMBEDDING_BATCH_SIZE
+    pending = IngestionChunk.objects.filter(
+        job=job, reused_chunk_id__isnull=True, embedding__isnull=True
+    ).only("id", "text").order_by("position")
+    started = time.perf_counter()
+    embedded = 0
+    while True:
+        rows = list(pending[:batch_size])
+        if not rows:
+            break
+        embs = get_embeddings([r.text for r in rows], batch_size=batch_size, model_name=column_model())
+        for row, emb in zip(rows, embs):
+            row.embedding = emb.tolist()
+        IngestionChunk.objects.bulk_update(rows, ["embedding"])
+        embedded += len(rows)
+
+    _record_stage(job, "embed", embedded, time.perf_counter() - started)
+    job.stage = 'embedded'
+    job.save(update_fields=['stage', 'stats', 'stage_timings'])
+    return job
+
+
+def run_persist(job_id):
+    """
+    Stage 3: trong 1 transaction, xoá chunk không còn trong tài liệu và tạo Chunk từ các chunk mới đã embed.
+    """
+    job = _load_job(job_id, 'embedded')
+    if job is None:
+        return None
+    if _superseded(job):
+        # Phiên bản mới hơn đã được yêu cầu: không ghi đè chunk bằng nội dung cũ
+        finish_job(job, 'superseded')
+        return None
+
+    doc = job.document
+    batch_size = settings.EMBEDDING_BATCH_SIZE
+    staged = IngestionChunk.objects.filter(job=job)
+    started = time.perf_counter()
+    created = 0
+    with transaction.atomic():
+        if not holds_document(job):
+            # Job bị coi là treo và đã bị expire: job khác có thể đang ghi chunk của tài liệu, không ghi đè
+            print(f"[Ingest] Job {job.id} no longer holds document {doc.id} → skip persist")
+            return None
+        _, deleted_by_model = Chunk.objects.filter(document=doc).exclude(
+            id__in=staged.filter(reused_chunk_id__isnull=False).values("reused_chunk_id")
+        ).delete()
+        # delete() đếm cả các dòng bị xoá theo cascade (ChunkEmbedding)
+        deleted = deleted_by_model.get(Chunk._meta.label, 0)
+        new_rows = staged.filter(reused_chunk_id__isnull=True).order_by("position").iterator(chunk_size=batch_size)
+        while True:
+            rows = list(islice(new_rows, batch_size))
+            if not rows:
+                break
+            Chunk.objects.bulk_create([
+                Chunk(
+                    course=doc.course,
+                    document=doc,
+                    text=row.text,
+                    content_hash=row.content_hash,
+                    embedding=row.embedding,
+                    token_count=row.token_count,
+                    meta={"source": doc.title}
+                )
+                for row in rows
+            ], batch_size=batch_size)
+            created += len(rows)
+
+        _record_stage(job, "persist", created + deleted, time.perf_counter() - started)
+        job.stage = 'persisted'
+        job.stats.update({"created": created, "deleted": deleted})
+        finish_job(job, 'succeeded')
+
+    if created and secondary_model():
+        # Embedding của model đang backfill cho chunk mới: encode trên queue ingest_embed, không phải ở stage persist
+        from learningapi.tasks import backfill_embeddings_task
+        backfill_embeddings_task.delay()
+    if created or deleted:
+        # Tài liệu của khoá học đã đổi → câu trả lời đã cache không còn đáng tin
+        answer_cache.invalidate_course(doc.course_id)
+        memory_index.invalidate_course(doc.course_id)
+    print(f"[Ingest] Done ingesting document {doc.id} (job {job.id}): {job.stats}")
+    return job
+
+
+def reembed_in_place(job, throttle=None):
+    """
+    Job reindex không tải lại nguồn: encode lại mọi chunk từ Chunk.text đã lưu rồi cập nhật embedding tại chỗ trong
+    1 transaction, nên retrieval chỉ thấy toàn bộ embedding cũ hoặc toàn bộ embedding mới, không có chunk trùng.
+    throttle(n) được gọi sau mỗi batch ghi DB. Job phải đã claim tài liệu (ingestion_coordinator.start_reindex).
+    """
+    from .ingestion_coordinator import current_job
+    from .rag_service import get_embeddings
+
+    doc = job.document
+    batch_size = settings.EMBEDDING_BATCH_SIZE
+    chunks = list(Chunk.objects.filter(document=doc).only("id", "text").order_by("id"))
+    started = time.perf_counter()
+    embeddings = []
+    for start in range(0, len(chunks), batch_size):
+        texts = [c.text for c in chunks[start:start + batch_size]]
+        embeddings.extend(get_embeddings(texts, batch_size=batch_size, model_name=column_model()))
+    _record_stage(job, "embed", len(chunks), time.perf_counter() - started)
+
+    started = time.perf_counter()
+    with transaction.atomic():
+        if not holds_document(job):
+            print(f"[Ingest] Job {job.id} no longer holds document {doc.id} → skip persist")
+            return None
+        for start in range(0, len(chunks), batch_size):
+            batch = chunks[start:start + batch_size]
+            for chunk, emb in zip(batch, embeddings[start:start + batch_size]):
+                chunk.embedding = emb.tolist()
+            Chunk.objects.bulk_update(batch, ["embedding"])
+            if throttle is not None:
+                throttle(len(batch))
+        _record_stage(job, "persist", len(chunks), time.perf_counter() - started)
+        current = current_job(doc)
+        # Nội dung không đổi: giữ fingerprint của lần ingest hiện tại để lần ingest sau vẫn dừng sớm được
+        job.content_fingerprint = current.content_fingerprint if current else ""
+        job.chunk_count = len(chunks)
+        job.stage = 'persisted'
+        job.stats.update({"chunks": len(chunks), "reembedded": len(chunks), "kept": 0, "created": 0, "deleted": 0})
+        finish_job(job, 'succeeded')
+
+    if chunks:
+        answer_cache.invalidate_course(doc.course_id)
+        memory_index.invalidate_course(doc.course_id)
+    return job
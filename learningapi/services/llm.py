@@ -0,0 +1,445 @@
+import asyncio
+import os
+import random
+import threading
+import time
+
+from django.conf import settings
+
+from . import metrics
+from .llm_concurrency import allm_slot, llm_slot
+
+# --- LLM provider ---
+# Client của provider được tạo 1 lần/process và dùng lại (trước đây mỗi request gọi genai.configure + GenerativeModel mới).
+# Mỗi lần gọi đều có:
+# - deadline: mỗi lần thử tối đa LLM_TIMEOUT_SECONDS, tổng cả các lần retry tối đa LLM_DEADLINE_SECONDS
+# - retry có giới hạn (LLM_MAX_RETRIES) với backoff mũ + jitter, chỉ cho lỗi tạm thời (timeout, 429, 5xx, mất kết nối)
+# - circuit breaker: LLM_BREAKER_FAILURES lần lỗi liên tiếp → từ chối ngay (LLMUnavailable) trong LLM_BREAKER_RESET_SECONDS
+#   giây, sau đó cho 1 request thử lại
+# Số lời gọi đồng thời được giới hạn bởi llm_concurrency (slot được giữ trong suốt các lần retry).
+# Provider:
+# - "gemini": Google Generative AI
+# - "openai": API tương thích OpenAI, gồm OpenAI, LM Studio (LLM_BASE_URL=http://localhost:1234/v1) và server giả lập
+#   `python manage.py fake_llm_server` để load test cả luồng chat mà không cần mạng
+
+PROVIDERS = ("gemini", "openai")
+METRIC_NAMES = [
+    "llm.calls",
+    "llm.retries",
+    "llm.failures",
+    "llm.short_circuited",
+    "llm.latency.count",
+    "llm.latency.total_ms",
+]
+
+
+class LLMUnavailable(Exception):
+    """
+    Provider đang lỗi (breaker mở hoặc hết số lần retry / deadline). retry_after: số giây nên chờ trước khi thử lại.
+    """
+
+    def __init__(self, message, retry_after: int = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class GeminiProvider:
+    name = "gemini"
+
+    def __init__(self, model: str, api_key: str):
+        import google.generativeai as genai
+
+        genai.configure(api_key=api_key)
+        self.model = genai.GenerativeModel(model)
+
+    def generate(self, prompt: str, timeout: float) -> str:
+        response = self.model.generate_content(prompt, request_options={"timeout": timeout})
+        return response.text.strip()
+
+    def stream(self, prompt: str, timeout: float):
+        for part in self.model.generate_content(prompt, stream=True, request_options={"timeout": timeout}):
+            if part.text:
+                yield part.text
+
+    async def agenerate(self, prompt: str, timeout: float) -> str:
+        response = await self.model.generate_content_async(prompt, request_options={"timeout": timeout})
+        return response.text.strip()
+
+    async def astream(self, prompt: str, timeout: float):
+        response = await self.model.generate_content_async(prompt, stream=True, request_options={"timeout": timeout})
+        async for part in response:
+            if part.text:
+                yield part.text
+
+    @staticmethod
+    def is_retryable(exc) -> bool:
+        from google.api_core import exceptions as gexc
+
+        return isinstance(exc, (
+            gexc.TooManyRequests, gexc.ServiceUnavailable, gexc.InternalServerError,
+            gexc.DeadlineExceeded, gexc.GatewayTimeout, TimeoutError, ConnectionError,
+        ))
+
+
+class OpenAIProvider:
+    name = "openai"
+    SYSTEM_PROMPT = "Bạn là AI tutor."
+
+    def __init__(self, model: str, api_key: str, base_url: str = None):
+        from openai import AsyncOpenAI, OpenAI
+
+        # Retry do lớp bọc bên dưới quản lý (theo deadline chung), không để SDK tự retry thêm
+        self.model = model
+        self.client = OpenAI(api_key=api_key, base_url=base_url or None, max_retries=0)
+        self.async_client = AsyncOpenAI(api_key=api_key, base_url=base_url or None, max_retries=0)
+
+    def _params(self, prompt: str):
+        return {
+            "model": self.model,
+            "messages": [
+                {"role": "system", "content": self.SYSTEM_PROMPT},
+                {"role": "user", "content": prompt},
+            ],
+            "temperature": settings.LLM_TEMPERATURE,
+            "max_tokens": settings.LLM_MAX_OUTPUT_TOKENS,
+        }
+
+    def generate(self, prompt: str, timeout: float) -> str:
+        resp = self.client.chat.completions.create(**self._params(prompt), timeout=timeout)
+        return (resp.choices[0].message.content or "").strip()
+
+    def stream(self, prompt: str, timeout: float):
+        for chunk in self.client.chat.completions.create(**self._params(prompt), stream=True, timeout=timeout):
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+    async def agenerate(self, prompt: str, timeout: float) -> str:
+        resp = await self.async_client.chat.completions.create(**self._params(prompt), timeout=timeout)
+        return (resp.choices[0].message.content or "").strip()
+
+    async def astream(self, prompt: str, timeout: float):
+        stream = await self.async_client.chat.completions.create(**self._params(prompt), stream=True, timeout=timeout)
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+    @staticmethod
+    def is_retryable(exc) -> bool:
+        import openai
+
+        return isinstance(exc, (
+            openai.APITimeoutError, openai.APIConnectionError, openai.RateLimitError, openai.InternalServerError,
+            TimeoutError, ConnectionError,
+        ))
+
+
+def create_provider(name: str = None):
+    name = name or settings.LLM_PROVIDER
+    if name == "gemini":
+        return GeminiProvider(settings.LLM_MODEL, settings.LLM_API_KEY or os.environ.get("GOOGLE_API_KEY"))
+    if name == "openai":
+        api_key = settings.LLM_API_KEY or os.environ.get("OPENAI_API_KEY") or "local"
+        return OpenAIProvider(settings.LLM_MODEL, api_key, base_url=settings.LLM_BASE_URL)
+    raise ValueError(f"Unknown LLM provider: {name}")
+
+
+class CircuitBreaker:
+    """
+    closed → (failure_threshold lỗi liên tiếp) → open → (sau reset_seconds) → half-open: cho 1 request thử,
+    thành công thì closed, lỗi thì open tiếp.
+    """
+
+    def __init__(self, failure_threshold: int, reset_seconds: float):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        return "half-open" if time.monotonic() - self.opened_at >= self.reset_seconds else "open"
+
+    def retry_after(self) -> int:
+        if self.opened_at is None:
+            return 0
+        return max(1, int(self.reset_seconds - (time.monotonic() - self.opened_at) + 0.999))
+
+    def begin(self):
+        """
+        "closed": cho qua bình thường, "trial": request này là lần thử half-open (phải gọi end_trial khi xong),
+        None: từ chối.
+        """
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return "closed"
+            if state == "half-open" and not self.trial_running:
+                self.trial_running = True
+                return "trial"
+            return None
+
+    def allow(self) -> bool:
+        return self.begin() is not None
+
+    def end_trial(self):
+        """
+        Lần thử half-open kết thúc mà không có kết quả (client ngắt stream, task bị huỷ...): request sau được thử lại,
+        không để breaker kẹt ở trạng thái từ chối mọi request.
+        """
+        with self._lock:
+            self.trial_running = False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.trial_running or self.failures >= self.failure_threshold:
+                if self.opened_at is None:
+                    print(f"[LLM] Circuit breaker open for {self.reset_seconds:.0f}s after {self.failures} failures")
+                self.opened_at = time.monotonic()
+            self.trial_running = False
+
+
+class ResilientLLM:
+    """
+    Bọc 1 provider với deadline, retry có jitter và circuit breaker. Dùng chung trong process qua get_llm().
+    """
+
+    def __init__(self, provider, breaker: CircuitBreaker = None):
+        self.provider = provider
+        self.breaker = breaker or CircuitBreaker(settings.LLM_BREAKER_FAILURES, settings.LLM_BREAKER_RESET_SECONDS)
+
+    def _retryable(self, exc) -> bool:
+        return isinstance(exc, asyncio.TimeoutError) or self.provider.is_retryable(exc)
+
+    def _check_breaker(self) -> bool:
+        """
+        Trả về True nếu request này là lần thử half-open của breaker.
+        """
+        admission = self.breaker.begin()
+        if admission is None:
+            metrics.incr("llm.short_circuited")
+            raise LLMUnavailable(f"LLM provider {self.provider.name} is degraded", self.breaker.retry_after())
+        return admission == "trial"
+
+    def _attempts(self):
+        """
+        Sinh (lần thử, timeout của lần thử) tới khi hết số lần retry hoặc hết deadline.
+        """
+        deadline = time.monotonic() + settings.LLM_DEADLINE_SECONDS
+        for attempt in range(settings.LLM_MAX_RETRIES + 1):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            yield attempt, min(settings.LLM_TIMEOUT_SECONDS, remaining), deadline
+
+    @staticmethod
+    def _backoff(attempt: int, deadline: float):
+        """
+        Full jitter: chờ ngẫu nhiên trong [0, base * 2^attempt]. None nếu chờ xong thì đã quá deadline.
+        """
+        delay = random.uniform(0, settings.LLM_RETRY_BASE_SECONDS * (2 ** attempt))
+        return delay if time.monotonic() + delay < deadline else None
+
+    def _failed(self, exc):
+        """
+        Lỗi sau lần thử cuối: lỗi tạm thời được tính cho breaker và đổi thành LLMUnavailable, lỗi khác giữ nguyên.
+        """
+        metrics.incr("llm.failures")
+        if exc is None or self._retryable(exc):
+            self.breaker.record_failure()
+            return LLMUnavailable(f"LLM provider {self.provider.name} failed: {exc}", self.breaker.retry_after() or None)
+        # Lỗi không phải do provider quá tải (prompt sai, sai API key...): breaker không mở vì lỗi này
+        self.breaker.record_success()
+        return exc
+
+    def _record(self, started: float):
+        self.breaker.record_success()
+        metrics.observe_ms("llm.latency", (time.perf_counter() - started) * 1000)
+
+    def generate(self, prompt: str) -> str:
+        # Lấy slot trước (có thể phải chờ), rồi mới kiểm tra breaker để lần thử half-open không bị giữ khi LLMBusy
+        with llm_slot():
+            return self._generate(prompt)
+
+    def stream(self, prompt: str):
+        """
+        Yield từng đoạn text. Chỉ retry khi chưa nhận được đoạn nào (không lặp lại text đã gửi cho client).
+        """
+        with llm_slot():
+            yield from self._stream(prompt)
+
+    async def agenerate(self, prompt: str) -> str:
+        async with allm_slot():
+            return await self._agenerate(prompt)
+
+    async def astream(self, prompt: str):
+        """
+        Bản async của stream (view SSE chạy qua ASGI), cùng quy tắc retry trước đoạn text đầu tiên.
+        """
+        async with allm_slot():
+            async for part in self._astream(prompt):
+                yield part
+
+    def _generate(self, prompt: str) -> str:
+        trial = self._check_breaker()
+        try:
+            return self._generate_attempts(prompt)
+        finally:
+            if trial:
+                self.breaker.end_trial()
+
+    def _generate_attempts(self, prompt: str) -> str:
+        metrics.incr("llm.calls")
+        started = time.perf_counter()
+        last_exc = None
+        for attempt, timeout, deadline in self._attempts():
+            try:
+                answer = self.provider.generate(prompt, timeout)
+                self._record(started)
+                return answer
+            except Exception as e:
+                last_exc = e
+                if not self._retryable(e):
+                    break
+                delay = self._backoff(attempt, deadline)
+                if delay is None or attempt == settings.LLM_MAX_RETRIES:
+                    break
+                metrics.incr("llm.retries")
+                print(f"[LLM] {self.provider.name} attempt {attempt + 1} failed ({e}), retrying in {delay:.2f}s")
+                time.sleep(delay)
+        raise self._failed(last_exc) from last_exc
+
+    def _stream(self, prompt: str):
+        trial = self._check_breaker()
+        try:
+            # GeneratorExit khi client ngắt kết nối giữa chừng: không qua record_success / record_failure
+            yield from self._stream_attempts(prompt)
+        finally:
+            if trial:
+                self.breaker.end_trial()
+
+    def _stream_attempts(self, prompt: str):
+        metrics.incr("llm.calls")
+        started = time.perf_counter()
+        last_exc = None
+        for attempt, timeout, deadline in self._attempts():
+            received = False
+            try:
+                for part in self.provider.stream(prompt, timeout):
+                    received = True
+                    yield part
+                self._record(started)
+                return
+            except Exception as e:
+                last_exc = e
+                if received or not self._retryable(e):
+                    break
+                delay = self._backoff(attempt, deadline)
+                if delay is None or attempt == settings.LLM_MAX_RETRIES:
+                    break
+                metrics.incr("llm.retries")
+                print(f"[LLM] {self.provider.name} stream attempt {attempt + 1} failed ({e}), retrying in {delay:.2f}s")
+                time.sleep(delay)
+        raise self._failed(last_exc) from last_exc
+
+    async def _agenerate(self, prompt: str) -> str:
+        trial = self._check_breaker()
+        try:
+            # CancelledError (BaseException) khi request bị huỷ: không qua record_success / record_failure
+            return await self._agenerate_attempts(prompt)
+        finally:
+            if trial:
+                self.breaker.end_trial()
+
+    async def _agenerate_attempts(self, prompt: str) -> str:
+        metrics.incr("llm.calls")
+        started = time.perf_counter()
+        last_exc = None
+        for attempt, timeout, deadline in self._attempts():
+            try:
+                # deadline cả phía client phòng khi SDK không tôn trọng timeout của request
+                answer = await asyncio.wait_for(self.provider.agenerate(prompt, timeout), timeout)
+                self._record(started)
+                return answer
+            except Exception as e:
+                last_exc = e
+                if not self._retryable(e):
+                    break
+                delay = self._backoff(attempt, deadline)
+                if delay is None or attempt == settings.LLM_MAX_RETRIES:
+                    break
+                metrics.incr("llm.retries")
+                print(f"[LLM] {self.provider.name} attempt {attempt + 1} failed ({e!r}), retrying in {delay:.2f}s")
+                await asyncio.sleep(delay)
+        raise self._failed(last_exc) from last_exc
+
+    async def _astream(self, prompt: str):
+        trial = self._check_breaker()
+        try:
+            async for part in self._astream_attempts(prompt):
+                yield part
+        finally:
+            if trial:
+                self.breaker.end_trial()
+
+    async def _astream_attempts(self, prompt: str):
+        metrics.incr("llm.calls")
+        started = time.perf_counter()
+        last_exc = None
+        for attempt, timeout, deadline in self._attempts():
+            received = False
+            try:
+                async for part in self.provider.astream(prompt, timeout):
+                    received = True
+                    yield part
+                self._record(started)
+                return
+            except Exception as e:
+                last_exc = e
+                if received or not self._retryable(e):
+                    break
+                delay = self._backoff(attempt, deadline)
+                if delay is None or attempt == settings.LLM_MAX_RETRIES:
+                    break
+                metrics.incr("llm.retries")
+                print(f"[LLM] {self.provider.name} stream attempt {attempt + 1} failed ({e!r}), retrying in {delay:.2f}s")
+                await asyncio.sleep(delay)
+        raise self._failed(last_exc) from last_exc
+
+
+_llm = None
+_llm_lock = threading.Lock()
+
+
+def get_llm() -> ResilientLLM:
+    """
+    Client LLM dùng chung trong process (tạo lần đầu khi cần).
+    """
+    global _llm
+    if _llm is None:
+        with _llm_lock:
+            if _llm is None:
+                _llm = ResilientLLM(create_provider())
+                print(f"[LLM] Using {settings.LLM_PROVIDER} ({settings.LLM_MODEL}"
+                      f"{', ' + settings.LLM_BASE_URL if settings.LLM_BASE_URL else ''})")
+    return _llm
+
+
+def llm_stats() -> dict:
+    llm = _llm
+    return {
+        "provider": settings.LLM_PROVIDER,
+        "model": settings.LLM_MODEL,
+        "breaker": llm.breaker.state if llm else "closed",
+        **metrics.snapshot(METRIC_NAMES),
+    }
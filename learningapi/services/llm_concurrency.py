@@ -0,0 +1,382 @@
+import asyncio
+import hashlib
+import random
+import threading
+import time
+import uuid
+from contextlib import asynccontextmanager, contextmanager
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+
+from . import metrics
+
+# --- Giới hạn đồng thời + gộp request cho LLM ---
+# Cuối buổi học hàng chục học viên hỏi gần như cùng 1 câu cùng lúc: mỗi request 1-2 lần gọi Gemini → hết quota, hết worker.
+# 1. Limiter: tối đa LLM_MAX_CONCURRENCY lần gọi LLM đồng thời mỗi process, LLM_MAX_CONCURRENCY_GLOBAL cho cả cụm
+#    (Redis, cần CACHE_REDIS_URL). Request chờ slot trong hàng đợi tối đa LLM_MAX_QUEUE request / LLM_QUEUE_TIMEOUT_SECONDS
+#    giây; hàng đợi đầy hoặc chờ quá lâu → LLMBusy (view trả 429 + Retry-After).
+# 2. Single-flight: các request cùng (khoá học, câu hỏi đã chuẩn hoá, model) đang chạy dùng chung 1 lần gọi:
+#    - trong process: request sau chờ kết quả của request đầu
+#    - giữa các worker: request đầu giữ 1 key trong Django cache, worker khác chờ key đó biến mất rồi lấy câu trả lời
+#      từ answer cache (request đầu đã lưu vào đó)
+#    - cùng quy tắc với answer cache (answer_cache.depends_on_history): câu hỏi độc lập được trả lời không kèm lịch sử nên
+#      gộp được kể cả khi learner đã có hội thoại, và worker khác đọc được câu trả lời request đầu đã lưu; chỉ câu hỏi
+#      nối tiếp (prompt có lịch sử riêng của từng learner) là không gộp
+
+GLOBAL_KEY = "llm:inflight"
+FLIGHT_PREFIX = "llm:flight:"
+METRIC_NAMES = [
+    "llm.rejected",
+    "llm.queued",
+    "llm.coalesced",
+    "llm.coalesced_remote",
+]
+
+
+class LLMBusy(Exception):
+    """
+    Hết slot gọi LLM và hàng đợi đã đầy / chờ quá lâu. retry_after: số giây client nên chờ.
+    """
+
+    def __init__(self, message, retry_after: int = None):
+        super().__init__(message)
+        self.retry_after = retry_after or settings.LLM_BUSY_RETRY_AFTER_SECONDS
+
+
+def _reject(reason: str):
+    metrics.incr("llm.rejected")
+    print(f"[LLM] Rejected: {reason}")
+    raise LLMBusy(f"LLM is busy: {reason}")
+
+
+# --- Limiter trong process ---
+class ProcessLimiter:
+    """
+    Semaphore có hàng đợi giới hạn cho thread (WSGI, Celery).
+    """
+
+    def __init__(self, limit: int, max_queue: int):
+        self.limit = limit
+        self.max_queue = max_queue
+        self.active = 0
+        self.waiting = 0
+        self._cond = threading.Condition()
+
+    def acquire(self, timeout: float):
+        with self._cond:
+            if self.active < self.limit:
+                self.active += 1
+                return
+            if self.waiting >= self.max_queue:
+                _reject(f"{self.waiting} requests already queued")
+            self.waiting += 1
+            metrics.incr("llm.queued")
+            try:
+                if not self._cond.wait_for(lambda: self.active < self.limit, timeout):
+                    _reject(f"no slot after {timeout:g}s")
+                self.active += 1
+            finally:
+                self.waiting -= 1
+
+    def release(self):
+        with self._cond:
+            self.active -= 1
+            self._cond.notify()
+
+
+class AsyncProcessLimiter:
+    """
+    Giống ProcessLimiter cho view async (ASGI): chờ slot không chiếm thread.
+    """
+
+    def __init__(self, limit: int, max_queue: int):
+        self.limit = limit
+        self.max_queue = max_queue
+        self.entered = 0  # đang giữ slot + đang chờ, đếm ngay khi vào (trước await) để không vượt hàng đợi
+        self._semaphore = None
+
+    @property
+    def waiting(self) -> int:
+        return max(0, self.entered - self.limit)
+
+    @property
+    def semaphore(self):
+        # Tạo trong event loop đang chạy (uvicorn worker)
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.limit)
+        return self._semaphore
+
+    async def acquire(self, timeout: float):
+        if self.entered >= self.limit + self.max_queue:
+            _reject(f"{self.waiting} requests already queued")
+        self.entered += 1
+        if self.entered > self.limit:
+            metrics.incr("llm.queued")
+        try:
+            await asyncio.wait_for(self.semaphore.acquire(), timeout)
+        except asyncio.TimeoutError:
+            self.entered -= 1
+            _reject(f"no slot after {timeout:g}s")
+        except BaseException:
+            self.entered -= 1
+            raise
+
+    def release(self):
+        self.entered -= 1
+        self.semaphore.release()
+
+
+# --- Limiter giữa các worker (Redis) ---
+class GlobalLimiter:
+    """
+    Semaphore trên Redis sorted set: mỗi slot là 1 token với score = thời điểm lấy. Token quá lease giây
+    (worker chết giữa chừng) tự bị bỏ ở lần acquire sau nên slot không bị rò.
+    """
+
+    def __init__(self, url: str, limit: int, lease: float):
+        import redis
+
+        self.client = redis.Redis.from_url(url)
+        self.limit = limit
+        self.lease = lease
+
+    def try_acquire(self):
+        token = uuid.uuid4().hex
+        now = time.time()
+        pipe = self.client.pipeline()
+        pipe.zremrangebyscore(GLOBAL_KEY, 0, now - self.lease)
+        pipe.zadd(GLOBAL_KEY, {token: now})
+        pipe.zrank(GLOBAL_KEY, token)
+        pipe.expire(GLOBAL_KEY, int(self.lease) + 60)
+        rank = pipe.execute()[2]
+        if rank is not None and rank < self.limit:
+            return token
+        self.client.zrem(GLOBAL_KEY, token)
+        return None
+
+    def release(self, token):
+        self.client.zrem(GLOBAL_KEY, token)
+
+
+_process_limiter = None
+_async_limiter = None
+_global_limiter = None
+_init_lock = threading.Lock()
+
+
+def _limiters():
+    global _process_limiter, _async_limiter, _global_limiter
+    if _process_limiter is None:
+        with _init_lock:
+            if _process_limiter is None:
+                if settings.LLM_MAX_CONCURRENCY_GLOBAL and settings.CACHE_REDIS_URL:
+                    lease = settings.LLM_DEADLINE_SECONDS + settings.LLM_QUEUE_TIMEOUT_SECONDS
+                    _global_limiter = GlobalLimiter(settings.CACHE_REDIS_URL, settings.LLM_MAX_CONCURRENCY_GLOBAL, lease)
+                _async_limiter = AsyncProcessLimiter(settings.LLM_MAX_CONCURRENCY, settings.LLM_MAX_QUEUE)
+                _process_limiter = ProcessLimiter(settings.LLM_MAX_CONCURRENCY, settings.LLM_MAX_QUEUE)
+    return _process_limiter, _async_limiter, _global_limiter
+
+
+def _global_try_acquire(limiter):
+    try:
+        return limiter.try_acquire(), True
+    except Exception as e:
+        # Redis lỗi: không chặn chat vì limiter, chỉ còn giới hạn trong process
+        print(f"[LLM] Global limiter unavailable: {e}")
+        return None, False
+
+
+def _global_release(limiter, token):
+    if token is None:
+        return
+    try:
+        limiter.release(token)
+    except Exception as e:
+        print(f"[LLM] Global limiter release failed: {e}")
+
+
+@contextmanager
+def llm_slot():
+    """
+    Giữ 1 slot gọi LLM trong suốt khối with (kể cả các lần retry). Raise LLMBusy nếu không lấy được slot.
+    """
+    process_limiter, _, global_limiter = _limiters()
+    deadline = time.monotonic() + settings.LLM_QUEUE_TIMEOUT_SECONDS
+    process_limiter.acquire(settings.LLM_QUEUE_TIMEOUT_SECONDS)
+    token = None
+    try:
+        if global_limiter is not None:
+            while True:
+                token, ok = _global_try_acquire(global_limiter)
+                if token is not None or not ok:
+                    break
+                if time.monotonic() >= deadline:
+                    _reject("global concurrency limit reached")
+                time.sleep(random.uniform(0.05, 0.15))
+        yield
+    finally:
+        _global_release(global_limiter, token)
+        process_limiter.release()
+
+
+@asynccontextmanager
+async def allm_slot():
+    _, async_limiter, global_limiter = _limiters()
+    deadline = time.monotonic() + settings.LLM_QUEUE_TIMEOUT_SECONDS
+    await async_limiter.acquire(settings.LLM_QUEUE_TIMEOUT_SECONDS)
+    token = None
+    try:
+        if global_limiter is not None:
+            while True:
+                token, ok = await sync_to_async(_global_try_acquire, thread_sensitive=False)(global_limiter)
+                if token is not None or not ok:
+                    break
+                if time.monotonic() >= deadline:
+                    _reject("global concurrency limit reached")
+                await asyncio.sleep(random.uniform(0.05, 0.15))
+        yield
+    finally:
+        await sync_to_async(_global_release, thread_sensitive=False)(global_limiter, token)
+        async_limiter.release()
+
+
+# --- Single-flight ---
+def flight_key(course_id, question: str, model_name: str = None, history=None):
+    """
+    Key gộp request cho single_flight, None (không gộp) nếu câu hỏi nối tiếp lịch sử hội thoại.
+    """
+    from .answer_cache import depends_on_history
+    from .query_embedding_cache import normalize
+
+    if depends_on_history(question, history):
+        return None
+
+    raw = f"{course_id}\0{model_name or settings.EMBEDDING_MODEL}\0{normalize(question)}"
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+def _flight_timeout() -> float:
+    return settings.LLM_QUEUE_TIMEOUT_SECONDS + settings.LLM_DEADLINE_SECONDS * 2
+
+
+class _Call:
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+_calls = {}
+_calls_lock = threading.Lock()
+_async_calls = {}
+
+
+def _claim(key: str) -> bool:
+    return cache.add(FLIGHT_PREFIX + key, 1, timeout=int(_flight_timeout()))
+
+
+def _wait_remote(key: str, lookup):
+    """
+    Worker khác đang trả lời cùng câu hỏi: chờ nó xong rồi lấy kết quả từ answer cache. None nếu không có.
+    """
+    deadline = time.monotonic() + _flight_timeout()
+    while cache.get(FLIGHT_PREFIX + key) is not None and time.monotonic() < deadline:
+        time.sleep(0.2)
+    result = lookup()
+    if result is not None:
+        metrics.incr("llm.coalesced_remote")
+    return result
+
+
+async def _await_remote(key: str, lookup):
+    deadline = time.monotonic() + _flight_timeout()
+    while await cache.aget(FLIGHT_PREFIX + key) is not None and time.monotonic() < deadline:
+        await asyncio.sleep(0.2)
+    result = await sync_to_async(lookup)()
+    if result is not None:
+        metrics.incr("llm.coalesced_remote")
+    return result
+
+
+def single_flight(key: str, fn, lookup=None):
+    """
+    Chạy fn() 1 lần cho mỗi key đang chạy trong process; request trùng key chờ và nhận cùng kết quả (hoặc lỗi).
+    lookup(): lấy kết quả đã lưu (answer cache) khi 1 worker khác vừa trả lời xong cùng key.
+    key None: không gộp.
+    """
+    if not settings.LLM_COALESCE or key is None:
+        return fn()
+    with _calls_lock:
+        call = _calls.get(key)
+        leader = call is None
+        if leader:
+            call = _calls[key] = _Call()
+    if not leader:
+        metrics.incr("llm.coalesced")
+        if call.event.wait(_flight_timeout()):
+            if call.error is not None:
+                raise call.error
+            return call.result
+        return fn()
+
+    owner = False
+    try:
+        if lookup is not None and settings.ANSWER_CACHE_ENABLED:
+            owner = _claim(key)
+            if not owner:
+                call.result = _wait_remote(key, lookup)
+        if call.result is None:
+            call.result = fn()
+        return call.result
+    except Exception as e:
+        call.error = e
+        raise
+    finally:
+        if owner:
+            cache.delete(FLIGHT_PREFIX + key)
+        with _calls_lock:
+            _calls.pop(key, None)
+        call.event.set()
+
+
+async def asingle_flight(key: str, fn, lookup=None):
+    """
+    Bản async của single_flight: fn là coroutine function, lookup là hàm sync (chạy qua sync_to_async).
+    """
+    if not settings.LLM_COALESCE or key is None:
+        return await fn()
+    task = _async_calls.get(key)
+    if task is not None:
+        metrics.incr("llm.coalesced")
+        # shield: 1 request bị huỷ (client ngắt kết nối) không huỷ lời gọi của các request khác
+        return await asyncio.shield(task)
+
+    async def run():
+        owner = False
+        try:
+            result = None
+            if lookup is not None and settings.ANSWER_CACHE_ENABLED:
+                owner = await cache.aadd(FLIGHT_PREFIX + key, 1, timeout=int(_flight_timeout()))
+                if not owner:
+                    result = await _await_remote(key, lookup)
+            return result if result is not None else await fn()
+        finally:
+            if owner:
+                await cache.adelete(FLIGHT_PREFIX + key)
+            _async_calls.pop(key, None)
+
+    task = _async_calls[key] = asyncio.ensure_future(run())
+    return await asyncio.shield(task)
+
+
+def limiter_stats() -> dict:
+    process_limiter, async_limiter, _ = _limiters()
+    return {
+        "max_concurrency": settings.LLM_MAX_CONCURRENCY,
+        "max_concurrency_global": settings.LLM_MAX_CONCURRENCY_GLOBAL if settings.CACHE_REDIS_URL else None,
+        "active": process_limiter.active,
+        "waiting": process_limiter.waiting + async_limiter.waiting,
+        **metrics.snapshot(METRIC_NAMES),
+    }
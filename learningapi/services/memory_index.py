@@ -0,0 +1,205 @@
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+from django.conf import settings
+from django.db.models import Count, Max
+from django.db.models.functions import Length
+
+from ..models import Chunk, Document
+from . import metrics
+from .embedding_models import uses_chunk_column
+from .retrieval import RetrievedChunk
+
+# --- Vector index trong process cho khoá học nhỏ / vừa ---
+# Phần lớn khoá học chỉ có vài trăm tới vài nghìn chunk: giữ ma trận embedding đã chuẩn hoá của khoá học trong RAM,
+# top-k = 1 phép nhân ma trận-vector thay vì 1 round-trip pgvector kéo theo text của mọi ứng viên.
+# - load lười khi khoá học được hỏi lần đầu, bỏ bớt theo LRU khi vượt MEMORY_INDEX_MAX_MB
+# - version của khoá học lấy từ DB (số chunk, id chunk lớn nhất): ingest ở worker Celery thêm/xoá chunk thì mọi web
+#   worker đều thấy, không phụ thuộc Django cache (LocMemCache không chia sẻ giữa các process). Version được kiểm tra
+#   lại tối đa mỗi MEMORY_INDEX_RECHECK_SECONDS giây, và index được load lại sau MEMORY_INDEX_TTL_SECONDS giây
+#   (tiêu đề tài liệu đổi không làm đổi version)
+# - khoá học có hơn MEMORY_INDEX_MAX_CHUNKS chunk: search() trả None, retrieve_chunks dùng SQL như cũ
+# Text của chunk không nằm trong index: retrieval.load_texts() lấy text của các chunk được chọn vào prompt bằng 1 query.
+
+METRIC_NAMES = [
+    "memory_index.hits",
+    "memory_index.loads",
+    "memory_index.fallbacks",
+    "memory_index.evictions",
+]
+
+
+class CourseIndex:
+    def __init__(self, version, ids, document_ids, tokens, matrix, titles):
+        self.version = version
+        self.loaded_at = self.checked_at = time.monotonic()
+        self.ids = ids
+        self.document_ids = document_ids
+        self.tokens = tokens
+        self.matrix = matrix  # (n, d) float32, mỗi dòng đã chuẩn hoá
+        self.titles = titles  # document_id → title
+        self.nbytes = ids.nbytes + document_ids.nbytes + tokens.nbytes + matrix.nbytes + 256 * len(titles)
+
+    def search(self, q_emb, limit: int):
+        if not len(self.ids):
+            return []
+        q = np.asarray(q_emb, dtype=np.float32)
+        q = q / max(float(np.linalg.norm(q)), 1e-12)
+        similarity = self.matrix @ q
+        k = min(limit, len(similarity))
+        top = np.argpartition(-similarity, k - 1)[:k]
+        top = top[np.argsort(-similarity[top], kind="stable")]
+        return [
+            RetrievedChunk(
+                id=int(self.ids[i]),
+                document_id=int(self.document_ids[i]),
+                document_title=self.titles.get(int(self.document_ids[i]), ""),
+                embedding=self.matrix[i],
+                token_count=int(self.tokens[i]),
+                distance=float(1.0 - similarity[i]),
+            )
+            for i in top
+        ]
+
+
+_indexes = OrderedDict()  # (course_id, model_name) → CourseIndex
+_oversized = {}  # (course_id, model_name) → (version, thời điểm kiểm tra) lúc đếm được quá MEMORY_INDEX_MAX_CHUNKS
+_lock = threading.Lock()
+_load_locks = {}
+
+
+def course_version(course_id):
+    """
+    (số chunk, id chunk lớn nhất) của khoá học: đổi khi có chunk được thêm hoặc xoá (ingest chỉ tạo chunk mới / xoá
+    chunk cũ, không sửa chunk tại chỗ). 1 query aggregate trên index course_id.
+    """
+    stats = Chunk.objects.filter(course_id=course_id).aggregate(count=Count("id"), max_id=Max("id"))
+    return stats["count"], stats["max_id"]
+
+
+def invalidate_course(course_id):
+    """
+    Gọi khi chunk (hoặc tiêu đề tài liệu) của khoá học thay đổi: bỏ index của khoá học trong process này ngay.
+    Process khác thấy thay đổi chunk sau tối đa MEMORY_INDEX_RECHECK_SECONDS giây, tiêu đề sau MEMORY_INDEX_TTL_SECONDS.
+    """
+    with _lock:
+        for key in [key for key in _indexes if key[0] == course_id]:
+            _indexes.pop(key)
+        for key in [key for key in _oversized if key[0] == course_id]:
+            _oversized.pop(key)
+
+
+def _load(course_id, model_name: str, version):
+    """
+    Đọc embedding của khoá học từ DB. Trả về None nếu khoá học vượt MEMORY_INDEX_MAX_CHUNKS.
+    """
+    if uses_chunk_column(model_name):
+        qs = Chunk.objects.filter(course_id=course_id)
+        embedding_field = "embedding"
+    else:
+        qs = Chunk.objects.filter(course_id=course_id, embeddings__model_name=model_name)
+        embedding_field = "embeddings__embedding"
+    if qs.count() > settings.MEMORY_INDEX_MAX_CHUNKS:
+        return None
+
+    started = time.perf_counter()
+    rows = list(
+        qs.annotate(text_length=Length("text"))
+        .order_by("id")
+        .values_list("id", "document_id", "token_count", "text_length", embedding_field)
+    )
+    ids = np.fromiter((r[0] for r in rows), dtype=np.int64, count=len(rows))
+    document_ids = np.fromiter((r[1] for r in rows), dtype=np.int64, count=len(rows))
+    # chunk cũ chưa có token_count: ước lượng như context_builder.estimate_tokens
+    tokens = np.fromiter((r[2] or max(1, r[3] // 4) for r in rows), dtype=np.int32, count=len(rows))
+    matrix = np.asarray([np.asarray(r[4], dtype=np.float32) for r in rows], dtype=np.float32)
+    if rows:
+        matrix /= np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+    titles = dict(Document.objects.filter(course_id=course_id).values_list("id", "title"))
+    index = CourseIndex(version, ids, document_ids, tokens, matrix, titles)
+    metrics.incr("memory_index.loads")
+    print(f"[MemoryIndex] Loaded course {course_id} ({model_name or settings.EMBEDDING_MODEL}): "
+          f"{len(rows)} chunks, {index.nbytes / (1024 * 1024):.1f} MB in {time.perf_counter() - started:.2f}s")
+    return index
+
+
+def _store(key, index):
+    budget = settings.MEMORY_INDEX_MAX_MB * 1024 * 1024
+    with _lock:
+        _indexes[key] = index
+        _indexes.move_to_end(key)
+        total = sum(i.nbytes for i in _indexes.values())
+        while total > budget and len(_indexes) > 1:
+            _, evicted = _indexes.popitem(last=False)
+            total -= evicted.nbytes
+            metrics.incr("memory_index.evictions")
+
+
+def get_index(course_id, model_name: str = None):
+    """
+    Index của khoá học, load nếu chưa có hoặc đã cũ. None nếu khoá học quá lớn cho index trong process.
+    """
+    key = (course_id, model_name or settings.EMBEDDING_MODEL)
+    now = time.monotonic()
+    with _lock:
+        index = _indexes.get(key)
+        fresh = index is not None and now - index.loaded_at < settings.MEMORY_INDEX_TTL_SECONDS
+        if fresh and now - index.checked_at < settings.MEMORY_INDEX_RECHECK_SECONDS:
+            _indexes.move_to_end(key)
+            return index
+        oversized = _oversized.get(key)
+        if oversized is not None and now - oversized[1] < settings.MEMORY_INDEX_RECHECK_SECONDS:
+            return None
+
+    version = course_version(course_id)
+    with _lock:
+        if fresh and index.version == version:
+            index.checked_at = now
+            _indexes.move_to_end(key)
+            return index
+        if oversized is not None and oversized[0] == version:
+            _oversized[key] = (version, now)
+            return None
+        load_lock = _load_locks.setdefault(key, threading.Lock())
+
+    # Mỗi khoá học chỉ 1 thread load, các thread khác chờ rồi dùng kết quả
+    with load_lock:
+        with _lock:
+            index = _indexes.get(key)
+        if index is not None and index.version == version and index.loaded_at >= now:
+            # Thread khác vừa load xong trong lúc chờ
+            return index
+        index = _load(course_id, model_name, version)
+        if index is None:
+            with _lock:
+                _oversized[key] = (version, now)
+                _indexes.pop(key, None)
+            return None
+        _store(key, index)
+        return index
+
+
+def search(course_id, q_emb, limit: int, model_name: str = None):
+    """
+    Top-limit chunk theo cosine distance (list RetrievedChunk, chưa có text), hoặc None nếu phải dùng SQL.
+    """
+    index = get_index(course_id, model_name)
+    if index is None:
+        metrics.incr("memory_index.fallbacks")
+        return None
+    metrics.incr("memory_index.hits")
+    return index.search(q_emb, limit)
+
+
+def index_stats() -> dict:
+    with _lock:
+        indexes = list(_indexes.items())
+    return {
+        "enabled": settings.MEMORY_INDEX_ENABLED,
+        "courses": len(indexes),
+        "chunks": sum(len(i.ids) for _, i in indexes),
+        "memory_mb": round(sum(i.nbytes for _, i in indexes) / (1024 * 1024), 1),
+        **metrics.snapshot(METRIC_NAMES),
+    }
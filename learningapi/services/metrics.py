@@ -0,0 +1,34 @@
+from django.core.cache import cache
+
+# --- Metrics đơn giản cho RAG ---
+# Lưu counter trong Django cache: dùng chung giữa các worker khi CACHES trỏ tới Redis,
+# còn với LocMemCache (dev) thì số liệu chỉ tính trong process hiện tại.
+
+PREFIX = "metrics:"
+_known = set()
+
+
+def incr(name: str, amount: int = 1):
+    key = PREFIX + name
+    _known.add(name)
+    # add() chỉ set khi key chưa tồn tại, tránh ghi đè counter của worker khác
+    cache.add(key, 0, timeout=None)
+    try:
+        cache.incr(key, amount)
+    except ValueError:
+        # key vừa bị evict giữa add() và incr()
+        cache.set(key, amount, timeout=None)
+
+
+def observe_ms(name: str, ms: float):
+    """
+    Ghi nhận 1 giá trị thời gian (ms): lưu tổng và số lần để tính trung bình.
+    """
+    incr(f"{name}.count")
+    incr(f"{name}.total_ms", int(round(ms)))
+
+
+def snapshot(names=None) -> dict:
+    names = sorted(names or _known)
+    values = cache.get_many([PREFIX + n for n in names])
+    return {n: values.get(PREFIX + n, 0) for n in names}
@@ -0,0 +1,130 @@
+import hashlib
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+
+from . import metrics
+
+# --- Cache embedding câu hỏi ---
+# Câu hỏi lặp lại ("khoá học này nói về gì?") không cần encode lại. Key = text đã chuẩn hoá + model (+ backend).
+# 2 tầng:
+# - trong process: LRU có TTL, tối đa QUERY_EMBEDDING_CACHE_SIZE câu
+# - dùng chung (tuỳ chọn, QUERY_EMBEDDING_CACHE_SHARED): Django cache → Redis khi có CACHE_REDIS_URL
+
+PREFIX = "qemb:"
+METRIC_NAMES = [
+    "query_embedding_cache.local_hits",
+    "query_embedding_cache.shared_hits",
+    "query_embedding_cache.misses",
+]
+
+_SPACES = re.compile(r"\s+")
+
+
+def normalize(text: str) -> str:
+    """
+    Chuẩn hoá để các cách gõ khác nhau của cùng 1 câu hỏi dùng chung key: Unicode NFC
+    (tiếng Việt gõ dựng sẵn / tổ hợp), bỏ khoảng trắng thừa, không phân biệt hoa thường.
+    """
+    return _SPACES.sub(" ", unicodedata.normalize("NFC", text)).strip().casefold()
+
+
+def cache_key(text: str, model_name: str) -> str:
+    model_id = f"{model_name or settings.EMBEDDING_MODEL}|{settings.EMBEDDING_BACKEND}"
+    digest = hashlib.sha1(f"{model_id}\0{normalize(text)}".encode("utf-8")).hexdigest()
+    return PREFIX + digest
+
+
+class LRUCache:
+    """
+    LRU giới hạn số phần tử, mỗi phần tử hết hạn sau ttl giây (ttl = 0: không hết hạn). Thread-safe.
+    """
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            value, expires_at = item
+            if expires_at and expires_at < time.monotonic():
+                del self._items[key]
+                return None
+            self._items.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        expires_at = time.monotonic() + self.ttl if self.ttl else 0
+        with self._lock:
+            self._items[key] = (value, expires_at)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def __len__(self):
+        return len(self._items)
+
+
+_local = LRUCache(settings.QUERY_EMBEDDING_CACHE_SIZE, settings.QUERY_EMBEDDING_CACHE_TTL)
+
+
+def get_or_compute(text: str, model_name: str, compute) -> np.ndarray:
+    """
+    Embedding của câu hỏi từ cache; nếu chưa có thì gọi compute(text, model_name) và lưu vào cả 2 tầng.
+    """
+    if not settings.QUERY_EMBEDDING_CACHE_ENABLED:
+        return compute(text, model_name)
+    key = cache_key(text, model_name)
+    emb = _local.get(key)
+    if emb is not None:
+        metrics.incr("query_embedding_cache.local_hits")
+        return emb
+
+    if settings.QUERY_EMBEDDING_CACHE_SHARED:
+        data = cache.get(key)
+        if data is not None:
+            emb = np.frombuffer(data, dtype=np.float32)
+            _local.set(key, emb)
+            metrics.incr("query_embedding_cache.shared_hits")
+            return emb
+
+    metrics.incr("query_embedding_cache.misses")
+    emb = np.asarray(compute(text, model_name), dtype=np.float32)
+    # Mảng dùng chung giữa các request: không cho sửa tại chỗ
+    emb.setflags(write=False)
+    _local.set(key, emb)
+    if settings.QUERY_EMBEDDING_CACHE_SHARED:
+        cache.set(key, emb.tobytes(), timeout=settings.QUERY_EMBEDDING_CACHE_TTL or None)
+    return emb
+
+
+def cache_stats() -> dict:
+    values = metrics.snapshot(METRIC_NAMES)
+    local_hits = values["query_embedding_cache.local_hits"]
+    shared_hits = values["query_embedding_cache.shared_hits"]
+    misses = values["query_embedding_cache.misses"]
+    lookups = local_hits + shared_hits + misses
+    return {
+        "enabled": settings.QUERY_EMBEDDING_CACHE_ENABLED,
+        "shared": settings.QUERY_EMBEDDING_CACHE_SHARED,
+        "local_size": len(_local),
+        "local_hits": local_hits,
+        "shared_hits": shared_hits,
+        "misses": misses,
+        "hit_rate": round((local_hits + shared_hits) / lookups, 4) if lookups else 0.0,
+    }
@@ -1,17 +1,29 @@
 from django.db.models import F
 from ..models import Chunk
-from openai import OpenAI
 import numpy as np
-from pgvector.django import CosineDistance
-import os
+from pgvector.django import CosineDistance, VectorField
+from django.db.models.functions import Cast
+import re
+import time
+from django.conf import settings
+from asgiref.sync import sync_to_async
 
-
-import google.generativeai as genai
+from .embedding_registry import get_model
+from .embedding_models import serving_model, uses_chunk_column
+from .vector_index import vector_search_session
+from .hybrid_search import hybrid_search, quantized_vector_search
+from .context_builder import chunk_tokens
+from .retrieval import RetrievalResult, RetrievedChunk, select_context
+from .llm import get_llm
+from .llm_concurrency import asingle_flight, flight_key, single_flight
+from . import answer_cache, embedding_server, memory_index, query_embedding_cache, relevance_gate
 
 # --- Embedding ---
 # OpenAI text-embedding-ada-002: 1536 chiều.
 # OpenAI text-embedding-3-large: 3072 chiều.
 # HuggingFace all-MiniLM-L6-v2: 384 chiều.
+# Model HuggingFace chạy qua backend cắm được (EMBEDDING_BACKEND: sentence-transformers / onnx, xem embedding_backends.py);
+# các backend cho cùng 1 model có embedding tương đương (cosine >= 0.99, kiểm tra bằng check_embedding_parity).
 
 #OpenAI
 # def get_embedding(text: str) -> np.ndarray:
@@ -26,16 +38,59 @@ import google.generativeai as genai
 #     return np.array(response.data[0].embedding, dtype=np.float32)
 
 # HuggingFace (dev mode)
-def get_embedding(text: str) -> np.ndarray:
+def _encode(texts, model_name: str = None):
+    """
+    Encode qua embedding server nếu có cấu hình (EMBEDDING_SERVER_URL), server không trả lời được thì
+    encode trong process như cũ. Trả về None nếu phải encode trong process.
+    """
+    client = embedding_server.get_client()
+    if client is None:
+        return None
+    try:
+        return client.encode(texts, model_name or settings.EMBEDDING_MODEL)
+    except embedding_server.ServerDown:
+        return None
+    except Exception as e:
+        print(f"[Embedding] Embedding server unavailable, encoding in-process: {e}")
+        return None
+
+
+def get_embedding(text: str, model_name: str = None) -> np.ndarray:
     """
     Sinh embedding cho text bằng HuggingFace (dev mode).
+    model_name: mặc định EMBEDDING_MODEL; câu hỏi chat dùng serving_model() để khớp với embedding tài liệu.
     """
-    # Dùng mô hình nhẹ, phổ biến cho dev
-    from sentence_transformers import SentenceTransformer
-    model = SentenceTransformer("sentence-transformers/all-MiniLM-L6-v2")
+    embs = _encode([text], model_name)
+    if embs is not None:
+        return embs[0]
+    # Dùng mô hình nhẹ, phổ biến cho dev. Model được load 1 lần/process qua registry.
+    model = get_model(model_name)
     emb = model.encode(text)
     return np.array(emb, dtype=np.float32)
 
+
+def get_embeddings(texts, batch_size: int = None, model_name: str = None) -> np.ndarray:
+    """
+    Sinh embedding cho nhiều text cùng lúc, encode theo batch thay vì từng câu.
+    Trả về ma trận (len(texts), dim).
+    """
+    batch_size = batch_size or settings.EMBEDDING_BATCH_SIZE
+    texts = list(texts)
+    embs = _encode(texts, model_name) if texts else None
+    if embs is not None:
+        return embs
+    model = get_model(model_name)
+    if not texts:
+        return np.zeros((0, model.dimensions), dtype=np.float32)
+    embs = model.encode(texts, batch_size=batch_size)
+    return np.asarray(embs, dtype=np.float32)
+
+def get_query_embedding(question: str, model_name: str = None) -> np.ndarray:
+    """
+    Embedding của câu hỏi chat, qua cache (query_embedding_cache) để câu hỏi lặp lại không phải encode lại.
+    """
+    return query_embedding_cache.get_or_compute(question, model_name, get_embedding)
+
 # Google Generative AI (Gemini)
 # def get_embedding(text: str) -> np.ndarray:
 #     """
@@ -52,32 +107,66 @@ def get_embedding(text: str) -> np.ndarray:
 #     return np.array(emb, dtype=np.float32)
 
 # --- RAG main ---
-def generate_ai_answer(course, question: str, allow_web: bool = False, history=None):
+NOT_IN_DOCUMENTS_MARKERS = ("Tài liệu chưa đề cập", "không có thông tin")
+
+
+def retrieve_chunks(course, q_emb, question: str = None, ef_search: int = None, probes: int = None,
+                    model_name: str = None):
     """
-    Sinh câu trả lời từ AI Tutor cho 1 course cụ thể.
-    - history: list các dict {"question": ..., "answer": ...}
-    - always trích nguồn: nếu từ document thì ghi title, nếu từ internet thì ghi link
+    Lấy các chunk ứng viên (list RetrievedChunk) liên quan nhất tới câu hỏi trong khoá học (build_context chọn lại sau).
+    RETRIEVAL_MODE="hybrid": full-text + vector gộp bằng RRF (cần question), "vector": chỉ cosine distance.
+    model_name: embedding model đã encode q_emb, quyết định so với cột Chunk.embedding hay bảng ChunkEmbedding.
+    MEMORY_INDEX_ENABLED + RETRIEVAL_MODE="vector": khoá học nhỏ được tìm trong RAM (memory_index), không query pgvector.
     """
-    q_emb = get_embedding(question)
-    chunks = (
-        Chunk.objects
-        .filter(course=course)
-        .annotate(distance=CosineDistance("embedding", q_emb))
-        .order_by("distance")[:10]
-    )
+    if settings.MEMORY_INDEX_ENABLED and not (settings.RETRIEVAL_MODE == "hybrid" and question):
+        hits = memory_index.search(course.id, q_emb, settings.RAG_CANDIDATES, model_name)
+        if hits is not None:
+            return hits
+    with vector_search_session(ef_search=ef_search, probes=probes):
+        if settings.RETRIEVAL_MODE == "hybrid" and question:
+            return hybrid_search(course, question, q_emb, model_name=model_name)
+        if uses_chunk_column(model_name):
+            if settings.VECTOR_QUANTIZATION != "none":
+                return quantized_vector_search(course, q_emb)
+            qs = Chunk.objects.filter(course=course).annotate(distance=CosineDistance("embedding", q_emb))
+        else:
+            # ép kiểu vector(n) giống partial index của model trong bảng ChunkEmbedding
+            qs = Chunk.objects.filter(course=course, embeddings__model_name=model_name).annotate(
+                distance=CosineDistance(Cast("embeddings__embedding", VectorField(dimensions=len(q_emb))), q_emb)
+            )
+        # Chỉ các cột cần cho context + title tài liệu join sẵn, 1 query
+        rows = qs.order_by("distance").values(
+            "id", "document_id", "text", "embedding", "token_count", "distance", document_title=F("document__title"),
+        )[:settings.RAG_CANDIDATES]
+        # iterative scan relaxed_order có thể trả về hơi lệch thứ tự: sắp xếp lại theo distance chính xác
+        return sorted((RetrievedChunk(**row) for row in rows), key=lambda c: c.distance)
 
-    # 1. Chuẩn bị context và nguồn
-    if not chunks.exists():
-        context = "Không tìm thấy tài liệu nào liên quan trong khoá học."
-        sources = []
-    else:
-        context = "\n\n".join(c.text for c in chunks)
-        sources = [c.document.title for c in chunks]
 
-    # 2. Lịch sử hội thoại
+def retrieve(course, q_emb, question: str = None, ef_search: int = None, probes: int = None,
+             model_name: str = None) -> RetrievalResult:
+    """
+    Retrieve ứng viên rồi chọn context cho prompt (MMR + ngân sách token).
+    Kết quả dùng chung cho build_prompt và response (sources), không query lại.
+    """
+    candidates = retrieve_chunks(course, q_emb, question, ef_search=ef_search, probes=probes, model_name=model_name)
+    return select_context(candidates)
+
+
+def build_prompt(course, question: str, retrieval: RetrievalResult, history=None) -> str:
+    """
+    Ghép context đã chọn (retrieval.chunks), lịch sử hội thoại và câu hỏi thành prompt.
+    """
+    # 1. Context và nguồn
+    chunks = retrieval.chunks
+    sources = retrieval.sources
+    context = retrieval.context if chunks else "Không tìm thấy tài liệu nào liên quan trong khoá học."
+
+    # 2. Lịch sử hội thoại: tóm tắt các lượt cũ + các lượt gần nhất (conversation.get_history)
     history_prompt = ""
     if history:
-        for turn in history:
+        if history.summary:
+            history_prompt += f"\nTóm tắt các lượt trước:\n{history.summary}\n"
+        for turn in history.turns:
             history_prompt += f"\nHọc viên: {turn['question']}\nAI: {turn['answer']}\n"
 
     # 3. Prompt cho AI: luôn yêu cầu trích nguồn
@@ -98,43 +187,16 @@ Yêu cầu:
 - Luôn trả lời bằng tiếng Việt, văn phong thân thiện, dễ hiểu.
 - Luôn ghi rõ nguồn tham khảo cuối câu trả lời.
     """
+    context_tokens = sum(chunk_tokens(c) for c in chunks)
+    print(f"[RAG] Prompt for course {course.id}: {len(prompt)} chars, "
+          f"{len(chunks)} chunks / {context_tokens} context tokens, {len(history or [])} history turns"
+          f"{' + summary' if history and history.summary else ''}")
+    return prompt
 
-    # 4. Gọi GPT
-
-    #dev mode với LM Studio
-    # client = OpenAI(
-    #     base_url="http://localhost:1234/v1",
-    #     api_key="lm-studio"  # dummy key
-    # )
-
-    # resp = client.chat.completions.create(
-    #     model="openai/gpt-oss-20b",
-    #     messages=[
-    #         {"role": "system", "content": "Bạn là AI tutor."},
-    #         {"role": "user", "content": prompt}
-    #     ]
-    # )
-
-    #OpenAI
-    # client = OpenAI()
-    # resp = client.chat.completions.create(
-    #     model="gpt-4o-mini",
-    #     messages=[{"role": "user", "content": prompt}],
-    #     temperature=0.3,
-    #     max_tokens=800
-    # )
-    # answer = resp.choices[0].message.content
-
-    # Google Generative AI (Gemini)
-    genai.configure(api_key=os.environ.get("GOOGLE_API_KEY"))
-    model = genai.GenerativeModel("gemini-2.5-flash")
-    response = model.generate_content(prompt)
-    answer = response.text.strip()
-
-    # 4. Nếu AI trả lời là "Tài liệu chưa đề cập..." thì tìm trên internet
-    if "Tài liệu chưa đề cập" in answer or "không có thông tin" in answer or not chunks.exists():
-        # Prompt lại cho AI tìm trên internet, yêu cầu trả lời kèm link nguồn
-        web_prompt = f"""
+
+def build_web_prompt(course, question: str) -> str:
+    # Prompt lại cho AI tìm trên internet, yêu cầu trả lời kèm link nguồn
+    return f"""
 Bạn là AI tutor cho khóa học "{course.title}".
 Câu hỏi của học viên: {question}
 
@@ -144,12 +206,222 @@ Yêu cầu:
 - Luôn ghi rõ nguồn tham khảo (đường link) cuối câu trả lời
 - Khi ghi nguồn tham khảo, hãy để đường link đầy đủ. Ví dụ: "Nguồn: https://example.com"
 """
-        web_response = model.generate_content(web_prompt)
-        answer = web_response.text.strip()
-        # Trích xuất link nguồn từ câu trả lời (nếu có)
-        import re
-        links = re.findall(r'(https?://[^\s]+)', answer)
-        sources = links if links else ["Internet"]
+
+
+def needs_web_answer(answer: str, chunks) -> bool:
+    return not chunks or any(marker in answer for marker in NOT_IN_DOCUMENTS_MARKERS)
+
+
+def web_sources(answer: str):
+    # Trích xuất link nguồn từ câu trả lời (nếu có)
+    links = re.findall(r'(https?://[^\s]+)', answer)
+    return links if links else ["Internet"]
+
+
+def generate_ai_answer(course, question: str, allow_web: bool = False, history=None,
+                       ef_search: int = None, probes: int = None):
+    """
+    Sinh câu trả lời từ AI Tutor cho 1 course cụ thể.
+    - history: ConversationHistory (conversation.get_history): tóm tắt + các lượt gần nhất
+    - ef_search / probes: tham số recall của index ANN cho request này (None = mặc định trong settings)
+    - always trích nguồn: nếu từ document thì ghi title, nếu từ internet thì ghi link
+    """
+    started = time.perf_counter()
+    # Câu hỏi độc lập không cần lịch sử → câu trả lời chỉ dựa trên tài liệu, dùng được answer cache
+    history = answer_cache.relevant_history(question, history)
+    # Câu hỏi và chunk phải dùng cùng 1 embedding model cho cả request
+    model_name = serving_model()
+    q_emb = get_query_embedding(question, model_name)
+
+    # 0. Câu hỏi gần giống đã được trả lời trong khoá học → dùng lại, không gọi LLM
+    cached = answer_cache.lookup(course, q_emb, model_name, history=history)
+    if cached is not None:
+        return cached
+
+    # Cùng câu hỏi (không kèm lịch sử) đang được trả lời ở request / worker khác → dùng chung kết quả
+    return single_flight(
+        flight_key(course.id, question, model_name, history=history),
+        lambda: _answer(course, question, q_emb, model_name, history, ef_search, probes, started),
+        lookup=lambda: answer_cache.lookup(course, q_emb, model_name, history=history),
+    )
+
+
+def _answer(course, question, q_emb, model_name, history, ef_search, probes, started):
+    retrieval = retrieve(course, q_emb, question, ef_search=ef_search, probes=probes, model_name=model_name)
+    llm = get_llm()
+    calls = 1
+
+    # Tài liệu không liên quan (relevance gate) → hỏi thẳng internet, 1 lần gọi LLM
+    if relevance_gate.choose_strategy(retrieval) == relevance_gate.WEB:
+        answer = llm.generate(build_web_prompt(course, question))
+        sources = web_sources(answer)
+    else:
+        answer = llm.generate(build_prompt(course, question, retrieval, history))
+        sources = retrieval.sources
+        # 4. Nếu AI vẫn trả lời là "Tài liệu chưa đề cập..." thì tìm trên internet
+        if needs_web_answer(answer, retrieval.chunks):
+            answer = llm.generate(build_web_prompt(course, question))
+            sources = web_sources(answer)
+            calls = 2
+    relevance_gate.record_calls(calls)
     print("Sources:", sources)
     print("Answer:", answer)
+    answer_cache.store(
+        course, question, q_emb, answer, sources, (time.perf_counter() - started) * 1000, model_name, history=history
+    )
+    return answer, sources
+
+
+def stream_ai_answer(course, question: str, history=None, ef_search: int = None, probes: int = None):
+    """
+    Giống generate_ai_answer nhưng yield từng sự kiện (event, data) trong lúc model đang sinh:
+    - ("sources", [...]): nguồn tài liệu đã retrieve, gửi đầu tiên
+    - ("token", "..."): từng đoạn text model sinh ra
+    - ("reset", {"sources": [...]}): câu trả lời từ tài liệu bị bỏ, chuyển sang trả lời từ internet
+    - ("done", {"answer": ..., "sources": [...]}): câu trả lời hoàn chỉnh
+    """
+    started = time.perf_counter()
+    history = answer_cache.relevant_history(question, history)
+    model_name = serving_model()
+    q_emb = get_query_embedding(question, model_name)
+
+    cached = answer_cache.lookup(course, q_emb, model_name, history=history)
+    if cached is not None:
+        answer, sources = cached
+        yield "sources", sources
+        yield "token", answer
+        yield "done", {"answer": answer, "sources": sources}
+        return
+
+    retrieval = retrieve(course, q_emb, question, ef_search=ef_search, probes=probes, model_name=model_name)
+    llm = get_llm()
+    calls = 1
+    if relevance_gate.choose_strategy(retrieval) == relevance_gate.WEB:
+        yield "sources", []
+        web = True
+    else:
+        sources = retrieval.sources
+        yield "sources", sources
+        parts = []
+        for part in llm.stream(build_prompt(course, question, retrieval, history)):
+            parts.append(part)
+            yield "token", part
+        answer = "".join(parts).strip()
+        web = needs_web_answer(answer, retrieval.chunks)
+        if web:
+            yield "reset", {"sources": []}
+            calls = 2
+
+    if web:
+        parts = []
+        for part in llm.stream(build_web_prompt(course, question)):
+            parts.append(part)
+            yield "token", part
+        answer = "".join(parts).strip()
+        sources = web_sources(answer)
+    relevance_gate.record_calls(calls)
+
+    answer_cache.store(
+        course, question, q_emb, answer, sources, (time.perf_counter() - started) * 1000, model_name, history=history
+    )
+    yield "done", {"answer": answer, "sources": sources}
+
+
+async def astream_ai_answer(course, question: str, history=None, ef_search: int = None, probes: int = None):
+    """
+    Bản async của stream_ai_answer (cùng các sự kiện) cho view SSE chạy qua ASGI: generator đồng bộ bị Django
+    gom hết (sync_to_async(list)) trước khi gửi byte đầu tiên, async generator thì được gửi ngay từng token.
+    """
+    started = time.perf_counter()
+    history = answer_cache.relevant_history(question, history)
+    model_name = await sync_to_async(serving_model)()
+    q_emb = await sync_to_async(get_query_embedding, thread_sensitive=False)(question, model_name)
+
+    cached = await sync_to_async(answer_cache.lookup)(course, q_emb, model_name, history=history)
+    if cached is not None:
+        answer, sources = cached
+        yield "sources", sources
+        yield "token", answer
+        yield "done", {"answer": answer, "sources": sources}
+        return
+
+    retrieval = await sync_to_async(retrieve)(
+        course, q_emb, question, ef_search=ef_search, probes=probes, model_name=model_name
+    )
+    llm = get_llm()
+    calls = 1
+    if relevance_gate.choose_strategy(retrieval) == relevance_gate.WEB:
+        yield "sources", []
+        web = True
+    else:
+        sources = retrieval.sources
+        yield "sources", sources
+        parts = []
+        async for part in llm.astream(build_prompt(course, question, retrieval, history)):
+            parts.append(part)
+            yield "token", part
+        answer = "".join(parts).strip()
+        web = needs_web_answer(answer, retrieval.chunks)
+        if web:
+            yield "reset", {"sources": []}
+            calls = 2
+
+    if web:
+        parts = []
+        async for part in llm.astream(build_web_prompt(course, question)):
+            parts.append(part)
+            yield "token", part
+        answer = "".join(parts).strip()
+        sources = web_sources(answer)
+    relevance_gate.record_calls(calls)
+
+    await sync_to_async(answer_cache.store)(
+        course, question, q_emb, answer, sources, (time.perf_counter() - started) * 1000, model_name, history=history
+    )
+    yield "done", {"answer": answer, "sources": sources}
+
+
+async def agenerate_ai_answer(course, question: str, history=None, ef_search: int = None, probes: int = None):
+    """
+    Bản async của generate_ai_answer cho view chạy qua ASGI: chờ LLM bằng get_llm().agenerate
+    nên 1 worker giữ được nhiều request đang chờ model cùng lúc.
+    Encode câu hỏi (CPU) chạy trong thread pool, truy vấn DB chạy qua sync_to_async.
+    """
+    started = time.perf_counter()
+    history = answer_cache.relevant_history(question, history)
+    model_name = await sync_to_async(serving_model)()
+    q_emb = await sync_to_async(get_query_embedding, thread_sensitive=False)(question, model_name)
+
+    cached = await sync_to_async(answer_cache.lookup)(course, q_emb, model_name, history=history)
+    if cached is not None:
+        return cached
+
+    return await asingle_flight(
+        flight_key(course.id, question, model_name, history=history),
+        lambda: _aanswer(course, question, q_emb, model_name, history, ef_search, probes, started),
+        lookup=lambda: answer_cache.lookup(course, q_emb, model_name, history=history),
+    )
+
+
+async def _aanswer(course, question, q_emb, model_name, history, ef_search, probes, started):
+    retrieval = await sync_to_async(retrieve)(
+        course, q_emb, question, ef_search=ef_search, probes=probes, model_name=model_name
+    )
+    llm = get_llm()
+    calls = 1
+    if relevance_gate.choose_strategy(retrieval) == relevance_gate.WEB:
+        answer = await llm.agenerate(build_web_prompt(course, question))
+        sources = web_sources(answer)
+    else:
+        answer = await llm.agenerate(build_prompt(course, question, retrieval, history))
+        sources = retrieval.sources
+        if needs_web_answer(answer, retrieval.chunks):
+            answer = await llm.agenerate(build_web_prompt(course, question))
+            sources = web_sources(answer)
+            calls = 2
+    relevance_gate.record_calls(calls)
+
+    await sync_to_async(answer_cache.store)(
+        course, question, q_emb, answer, sources, (time.perf_counter() - started) * 1000, model_name, history=history
+    )
     return answer, sources
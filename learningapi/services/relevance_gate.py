@@ -0,0 +1,71 @@
+from django.conf import settings
+
+from . import metrics
+
+# --- Relevance gate: chọn prompt tài liệu hay internet TRƯỚC lần gọi LLM đầu tiên ---
+# Trước đây câu hỏi ngoài tài liệu tốn 2 lần gọi LLM: prompt tài liệu → model trả "Tài liệu chưa đề cập" → prompt web.
+# Gate nhìn phân bố cosine distance của các chunk ứng viên: trung bình RELEVANCE_GATE_TOP_K distance nhỏ nhất
+# > RELEVANCE_GATE_MAX_DISTANCE thì coi như tài liệu không đề cập và gửi thẳng prompt web (1 lần gọi).
+# Gate chọn "docs" mà model vẫn trả lời "chưa đề cập" thì vẫn gọi lần 2 như cũ; tỉ lệ đó được ghi lại
+# (relevance_gate.two_calls / relevance_gate.requests) để chỉnh ngưỡng, xem `manage.py calibrate_relevance_gate`.
+
+DOCS = "docs"
+WEB = "web"
+METRIC_NAMES = [
+    "relevance_gate.requests",
+    "relevance_gate.docs",
+    "relevance_gate.web",
+    "relevance_gate.two_calls",
+]
+
+
+def relevance_score(candidates, top_k: int = None):
+    """
+    Trung bình top_k cosine distance nhỏ nhất của các ứng viên (càng nhỏ càng liên quan).
+    None nếu không có ứng viên nào có distance (VD hybrid chỉ khớp full-text).
+    """
+    top_k = top_k or settings.RELEVANCE_GATE_TOP_K
+    distances = sorted(float(c.distance) for c in candidates if c.distance is not None)[:top_k]
+    if not distances:
+        return None
+    return sum(distances) / len(distances)
+
+
+def choose_strategy(retrieval) -> str:
+    """
+    DOCS: trả lời bằng prompt có context tài liệu, WEB: bỏ context, gửi thẳng prompt tìm trên internet.
+    """
+    if not retrieval.chunks:
+        strategy = WEB
+    elif not settings.RELEVANCE_GATE_ENABLED:
+        strategy = DOCS
+    else:
+        score = relevance_score(retrieval.candidates)
+        strategy = WEB if score is not None and score > settings.RELEVANCE_GATE_MAX_DISTANCE else DOCS
+        if strategy == WEB:
+            print(f"[RelevanceGate] score={score:.4f} > {settings.RELEVANCE_GATE_MAX_DISTANCE} → web prompt")
+    metrics.incr(f"relevance_gate.{strategy}")
+    return strategy
+
+
+def record_calls(calls: int):
+    """
+    Ghi nhận số lần gọi LLM của 1 câu trả lời (1 hoặc 2).
+    """
+    metrics.incr("relevance_gate.requests")
+    if calls > 1:
+        metrics.incr("relevance_gate.two_calls")
+
+
+def gate_stats() -> dict:
+    values = metrics.snapshot(METRIC_NAMES)
+    requests = values["relevance_gate.requests"]
+    return {
+        "enabled": settings.RELEVANCE_GATE_ENABLED,
+        "max_distance": settings.RELEVANCE_GATE_MAX_DISTANCE,
+        "requests": requests,
+        "docs": values["relevance_gate.docs"],
+        "web": values["relevance_gate.web"],
+        "two_calls": values["relevance_gate.two_calls"],
+        "two_call_rate": round(values["relevance_gate.two_calls"] / requests, 4) if requests else 0.0,
+    }
@@ -0,0 +1,91 @@
+from dataclasses import dataclass, field
+
+import numpy as np
+from django.db import connection
+from pgvector import Vector
+
+from ..models import Chunk
+from .context_builder import build_context
+
+# --- Kết quả retrieval ---
+# Mọi nhánh retrieval (hybrid SQL, vector SQL, ORM, index trong process) trả về RetrievedChunk: chỉ các cột cần cho
+# context + trích nguồn, tiêu đề tài liệu join sẵn trong cùng câu query → không lazy-load chunk.document cho từng chunk.
+# RetrievalResult được build_prompt và response dùng chung (context, sources, distances), không query lại.
+
+# Cột lấy trong các câu SQL retrieval (alias c = learningapi_chunk, d = learningapi_document)
+SELECT_COLUMNS = "c.id, c.document_id, d.title AS document_title, c.text, c.embedding, c.token_count"
+
+
+@dataclass
+class RetrievedChunk:
+    id: int
+    document_id: int
+    document_title: str
+    embedding: np.ndarray
+    token_count: int
+    distance: float = None
+    text: str = None  # None: chưa load (index trong process), điền bởi load_texts()
+    rrf_score: float = None  # chỉ có với hybrid search
+
+
+@dataclass
+class RetrievalResult:
+    candidates: list = field(default_factory=list)  # theo thứ tự retrieval
+    chunks: list = field(default_factory=list)  # chọn vào prompt (MMR + ngân sách token), đã có text
+
+    @property
+    def sources(self) -> list:
+        return [c.document_title for c in self.chunks]
+
+    @property
+    def distances(self) -> list:
+        return [c.distance for c in self.chunks]
+
+    @property
+    def context(self) -> str:
+        return "\n\n".join(c.text for c in self.chunks)
+
+
+def fetch_chunks(sql: str, params) -> list:
+    """
+    Chạy câu SQL retrieval (cột SELECT_COLUMNS, tuỳ chọn distance / rrf_score) và trả về list RetrievedChunk.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        names = [col[0] for col in cursor.description]
+        rows = [dict(zip(names, row)) for row in cursor.fetchall()]
+    for row in rows:
+        row["embedding"] = from_db_vector(row["embedding"])
+    return [RetrievedChunk(**row) for row in rows]
+
+
+def to_db_vector(values) -> str:
+    """
+    Tham số SQL cho 1 vector (dạng text '[...]' của pgvector, dùng với %s::vector) qua API công khai của pgvector.
+    """
+    return Vector(list(values)).to_text()
+
+
+def from_db_vector(value) -> np.ndarray:
+    """
+    Cột vector đọc bằng SQL thô (psycopg2 trả về text) → np.ndarray float32.
+    """
+    if value is None or isinstance(value, np.ndarray):
+        return value
+    return Vector.from_text(value).to_numpy().astype(np.float32)
+
+
+def load_texts(chunks):
+    """
+    Điền text cho các chunk chưa có, 1 query cho cả danh sách.
+    """
+    missing = [c for c in chunks if c.text is None]
+    if missing:
+        texts = dict(Chunk.objects.filter(id__in=[c.id for c in missing]).values_list("id", "text"))
+        for c in missing:
+            c.text = texts.get(c.id, "")
+    return chunks
+
+
+def select_context(candidates) -> RetrievalResult:
+    return RetrievalResult(candidates=candidates, chunks=load_texts(build_context(candidates)))
@@ -0,0 +1,236 @@
+import math
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connection, transaction
+
+# --- ANN index cho Chunk.embedding ---
+# pgvector hỗ trợ 2 loại index xấp xỉ (ANN):
+# - HNSW: recall cao, build chậm hơn, không cần dữ liệu trước khi build. Tham số lúc query: hnsw.ef_search
+# - IVFFlat: build nhanh, nhẹ, nhưng nên build sau khi đã có dữ liệu. Tham số lúc query: ivfflat.probes
+# settings.VECTOR_INDEX_TYPE chọn loại index đang dùng ("hnsw", "ivfflat" hoặc "none").
+# settings.VECTOR_QUANTIZATION: build index trên bản lượng tử hoá của embedding để index nhỏ hơn (nằm gọn trong RAM):
+# - "halfvec": float16, index ~1/2, recall gần như không đổi
+# - "binary": 1 bit/chiều (binary_quantize, khoảng cách Hamming), index ~1/32, cần re-rank
+# Cột Chunk.embedding vẫn giữ float32 để re-rank chính xác các ứng viên lấy từ index (VECTOR_RERANK).
+# Filter course_id được áp dụng SAU khi quét index: HNSW chỉ trả về ef_search dòng gần nhất của cả bảng, khoá học nhỏ
+# trong bảng nhiều khoá học có thể nhận ít hơn k chunk (hoặc không có). pgvector >= 0.8 có iterative scan
+# (VECTOR_ITERATIVE_SCAN, mặc định relaxed_order) để index quét tiếp tới khi đủ dòng thoả filter; pgvector cũ hơn
+# thì ef_search được nâng lên VECTOR_HNSW_EF_SEARCH_FILTERED.
+
+INDEX_TYPES = ("hnsw", "ivfflat")
+QUANTIZATIONS = ("none", "halfvec", "binary")
+ITERATIVE_SCAN_MIN_VERSION = (0, 8)
+
+CHUNK_TABLE = "learningapi_chunk"
+CHUNK_COLUMN = "embedding"
+COSINE_OPCLASS = "vector_cosine_ops"
+# Bằng embedding_models.SERVING_CACHE_SECONDS: promote chờ chừng ấy giây để mọi process thấy cột mới
+CHUNK_DIMENSIONS_CACHE_SECONDS = 30
+
+_chunk_dimensions = {"value": None, "checked_at": 0.0}
+
+
+def index_name(kind: str, table: str = CHUNK_TABLE, column: str = CHUNK_COLUMN, quantization: str = None) -> str:
+    name = f"{table}_{column}_{kind}"
+    return f"{name}_{quantization}" if quantization and quantization != "none" else name
+
+
+def chunk_dimensions() -> int:
+    """
+    Số chiều hiện tại của Chunk.embedding, dùng cho các phép cast halfvec(n) / bit(n) của index lượng tử hoá.
+    Đọc từ database (column_dimensions) vì promote_embedding_model --resize đổi cột bằng ALTER TABLE trong khi models.py
+    và migration vẫn khai báo số chiều cũ; database không phải PostgreSQL thì dùng khai báo của model.
+    Kết quả được nhớ trong process CHUNK_DIMENSIONS_CACHE_SECONDS giây (reset_chunk_dimensions sau khi đổi cột).
+    """
+    now = time.monotonic()
+    if _chunk_dimensions["value"] is None or now - _chunk_dimensions["checked_at"] > CHUNK_DIMENSIONS_CACHE_SECONDS:
+        from ..models import Chunk
+        dimensions = column_dimensions() or Chunk._meta.get_field(CHUNK_COLUMN).dimensions
+        _chunk_dimensions.update(value=dimensions, checked_at=now)
+    return _chunk_dimensions["value"]
+
+
+def reset_chunk_dimensions():
+    _chunk_dimensions.update(value=None, checked_at=0.0)
+
+
+def column_dimensions(table: str = CHUNK_TABLE, column: str = CHUNK_COLUMN, conn=None):
+    """
+    Số chiều thực tế của cột vector trong database (typmod của kiểu vector(n)), None nếu cột không khai báo số chiều.
+    """
+    conn = conn or connection
+    if conn.vendor != "postgresql":
+        return None
+    with conn.cursor() as cursor:
+        cursor.execute(
+            "SELECT atttypmod FROM pg_attribute WHERE attrelid = %s::regclass AND attname = %s",
+            [table, column],
+        )
+        row = cursor.fetchone()
+    return row[0] if row and row[0] > 0 else None
+
+
+def quantized_expression(quantization: str, dimensions: int, column: str = CHUNK_COLUMN):
+    """
+    (biểu thức được index, operator class) cho từng kiểu lượng tử hoá.
+    """
+    if quantization == "halfvec":
+        return f"({column})::halfvec({int(dimensions)})", "halfvec_cosine_ops"
+    if quantization == "binary":
+        return f"binary_quantize({column})::bit({int(dimensions)})", "bit_hamming_ops"
+    if quantization not in (None, "none"):
+        raise ValueError(f"Unknown vector quantization: {quantization}")
+    return column, COSINE_OPCLASS
+
+
+def approx_distance_sql(quantization: str, dimensions: int, column: str = CHUNK_COLUMN,
+                        query: str = "%(q_emb)s::vector") -> str:
+    """
+    Biểu thức khoảng cách dùng trong ORDER BY để query dùng được index lượng tử hoá (phải khớp quantized_expression).
+    """
+    expression, _ = quantized_expression(quantization, dimensions, column)
+    if quantization == "halfvec":
+        return f"{expression} <=> ({query})::halfvec({int(dimensions)})"
+    if quantization == "binary":
+        return f"{expression} <~> binary_quantize({query})::bit({int(dimensions)})"
+    return f"{column} <=> {query}"
+
+
+def ivfflat_lists(rows: int) -> int:
+    """
+    Số list cho IVFFlat theo khuyến nghị của pgvector: rows/1000 tới 1M dòng, sqrt(rows) khi lớn hơn.
+    """
+    if rows > 1_000_000:
+        return int(math.sqrt(rows))
+    return max(10, rows // 1000)
+
+
+def create_index_sql(kind: str, table: str = CHUNK_TABLE, column: str = CHUNK_COLUMN,
+                     opclass: str = COSINE_OPCLASS, rows: int = 0, expression: str = None,
+                     name: str = None, where: str = None) -> str:
+    target = expression or column
+    name = name or index_name(kind, table, column)
+    if kind == "hnsw":
+        with_params = f"m = {int(settings.VECTOR_HNSW_M)}, ef_construction = {int(settings.VECTOR_HNSW_EF_CONSTRUCTION)}"
+    elif kind == "ivfflat":
+        with_params = f"lists = {ivfflat_lists(rows)}"
+    else:
+        raise ValueError(f"Unknown vector index type: {kind}")
+    sql = f"CREATE INDEX IF NOT EXISTS {name} ON {table} USING {kind} (({target}) {opclass}) WITH ({with_params})"
+    # partial index (ví dụ chỉ embedding của 1 model trong bảng ChunkEmbedding)
+    return f"{sql} WHERE {where}" if where else sql
+
+
+def ensure_vector_index(kind: str = None, table: str = CHUNK_TABLE, column: str = CHUNK_COLUMN,
+                        opclass: str = COSINE_OPCLASS, expression: str = None, rebuild: bool = False,
+                        using=None, name_prefix: str = None, where: str = None, quantization: str = None,
+                        dimensions: int = None):
+    """
+    Tạo index ANN theo settings.VECTOR_INDEX_TYPE và xoá index của loại còn lại.
+    rebuild=True: build lại index đang chọn (ví dụ IVFFlat sau khi dữ liệu thay đổi nhiều).
+    name_prefix / where: tên và điều kiện cho partial index (tên mặc định: <table>_<column>_<kind>).
+    quantization: chỉ áp dụng cho Chunk.embedding (mặc định settings.VECTOR_QUANTIZATION).
+    dimensions: số chiều của Chunk.embedding cho index lượng tử hoá (mặc định chunk_dimensions()).
+    """
+    from django.db import connections
+    conn = connections[using] if using else connection
+    if conn.vendor != "postgresql":
+        return
+    kind = kind or settings.VECTOR_INDEX_TYPE
+    variants = [(k, None) for k in INDEX_TYPES]
+    if table == CHUNK_TABLE and column == CHUNK_COLUMN and expression is None and name_prefix is None:
+        # Index của Chunk.embedding: có thể build trên bản lượng tử hoá, mỗi kiểu có tên index riêng
+        quantization = quantization or settings.VECTOR_QUANTIZATION
+        expression, opclass = quantized_expression(quantization, dimensions or chunk_dimensions(), column)
+        variants = [(k, q) for k in INDEX_TYPES for q in QUANTIZATIONS]
+    else:
+        quantization = None
+
+    def name_for(k, q=None):
+        return f"{name_prefix}_{k}" if name_prefix else index_name(k, table, column, q)
+
+    with conn.cursor() as cursor:
+        for other, q in variants:
+            if (other, q or "none") != (kind, quantization or "none") or rebuild:
+                cursor.execute(f"DROP INDEX IF EXISTS {name_for(other, q)}")
+        if kind in INDEX_TYPES:
+            rows = 0
+            if kind == "ivfflat":
+                cursor.execute(f"SELECT count(*) FROM {table}" + (f" WHERE {where}" if where else ""))
+                rows = cursor.fetchone()[0]
+            name = name_for(kind, quantization)
+            print(f"[VectorIndex] Building {kind} index {name} on {table} ({rows} rows)")
+            cursor.execute(create_index_sql(kind, table, column, opclass, rows, expression, name, where))
+
+
+_pgvector_versions = {}
+
+
+def pgvector_version(conn=None):
+    """
+    Phiên bản extension vector của database (tuple, ví dụ (0, 8, 0)), đọc 1 lần mỗi process. None nếu chưa cài.
+    """
+    conn = conn or connection
+    if conn.alias not in _pgvector_versions:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT extversion FROM pg_extension WHERE extname = 'vector'")
+            row = cursor.fetchone()
+        _pgvector_versions[conn.alias] = (
+            tuple(int(part) for part in row[0].split(".") if part.isdigit()) if row else None
+        )
+    return _pgvector_versions[conn.alias]
+
+
+def supports_iterative_scan(conn=None) -> bool:
+    version = pgvector_version(conn)
+    return version is not None and version >= ITERATIVE_SCAN_MIN_VERSION
+
+
+def clamp_search_params(ef_search=None, probes=None):
+    """
+    Giới hạn tham số recall do client gửi lên để 1 request không thể quét toàn bộ index.
+    """
+    if ef_search is not None:
+        ef_search = max(1, min(int(ef_search), settings.VECTOR_HNSW_EF_SEARCH_MAX))
+    if probes is not None:
+        probes = max(1, min(int(probes), settings.VECTOR_IVFFLAT_PROBES_MAX))
+    return ef_search, probes
+
+
+@contextmanager
+def vector_search_session(ef_search=None, probes=None):
+    """
+    Mở transaction và set tham số recall/latency cho index ANN (chỉ có hiệu lực trong transaction này).
+    Query phải được evaluate bên trong khối with.
+    """
+    ef_search, probes = clamp_search_params(ef_search, probes)
+    with transaction.atomic():
+        if connection.vendor == "postgresql":
+            with connection.cursor() as cursor:
+                kind = settings.VECTOR_INDEX_TYPE
+                # pgvector >= 0.8: quét tiếp index khi filter theo course loại bớt kết quả
+                iterative = (
+                    kind in INDEX_TYPES and settings.VECTOR_ITERATIVE_SCAN not in ("", "off")
+                    and supports_iterative_scan()
+                )
+                if kind == "hnsw":
+                    ef_search = ef_search or settings.VECTOR_HNSW_EF_SEARCH
+                    if not iterative:
+                        # Không có iterative scan: cần nhiều ứng viên hơn để sau khi lọc theo course vẫn còn đủ k dòng
+                        ef_search = max(ef_search, settings.VECTOR_HNSW_EF_SEARCH_FILTERED)
+                    if settings.VECTOR_QUANTIZATION != "none" and settings.VECTOR_RERANK:
+                        # HNSW trả về tối đa ef_search dòng: phải đủ ứng viên cho bước re-rank
+                        ef_search = max(ef_search, settings.VECTOR_RERANK_CANDIDATES)
+                    cursor.execute("SELECT set_config('hnsw.ef_search', %s, true)", [str(ef_search)])
+                elif kind == "ivfflat":
+                    cursor.execute(
+                        "SELECT set_config('ivfflat.probes', %s, true)",
+                        [str(probes or settings.VECTOR_IVFFLAT_PROBES)],
+                    )
+                if iterative:
+                    # ivfflat chỉ hỗ trợ relaxed_order
+                    mode = "relaxed_order" if kind == "ivfflat" else settings.VECTOR_ITERATIVE_SCAN
+                    cursor.execute(f"SELECT set_config('{kind}.iterative_scan', %s, true)", [mode])
+        yield
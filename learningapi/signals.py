@@ -5,7 +5,7 @@ from django.conf import settings
 
 from learningapi import models
 
-from django.db.models.signals import post_delete, post_save
+from django.db.models.signals import post_delete, post_save, pre_save
 from django.dispatch import receiver
 from .models import *
 
@@ -106,14 +106,41 @@ def create_default_superuser_and_tags(sender, **kwargs):
 @receiver(post_delete, sender=Document)
 def delete_chunks_on_document_delete(sender, instance, **kwargs):
     Chunk.objects.filter(document=instance).delete()
+    from .services import answer_cache, memory_index
+    answer_cache.invalidate_course(instance.course_id)
+    memory_index.invalidate_course(instance.course_id)
+    _recompute_progress(instance.course_id)
+
+def _recompute_progress(course_id):
+    # Tập tài liệu của khoá học đổi → tính lại progress mọi learner (1 câu UPDATE) sau khi transaction commit
+    from django.db import transaction
+    transaction.on_commit(lambda: CourseProgress.update_all_progress(course_id))
+
+@receiver(pre_save, sender=Document)
+def remember_document_source(sender, instance, update_fields=None, **kwargs):
+    # Snapshot file/url trước khi lưu: sửa tiêu đề / mô tả không được kéo theo tải lại và chunk lại tài liệu
+    if instance.pk is None:
+        instance._source_changed = True
+    elif update_fields is not None and not {"file", "url"} & set(update_fields):
+        instance._source_changed = False
+    else:
+        previous = Document.objects.filter(pk=instance.pk).values_list("file", "url").first()
+        instance._source_changed = previous is None or (previous[0] or "", previous[1] or "") != (
+            instance.file or "", instance.url or ""
+        )
 
 @receiver(post_save, sender=Document)
 def update_chunks_on_document_update(sender, instance, created, **kwargs):
-    # Nếu là update (không phải tạo mới), và file/url thay đổi thì xóa chunk cũ và ingest lại
-    if not created:
-        old_instance = Document.objects.get(pk=instance.pk)
-        # Chỉ ingest nếu file là string (tức là đã upload xong)
-        if (old_instance.file != instance.file or old_instance.url != instance.url) and isinstance(instance.file, str):
-            Chunk.objects.filter(document=instance).delete()
-            from .services.document_ingestion import ingest_document
-            ingest_document(instance)
\ No newline at end of file
+    if created:
+        _recompute_progress(instance.course_id)
+    else:
+        # index trong process lưu tiêu đề tài liệu để trích nguồn
+        from .services import memory_index
+        memory_index.invalidate_course(instance.course_id)
+    # Chỉ thay đổi file/url (tạo mới, sửa qua API hay admin) mới đi qua coordinator: coordinator gộp trigger lặp lại
+    # khi phiên bản này đang được ingest và job chạy ngoài request thread. Kiểm tra lại nội dung ở cùng file/url
+    # (trang web sửa, upload đè) là thao tác riêng: POST /documents/<id>/reingest/
+    # Chỉ ingest nếu file là string (tức là đã upload xong) hoặc là url
+    if getattr(instance, "_source_changed", True) and (isinstance(instance.file, str) or instance.url):
+        from .services.ingestion_coordinator import request_ingestion
+        request_ingestion(instance)
\ No newline at end of file
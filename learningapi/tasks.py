@@ -1,11 +1,96 @@
-from celery import shared_task
+from celery import Task, chain, shared_task
+from django.conf import settings
+from django.core.cache import cache
 from .models import Document
-from .services.document_ingestion import ingest_document
+from .services.ingestion_coordinator import BUSY_RETRY_SECONDS, DocumentBusy, request_ingestion, run_job
+from .services import embedding_models, ingestion_pipeline
 
 @shared_task
 def ingest_document_task(document_id):
+    # Giữ lại cho message cũ còn trong queue: chuyển qua coordinator để không ingest trùng
     try:
         doc = Document.objects.get(id=document_id)
-        ingest_document(doc)
+        request_ingestion(doc)
     except Document.DoesNotExist:
-        pass
\ No newline at end of file
+        pass
+
+@shared_task(bind=True)
+def run_ingestion_job_task(self, job_id):
+    try:
+        run_job(job_id)
+    except DocumentBusy as e:
+        # Job khác (pipeline, reindex_chunks) đang ghi chunk của tài liệu: chạy lại sau
+        raise self.retry(exc=e, countdown=BUSY_RETRY_SECONDS,
+                         max_retries=settings.INGESTION_JOB_STALE_SECONDS // BUSY_RETRY_SECONDS)
+
+
+class IngestionStageTask(Task):
+    """
+    Task cho 1 stage của pipeline ingest: lỗi thì Celery retry riêng stage đó (có backoff),
+    hết số lần retry thì đánh dấu job failed. acks_late để worker chết giữa chừng thì message được giao lại.
+    """
+    autoretry_for = (Exception,)
+    dont_autoretry_for = (DocumentBusy,)
+    retry_backoff = 10
+    retry_backoff_max = 300
+    retry_jitter = True
+    acks_late = True
+    reject_on_worker_lost = True
+
+    @property
+    def max_retries(self):
+        return settings.INGESTION_STAGE_MAX_RETRIES
+
+    def on_failure(self, exc, task_id, args, kwargs, einfo):
+        print(f"[Ingest] Stage {self.name} failed for job {args[0]}: {exc}\n{einfo}")
+        ingestion_pipeline.mark_failed(args[0], str(exc))
+
+
+@shared_task(base=IngestionStageTask, bind=True)
+def ingest_extract_task(self, job_id):
+    try:
+        ingestion_pipeline.run_extract(job_id)
+    except DocumentBusy as e:
+        # Đợi job trước của cùng tài liệu xong (job treo sẽ bị coi là stale sau INGESTION_JOB_STALE_SECONDS)
+        raise self.retry(exc=e, countdown=BUSY_RETRY_SECONDS,
+                         max_retries=settings.INGESTION_JOB_STALE_SECONDS // BUSY_RETRY_SECONDS)
+
+@shared_task(base=IngestionStageTask, bind=True)
+def ingest_embed_task(self, job_id):
+    ingestion_pipeline.run_embed(job_id)
+
+@shared_task(base=IngestionStageTask, bind=True)
+def ingest_persist_task(self, job_id):
+    ingestion_pipeline.run_persist(job_id)
+
+
+def start_ingestion_pipeline(job_id):
+    """
+    Gửi chuỗi extract → embed → persist; mỗi task đi vào queue riêng theo CELERY_TASK_ROUTES.
+    """
+    return chain(
+        ingest_extract_task.si(job_id),
+        ingest_embed_task.si(job_id),
+        ingest_persist_task.si(job_id),
+    ).apply_async()
+
+
+@shared_task
+def backfill_embeddings_task(model_name=None):
+    """
+    Backfill embedding của EMBEDDING_ACTIVE_MODEL theo từng đợt EMBEDDING_BACKFILL_BATCHES_PER_TASK batch,
+    tự gửi lại task cho đợt sau tới khi phủ hết chunk. Chỉ 1 task backfill chạy cho mỗi model.
+    """
+    model_name = model_name or embedding_models.secondary_model()
+    if model_name is None:
+        return None
+    lock_key = f"embedding_backfill:{model_name}"
+    if not cache.add(lock_key, 1, timeout=3600):
+        return None
+    try:
+        stats = embedding_models.backfill(model_name, max_batches=settings.EMBEDDING_BACKFILL_BATCHES_PER_TASK)
+    finally:
+        cache.delete(lock_key)
+    if stats and not stats["complete"]:
+        backfill_embeddings_task.delay(model_name)
+    return stats
@@ -0,0 +1,32 @@
+from django.test import SimpleTestCase, override_settings
+
+from learningapi.services.answer_cache import depends_on_history, relevant_history
+
+HISTORY = [{"question": "Gradient descent là gì?", "answer": "Thuật toán tối ưu lặp."}]
+
+
+@override_settings(ANSWER_CACHE_STANDALONE_MIN_WORDS=4)
+class DependsOnHistoryTests(SimpleTestCase):
+    def test_without_history_nothing_depends_on_it(self):
+        self.assertFalse(depends_on_history("còn ví dụ khác không?", []))
+        self.assertFalse(depends_on_history("tại sao?", None))
+
+    def test_standalone_question_does_not_depend_on_history(self):
+        self.assertFalse(depends_on_history("Stochastic gradient descent khác batch gradient descent thế nào?", HISTORY))
+        self.assertFalse(depends_on_history("What is a learning rate schedule?", HISTORY))
+
+    def test_short_question_is_a_follow_up(self):
+        self.assertTrue(depends_on_history("Tại sao vậy?", HISTORY))
+
+    def test_reference_words_make_a_follow_up(self):
+        self.assertTrue(depends_on_history("Cho mình thêm ví dụ khác về thuật toán", HISTORY))
+        self.assertTrue(depends_on_history("Vậy learning rate của nó nên chọn bao nhiêu?", HISTORY))
+        self.assertTrue(depends_on_history("How should I tune it for large datasets?", HISTORY))
+
+    def test_markers_match_whole_words_only(self):
+        # "nói" chứa "nó" nhưng không phải từ tham chiếu
+        self.assertFalse(depends_on_history("Mạng nơ ron nói chung gồm những lớp nào", HISTORY))
+
+    def test_relevant_history_drops_history_for_standalone_questions(self):
+        self.assertIsNone(relevant_history("Learning rate là gì trong gradient descent?", HISTORY))
+        self.assertIs(relevant_history("Giải thích thêm đi", HISTORY), HISTORY)
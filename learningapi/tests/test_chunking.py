@@ -0,0 +1,83 @@
+from django.test import SimpleTestCase
+
+from learningapi.services.chunking import WordTokenCounter, iter_chunks_with_tokens, iter_sentences
+
+COUNTER = WordTokenCounter()
+
+
+def sentence(i, words=5):
+    return " ".join([f"s{i}w{j}" for j in range(words - 1)] + [f"s{i}end."])
+
+
+def chunk(segments, max_tokens, overlap_tokens):
+    return list(iter_chunks_with_tokens(segments, max_tokens=max_tokens, overlap_tokens=overlap_tokens, counter=COUNTER))
+
+
+class SentenceSplitTests(SimpleTestCase):
+    def test_splits_on_punctuation_and_blank_lines(self):
+        text = "Câu một. Câu hai?\n\nĐoạn mới không có dấu câu\n\nCâu cuối!"
+        self.assertEqual(
+            list(iter_sentences([text])),
+            ["Câu một.", "Câu hai?", "Đoạn mới không có dấu câu", "Câu cuối!"],
+        )
+
+    def test_sentence_spanning_two_segments_is_joined(self):
+        # Trang PDF / khối text có thể cắt giữa câu
+        self.assertEqual(
+            list(iter_sentences(["Câu đầu. Câu bị ", "cắt ngang.  Câu   cuối"])),
+            ["Câu đầu.", "Câu bị cắt ngang.", "Câu cuối"],
+        )
+
+    def test_text_without_punctuation_is_cut_at_whitespace(self):
+        text = "từ " * 100
+        parts = list(iter_sentences([text], max_pending=50))
+        self.assertTrue(all(len(p) <= 50 for p in parts))
+        self.assertEqual(" ".join(parts).split(), text.split())
+
+
+class ChunkerTests(SimpleTestCase):
+    def test_empty_input_yields_nothing(self):
+        self.assertEqual(chunk(["", "   \n\n  "], 20, 5), [])
+
+    def test_chunks_never_exceed_max_tokens(self):
+        text = " ".join(sentence(i, words=3 + i % 5) for i in range(40))
+        chunks = chunk([text], 20, 8)
+        self.assertGreater(len(chunks), 1)
+        for text, tokens in chunks:
+            self.assertLessEqual(tokens, 20)
+            self.assertEqual(tokens, len(text.split()))
+
+    def test_chunk_boundaries_fall_on_sentence_ends(self):
+        text = " ".join(sentence(i) for i in range(12))
+        for text, _ in chunk([text], 12, 0):
+            self.assertTrue(text.split()[0].endswith("w0"))
+            self.assertTrue(text.endswith("end."))
+
+    def test_no_overlap_covers_every_sentence_once(self):
+        sentences = [sentence(i) for i in range(12)]
+        chunks = chunk([" ".join(sentences)], 12, 0)
+        self.assertEqual(" ".join(text for text, _ in chunks), " ".join(sentences))
+
+    def test_overlap_repeats_whole_trailing_sentences(self):
+        sentences = [sentence(i) for i in range(12)]
+        chunks = [text for text, _ in chunk([" ".join(sentences)], 15, 5)]
+        self.assertGreater(len(chunks), 1)
+        for previous, current in zip(chunks, chunks[1:]):
+            # 3 câu 5 token / chunk, overlap 5 token = đúng câu cuối của chunk trước
+            last_sentence = " ".join(previous.split()[-5:])
+            self.assertTrue(current.startswith(last_sentence))
+        # Không mất câu nào
+        joined = " ".join(chunks)
+        for s in sentences:
+            self.assertIn(s, joined)
+
+    def test_overlap_is_dropped_when_next_sentence_does_not_fit(self):
+        text = f"{sentence(0, words=6)} {sentence(1, words=9)}"
+        chunks = chunk([text], 10, 6)
+        self.assertEqual([t for _, t in chunks], [6, 9])
+
+    def test_long_sentence_is_split_at_token_boundaries(self):
+        long_sentence = " ".join(f"w{i}" for i in range(25)) + "."
+        chunks = chunk([long_sentence], 10, 0)
+        self.assertEqual([tokens for _, tokens in chunks], [10, 10, 5])
+        self.assertEqual(" ".join(text for text, _ in chunks), long_sentence)
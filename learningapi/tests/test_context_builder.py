@@ -0,0 +1,77 @@
+import numpy as np
+from django.test import SimpleTestCase
+
+from learningapi.services.context_builder import _relevance, build_context, chunk_tokens
+
+from .utils import retrieved_chunk, vector
+
+
+def build(chunks, token_budget=1000, max_chunks=10, mmr_lambda=0.5, duplicate_threshold=0.99):
+    return [c.id for c in build_context(
+        chunks, token_budget=token_budget, max_chunks=max_chunks,
+        mmr_lambda=mmr_lambda, duplicate_threshold=duplicate_threshold,
+    )]
+
+
+class RelevanceTests(SimpleTestCase):
+    def test_uses_cosine_similarity_without_rrf(self):
+        chunks = [retrieved_chunk(1, vector(1), distance=0.1), retrieved_chunk(2, vector(0, 1), distance=0.4)]
+        np.testing.assert_allclose(_relevance(chunks), [0.9, 0.6], rtol=1e-5)
+
+    def test_uses_normalised_rrf_score_for_hybrid_results(self):
+        chunks = [
+            retrieved_chunk(1, vector(1), distance=0.1, rrf_score=0.01),
+            retrieved_chunk(2, vector(0, 1), distance=0.5, rrf_score=0.03),
+        ]
+        np.testing.assert_allclose(_relevance(chunks), [1 / 3, 1.0], rtol=1e-5)
+
+    def test_token_count_falls_back_to_estimate(self):
+        chunk = retrieved_chunk(1, vector(1), token_count=0)
+        chunk.text = "x" * 40
+        self.assertEqual(chunk_tokens(chunk), 10)
+
+
+class BuildContextTests(SimpleTestCase):
+    def setUp(self):
+        # 1 và 2 gần giống nhau (cosine ~0.98), 3 khác hẳn nhưng kém liên quan hơn
+        self.chunks = [
+            retrieved_chunk(1, vector(1, 0.1), distance=0.10),
+            retrieved_chunk(2, vector(1, 0.3), distance=0.12),
+            retrieved_chunk(3, vector(0, 0, 1), distance=0.30),
+        ]
+
+    def test_empty_input(self):
+        self.assertEqual(build_context([]), [])
+
+    def test_pure_relevance_keeps_retrieval_order(self):
+        self.assertEqual(build(self.chunks, mmr_lambda=1.0), [1, 2, 3])
+
+    def test_mmr_prefers_diverse_chunk(self):
+        self.assertEqual(build(self.chunks, max_chunks=2), [1, 3])
+
+    def test_near_duplicates_are_skipped(self):
+        duplicate = retrieved_chunk(4, vector(1, 0.1), distance=0.10)
+        chunks = [self.chunks[0], duplicate, self.chunks[2]]
+        self.assertEqual(build(chunks, mmr_lambda=1.0, duplicate_threshold=0.95), [1, 3])
+
+    def test_rrf_score_decides_order_for_hybrid_results(self):
+        chunks = [
+            retrieved_chunk(1, vector(1), distance=0.1, rrf_score=0.01),
+            retrieved_chunk(2, vector(0, 1), distance=0.5, rrf_score=0.03),
+        ]
+        self.assertEqual(build(chunks, mmr_lambda=1.0), [2, 1])
+
+    def test_max_chunks(self):
+        chunks = [retrieved_chunk(i, vector(*([0] * i + [1])), distance=0.1 * i) for i in range(5)]
+        self.assertEqual(build(chunks, max_chunks=3), [0, 1, 2])
+
+    def test_stops_at_token_budget(self):
+        chunks = [retrieved_chunk(i, vector(*([0] * i + [1])), distance=0.1 * i, token_count=10) for i in range(4)]
+        self.assertEqual(build(chunks, token_budget=25), [0, 1])
+
+    def test_first_chunk_is_kept_even_over_budget(self):
+        chunks = [
+            retrieved_chunk(1, vector(1), distance=0.1, token_count=50),
+            retrieved_chunk(2, vector(0, 1), distance=0.2, token_count=5),
+        ]
+        self.assertEqual(build(chunks, token_budget=25), [1])
@@ -0,0 +1,69 @@
+from django.test import SimpleTestCase, override_settings
+
+from learningapi.services.context_builder import estimate_tokens
+from learningapi.services.conversation import _fold, fit_budget
+
+
+def turn(i, answer=None):
+    # câu hỏi / câu trả lời 40 ký tự ~ 10 token
+    return {"question": f"Câu hỏi {i}".ljust(40, "."), "answer": answer or f"Trả lời {i}".ljust(40, ".")}
+
+
+@override_settings(CONVERSATION_ANSWER_MAX_TOKENS=10, CONVERSATION_SUMMARY_MAX_TOKENS=20)
+class FitBudgetTests(SimpleTestCase):
+    def test_everything_fits(self):
+        turns = [turn(i) for i in range(3)]
+        history = fit_budget("", turns, token_budget=100)
+        self.assertEqual(history.turns, turns)
+        self.assertEqual(history.summary, "")
+        self.assertEqual(len(history), 3)
+
+    def test_oldest_turns_are_dropped_first(self):
+        history = fit_budget("", [turn(i) for i in range(4)], token_budget=50)
+        self.assertEqual(history.turns, [turn(2), turn(3)])
+
+    def test_summary_counts_against_budget(self):
+        history = fit_budget("t" * 80, [turn(i) for i in range(4)], token_budget=50)
+        self.assertEqual(history.summary, "t" * 80)
+        self.assertEqual(history.turns, [turn(3)])
+
+    def test_long_summary_is_truncated(self):
+        history = fit_budget("t" * 400, [], token_budget=100)
+        self.assertEqual(history.summary, "t" * 80 + "…")
+
+    def test_long_answer_is_truncated(self):
+        history = fit_budget("", [turn(0, answer="y" * 400)], token_budget=100)
+        self.assertEqual(history.turns[0]["answer"], "y" * 40 + "…")
+        self.assertEqual(history.turns[0]["question"], turn(0)["question"])
+
+    def test_empty_history_is_falsy(self):
+        self.assertFalse(fit_budget("", [], token_budget=100))
+        self.assertFalse(fit_budget("", [turn(0)], token_budget=5))
+
+
+@override_settings(CONVERSATION_SUMMARY_MAX_TOKENS=40)
+class FoldTests(SimpleTestCase):
+    def test_keeps_question_and_first_sentence_of_answer(self):
+        summary = _fold("", {
+            "question": "Gradient descent là gì?",
+            "answer": "Thuật toán tối ưu lặp. Nó cập nhật trọng số ngược hướng gradient.",
+        })
+        self.assertEqual(summary, "- Học viên hỏi: Gradient descent là gì? → Thuật toán tối ưu lặp.")
+
+    def test_appends_to_existing_summary(self):
+        summary = _fold("- Học viên hỏi: A → B.", {"question": "C", "answer": "D. E."})
+        self.assertEqual(summary.splitlines(), ["- Học viên hỏi: A → B.", "- Học viên hỏi: C → D."])
+
+    def test_oldest_lines_are_trimmed_at_summary_limit(self):
+        summary = ""
+        for i in range(10):
+            summary = _fold(summary, {"question": f"Câu hỏi số {i}", "answer": f"Trả lời {i}. Chi tiết."})
+        lines = summary.splitlines()
+        self.assertLessEqual(estimate_tokens(summary), 40)
+        self.assertLess(len(lines), 10)
+        self.assertEqual(lines[-1], "- Học viên hỏi: Câu hỏi số 9 → Trả lời 9.")
+        self.assertEqual([line.split()[-1] for line in lines], [f"{i}." for i in range(10 - len(lines), 10)])
+
+    def test_single_long_line_is_kept(self):
+        summary = _fold("- Học viên hỏi: cũ → cũ.", {"question": "q" * 500, "answer": "a" * 500})
+        self.assertEqual(summary.splitlines(), [f"- Học viên hỏi: {'q' * 240}… → {'a' * 320}…"])
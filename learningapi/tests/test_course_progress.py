@@ -0,0 +1,85 @@
+from unittest import mock
+
+from django.test import TestCase
+
+from learningapi.models import CourseProgress, DocumentCompletion, Notification, UserNotification
+
+from .utils import make_course, make_document, make_user
+
+
+def complete(user, documents, is_complete=True):
+    DocumentCompletion.objects.bulk_create(
+        [DocumentCompletion(user=user, document=d, is_complete=is_complete) for d in documents]
+    )
+
+
+class UpdateAllProgressTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.course = make_course()
+        cls.documents = [make_document(cls.course, title=f"Bài {i}") for i in range(4)]
+        cls.half, cls.done, cls.idle = (make_user("learner") for _ in range(3))
+        for learner in (cls.half, cls.done, cls.idle):
+            CourseProgress.objects.create(learner=learner, course=cls.course)
+        complete(cls.half, cls.documents[:2])
+        complete(cls.done, cls.documents)
+        # chưa hoàn thành / thuộc khoá học khác: không được tính
+        complete(cls.idle, cls.documents[:1], is_complete=False)
+        complete(cls.half, [make_document(make_course())])
+
+    def setUp(self):
+        patcher = mock.patch.object(Notification, "_send_email_to_user")
+        self.send_email = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def progress(self, learner):
+        return CourseProgress.objects.get(learner=learner, course=self.course)
+
+    def test_progress_is_percentage_of_completed_documents(self):
+        self.assertEqual(CourseProgress.update_all_progress(self.course), 3)
+        self.assertEqual(self.progress(self.half).progress, 50.0)
+        self.assertEqual(self.progress(self.done).progress, 100.0)
+        self.assertEqual(self.progress(self.idle).progress, 0.0)
+        self.assertEqual(
+            {learner.id for learner in (self.half, self.done, self.idle) if self.progress(learner).is_completed},
+            {self.done.id},
+        )
+
+    def test_progress_is_rounded_to_two_decimals(self):
+        course = make_course()
+        documents = [make_document(course) for _ in range(3)]
+        CourseProgress.objects.create(learner=self.half, course=course)
+        complete(self.half, documents[:1])
+        CourseProgress.update_all_progress(course.id)
+        self.assertEqual(CourseProgress.objects.get(learner=self.half, course=course).progress, 33.33)
+
+    def test_only_newly_completed_learners_are_notified(self):
+        CourseProgress.update_all_progress(self.course)
+        self.assertEqual(list(UserNotification.objects.values_list("user_id", flat=True)), [self.done.id])
+        self.send_email.assert_called_once_with(self.done)
+        # lần tính lại sau: learner đã hoàn thành từ trước không nhận thêm notification
+        CourseProgress.update_all_progress(self.course)
+        self.assertEqual(UserNotification.objects.count(), 1)
+        self.assertEqual(self.send_email.call_count, 1)
+
+    def test_query_count_does_not_depend_on_learners(self):
+        CourseProgress.update_all_progress(self.course)
+        # đếm tài liệu + learner vừa hoàn thành + 1 câu UPDATE
+        with self.assertNumQueries(3):
+            CourseProgress.update_all_progress(self.course)
+
+    def test_new_document_recomputes_progress_after_commit(self):
+        CourseProgress.update_all_progress(self.course)
+        with self.captureOnCommitCallbacks(execute=True):
+            make_document(self.course, title="Bài mới")
+        done = self.progress(self.done)
+        self.assertEqual(done.progress, 80.0)
+        self.assertFalse(done.is_completed)
+
+    def test_course_without_documents_resets_progress(self):
+        course = make_course()
+        CourseProgress.objects.create(learner=self.half, course=course, progress=50, is_completed=True)
+        self.assertEqual(CourseProgress.update_all_progress(course), 1)
+        progress = CourseProgress.objects.get(learner=self.half, course=course)
+        self.assertEqual(progress.progress, 0)
+        self.assertFalse(progress.is_completed)
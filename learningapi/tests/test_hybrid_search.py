@@ -0,0 +1,62 @@
+import numpy as np
+from django.test import TestCase, override_settings
+
+from learningapi.services.hybrid_search import hybrid_search
+from learningapi.services.vector_index import vector_search_session
+
+from .utils import make_chunks, make_course, make_document, vector
+
+
+@override_settings(
+    VECTOR_INDEX_TYPE="hnsw",
+    VECTOR_QUANTIZATION="none",
+    VECTOR_ITERATIVE_SCAN="off",
+    HYBRID_RRF_K=60,
+)
+class HybridSearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.course = make_course()
+        document = make_document(cls.course, title="Bài 1")
+        cls.both, cls.vector_only, cls.text_only, cls.neither = make_chunks(document, [
+            # khớp cả từ khoá lẫn vector
+            ("Gradient descent cập nhật trọng số theo hướng ngược gradient.", vector(1, 0.1)),
+            # gần về vector nhưng không chứa từ khoá
+            ("Tối ưu hoá trọng số bằng đạo hàm của hàm mất mát.", vector(1, 0.3)),
+            # chứa từ khoá nhưng xa về vector
+            ("Bài tập: cài đặt gradient descent bằng numpy.", vector(0, 0, 1)),
+            # không khớp nhánh nào (ngoài top ứng viên vector)
+            ("Softmax chuyển logits thành phân phối xác suất.", vector(0.2, 1)),
+        ])
+        # Chunk của khoá học khác không bao giờ được trả về
+        other = make_document(make_course(), title="Khoá khác")
+        make_chunks(other, [("Gradient descent trong khoá học khác.", vector(1, 0.1))])
+        cls.q_emb = np.asarray(vector(1, 0.1), dtype=np.float32)
+
+    def search(self, question="gradient descent là gì", candidates=2):
+        with vector_search_session():
+            return hybrid_search(self.course, question, self.q_emb, limit=10, candidates=candidates)
+
+    def test_chunk_matching_both_branches_ranks_first(self):
+        results = self.search()
+        self.assertEqual(results[0].id, self.both.id)
+        # 1/(k+1) từ nhánh vector + 1/(k+hạng full-text)
+        self.assertGreater(results[0].rrf_score, 1 / 61)
+
+    def test_union_of_vector_and_full_text_candidates(self):
+        ids = {c.id for c in self.search()}
+        self.assertEqual(ids, {self.both.id, self.vector_only.id, self.text_only.id})
+
+    def test_full_text_only_match_still_has_distance(self):
+        text_only = next(c for c in self.search() if c.id == self.text_only.id)
+        self.assertAlmostEqual(text_only.distance, 1.0, places=4)
+        self.assertEqual(text_only.text, "Bài tập: cài đặt gradient descent bằng numpy.")
+        self.assertEqual(text_only.document_title, "Bài 1")
+
+    def test_results_sorted_by_rrf_score(self):
+        scores = [c.rrf_score for c in self.search()]
+        self.assertEqual(scores, sorted(scores, reverse=True))
+
+    def test_question_without_keywords_falls_back_to_vector(self):
+        results = self.search(question="xin chào", candidates=3)
+        self.assertEqual([c.id for c in results], [self.both.id, self.vector_only.id, self.neither.id])
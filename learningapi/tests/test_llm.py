@@ -0,0 +1,154 @@
+import time
+
+from django.test import SimpleTestCase, override_settings
+
+from learningapi.services.llm import CircuitBreaker, LLMUnavailable, ResilientLLM
+
+
+class FakeProvider:
+    """
+    Provider giả: generate() lần lượt trả về (hoặc raise) từng phần tử của results, stream() yield các đoạn cố định.
+    """
+    name = "fake"
+
+    def __init__(self, *results, parts=("Xin ", "chào")):
+        self.results = list(results)
+        self.parts = parts
+        self.calls = 0
+
+    def generate(self, prompt: str, timeout: float) -> str:
+        self.calls += 1
+        result = self.results.pop(0)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def stream(self, prompt: str, timeout: float):
+        self.calls += 1
+        yield from self.parts
+
+    @staticmethod
+    def is_retryable(exc) -> bool:
+        return isinstance(exc, (TimeoutError, ConnectionError))
+
+
+def expire(breaker: CircuitBreaker):
+    # Giả lập đã qua reset_seconds kể từ lúc breaker mở
+    breaker.opened_at = time.monotonic() - breaker.reset_seconds
+
+
+class CircuitBreakerTests(SimpleTestCase):
+    def setUp(self):
+        self.breaker = CircuitBreaker(failure_threshold=3, reset_seconds=30)
+
+    def open_breaker(self):
+        for _ in range(3):
+            self.breaker.record_failure()
+
+    def test_stays_closed_below_threshold(self):
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, "closed")
+        self.assertEqual(self.breaker.begin(), "closed")
+        self.assertEqual(self.breaker.retry_after(), 0)
+
+    def test_success_resets_failure_count(self):
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        self.breaker.record_success()
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, "closed")
+
+    def test_opens_after_threshold(self):
+        self.open_breaker()
+        self.assertEqual(self.breaker.state, "open")
+        self.assertIsNone(self.breaker.begin())
+        self.assertFalse(self.breaker.allow())
+        self.assertTrue(1 <= self.breaker.retry_after() <= 30)
+
+    def test_half_open_admits_a_single_trial(self):
+        self.open_breaker()
+        expire(self.breaker)
+        self.assertEqual(self.breaker.state, "half-open")
+        self.assertEqual(self.breaker.begin(), "trial")
+        self.assertIsNone(self.breaker.begin())
+
+    def test_trial_success_closes(self):
+        self.open_breaker()
+        expire(self.breaker)
+        self.breaker.begin()
+        self.breaker.record_success()
+        self.assertEqual(self.breaker.state, "closed")
+        self.assertFalse(self.breaker.trial_running)
+        self.assertEqual(self.breaker.begin(), "closed")
+
+    def test_trial_failure_reopens(self):
+        self.open_breaker()
+        expire(self.breaker)
+        self.breaker.begin()
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, "open")
+        self.assertFalse(self.breaker.trial_running)
+        self.assertIsNone(self.breaker.begin())
+
+    def test_end_trial_lets_next_request_try(self):
+        self.open_breaker()
+        expire(self.breaker)
+        self.assertEqual(self.breaker.begin(), "trial")
+        self.breaker.end_trial()
+        self.assertEqual(self.breaker.state, "half-open")
+        self.assertEqual(self.breaker.begin(), "trial")
+
+
+@override_settings(
+    LLM_MAX_RETRIES=1,
+    LLM_RETRY_BASE_SECONDS=0,
+    LLM_TIMEOUT_SECONDS=1,
+    LLM_DEADLINE_SECONDS=5,
+)
+class ResilientLLMTests(SimpleTestCase):
+    def make_llm(self, provider):
+        return ResilientLLM(provider, CircuitBreaker(failure_threshold=2, reset_seconds=30))
+
+    def test_retries_transient_error(self):
+        provider = FakeProvider(TimeoutError("timeout"), "Trả lời")
+        llm = self.make_llm(provider)
+        self.assertEqual(llm.generate("prompt"), "Trả lời")
+        self.assertEqual(provider.calls, 2)
+        self.assertEqual(llm.breaker.failures, 0)
+
+    def test_non_retryable_error_is_raised_and_not_counted(self):
+        provider = FakeProvider(ValueError("bad prompt"))
+        llm = self.make_llm(provider)
+        with self.assertRaises(ValueError):
+            llm.generate("prompt")
+        self.assertEqual(provider.calls, 1)
+        self.assertEqual(llm.breaker.failures, 0)
+
+    def test_repeated_failures_open_breaker_and_short_circuit(self):
+        provider = FakeProvider(*[ConnectionError("down")] * 4)
+        llm = self.make_llm(provider)
+        for _ in range(2):
+            with self.assertRaises(LLMUnavailable):
+                llm.generate("prompt")
+        self.assertEqual(llm.breaker.state, "open")
+        calls = provider.calls
+        with self.assertRaises(LLMUnavailable) as ctx:
+            llm.generate("prompt")
+        self.assertEqual(provider.calls, calls)
+        self.assertGreaterEqual(ctx.exception.retry_after, 1)
+
+    def test_closing_stream_mid_trial_releases_trial(self):
+        llm = self.make_llm(FakeProvider())
+        llm.breaker.record_failure()
+        llm.breaker.record_failure()
+        expire(llm.breaker)
+        stream = llm.stream("prompt")
+        self.assertEqual(next(stream), "Xin ")
+        self.assertTrue(llm.breaker.trial_running)
+        # client ngắt kết nối giữa chừng
+        stream.close()
+        self.assertFalse(llm.breaker.trial_running)
+        self.assertEqual(llm.breaker.state, "half-open")
+        self.assertEqual("".join(llm.stream("prompt")), "Xin chào")
+        self.assertEqual(llm.breaker.state, "closed")
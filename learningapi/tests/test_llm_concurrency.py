@@ -0,0 +1,118 @@
+import threading
+import time
+
+from django.test import SimpleTestCase, override_settings
+
+from learningapi.services import llm_concurrency, metrics
+from learningapi.services.llm_concurrency import flight_key, single_flight
+
+WAIT_SECONDS = 5
+
+
+def coalesced() -> int:
+    return metrics.snapshot(["llm.coalesced"])["llm.coalesced"]
+
+
+class FlightKeyTests(SimpleTestCase):
+    def test_same_question_typed_differently_shares_key(self):
+        self.assertEqual(
+            flight_key(1, "Gradient  Descent là gì", "model"),
+            flight_key(1, "gradient descent là gì ", "model"),
+        )
+
+    def test_course_and_model_are_part_of_key(self):
+        key = flight_key(1, "gradient descent là gì", "model")
+        self.assertNotEqual(key, flight_key(2, "gradient descent là gì", "model"))
+        self.assertNotEqual(key, flight_key(1, "gradient descent là gì", "other-model"))
+
+    def test_follow_up_question_is_not_coalesced(self):
+        self.assertIsNone(flight_key(1, "còn ví dụ khác không?", "model", history=[("hỏi", "đáp")]))
+
+    def test_standalone_question_with_history_shares_key(self):
+        # trả lời không kèm lịch sử (answer_cache.relevant_history) → dùng chung key với learner chưa có hội thoại
+        self.assertEqual(
+            flight_key(1, "gradient descent là gì trong học máy", "model", history=[("hỏi", "đáp")]),
+            flight_key(1, "gradient descent là gì trong học máy", "model"),
+        )
+
+
+@override_settings(LLM_COALESCE=True, ANSWER_CACHE_ENABLED=False)
+class SingleFlightTests(SimpleTestCase):
+    def run_concurrently(self, key, fn, followers=3):
+        """
+        1 leader chạy fn (chặn tới khi release), followers gọi cùng key trong lúc đó. Trả về kết quả / lỗi của từng thread.
+        """
+        started, release = threading.Event(), threading.Event()
+        outcomes = []
+
+        def leader_fn():
+            started.set()
+            release.wait(WAIT_SECONDS)
+            return fn()
+
+        def call(f):
+            try:
+                outcomes.append(single_flight(key, f))
+            except Exception as e:
+                outcomes.append(e)
+
+        before = coalesced()
+        threads = [threading.Thread(target=call, args=(leader_fn,))]
+        threads[0].start()
+        self.assertTrue(started.wait(WAIT_SECONDS))
+        threads += [threading.Thread(target=call, args=(fn,)) for _ in range(followers)]
+        for t in threads[1:]:
+            t.start()
+        # chờ tất cả followers đã vào hàng chờ của leader rồi mới cho leader chạy xong
+        deadline = time.monotonic() + WAIT_SECONDS
+        while coalesced() - before < followers and time.monotonic() < deadline:
+            time.sleep(0.01)
+        release.set()
+        for t in threads:
+            t.join(WAIT_SECONDS)
+        self.assertNotIn(key, llm_concurrency._calls)
+        return outcomes
+
+    def test_concurrent_callers_share_one_call(self):
+        calls = []
+
+        def fn():
+            calls.append(1)
+            return "Trả lời"
+
+        outcomes = self.run_concurrently("same-question", fn)
+        self.assertEqual(outcomes, ["Trả lời"] * 4)
+        self.assertEqual(len(calls), 1)
+
+    def test_error_is_raised_for_every_waiter(self):
+        def fn():
+            raise RuntimeError("provider down")
+
+        outcomes = self.run_concurrently("failing-question", fn)
+        self.assertEqual(len(outcomes), 4)
+        self.assertTrue(all(isinstance(o, RuntimeError) for o in outcomes))
+
+    def run_in_parallel(self, key):
+        # Barrier chỉ qua được khi cả 2 lời gọi fn chạy cùng lúc, tức là không bị gộp
+        barrier = threading.Barrier(2, timeout=WAIT_SECONDS)
+        outcomes = []
+
+        def call():
+            try:
+                outcomes.append(single_flight(key, barrier.wait))
+            except Exception as e:
+                outcomes.append(e)
+
+        threads = [threading.Thread(target=call) for _ in range(2)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join(WAIT_SECONDS * 2)
+        return outcomes
+
+    def test_none_key_is_not_coalesced(self):
+        self.assertEqual(sorted(self.run_in_parallel(None)), [0, 1])
+
+    @override_settings(LLM_COALESCE=False)
+    def test_coalescing_can_be_disabled(self):
+        self.assertEqual(sorted(self.run_in_parallel("same-question")), [0, 1])
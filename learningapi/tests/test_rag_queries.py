@@ -0,0 +1,98 @@
+from unittest import mock
+
+import numpy as np
+from django.test import TestCase, override_settings
+
+from learningapi.services import embedding_models, rag_service
+
+from .utils import make_chunks, make_course, make_document, vector
+
+# Số query cho mỗi câu hỏi, đo ở trạng thái ổn định (model của cột Chunk.embedding đã được nhớ trong process).
+# vector_search_session: SAVEPOINT + set_config(hnsw.ef_search) + câu retrieval + RELEASE SAVEPOINT = 4 query.
+RAG_SETTINGS = dict(
+    RETRIEVAL_MODE="hybrid",
+    VECTOR_INDEX_TYPE="hnsw",
+    VECTOR_QUANTIZATION="none",
+    VECTOR_ITERATIVE_SCAN="off",
+    MEMORY_INDEX_ENABLED=False,
+    ANSWER_CACHE_ENABLED=False,
+    RELEVANCE_GATE_ENABLED=True,
+    EMBEDDING_ACTIVE_MODEL="",
+)
+RETRIEVE_QUERIES = 4
+
+
+class FakeLLM:
+    """
+    LLM giả: trả về câu trả lời cố định và ghi lại các prompt đã nhận.
+    """
+
+    def __init__(self, answer="Gradient descent cập nhật trọng số ngược hướng gradient. Nguồn: Bài 1"):
+        self.answer = answer
+        self.prompts = []
+
+    def generate(self, prompt):
+        self.prompts.append(prompt)
+        return self.answer
+
+
+@override_settings(**RAG_SETTINGS)
+class RetrievalQueryCountTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.course = make_course()
+        document = make_document(cls.course, title="Bài 1")
+        make_chunks(document, [
+            ("Gradient descent cập nhật trọng số theo hướng ngược gradient.", vector(1, 0.1)),
+            ("Learning rate quyết định độ dài mỗi bước của gradient descent.", vector(1, 0.3)),
+            ("Softmax chuyển logits thành phân phối xác suất.", vector(0.2, 1)),
+            ("Cây nhị phân có thể duyệt theo thứ tự trước, giữa và sau.", vector(0, 0, 1)),
+        ])
+        cls.q_emb = np.asarray(vector(1, 0.1), dtype=np.float32)
+
+    def setUp(self):
+        # Model của cột được đọc từ DB 1 lần rồi nhớ trong process: đọc trước để chỉ đếm query của câu hỏi
+        embedding_models._column.update(name=None, checked_at=0.0)
+        embedding_models._serving.update(target=None, name=None, checked_at=0.0)
+        self.model_name = embedding_models.serving_model()
+
+    def test_hybrid_retrieve_is_one_round_trip(self):
+        with self.assertNumQueries(RETRIEVE_QUERIES):
+            result = rag_service.retrieve(self.course, self.q_emb, "gradient descent là gì", model_name=self.model_name)
+        self.assertTrue(result.chunks)
+        # text và tiêu đề tài liệu đã có sẵn, không lazy-load thêm query
+        with self.assertNumQueries(0):
+            self.assertTrue(result.context)
+            self.assertEqual(set(result.sources), {"Bài 1"})
+
+    @override_settings(RETRIEVAL_MODE="vector")
+    def test_vector_retrieve_is_one_round_trip(self):
+        with self.assertNumQueries(RETRIEVE_QUERIES):
+            result = rag_service.retrieve(self.course, self.q_emb, "gradient descent là gì", model_name=self.model_name)
+        self.assertEqual(result.candidates[0].text, "Gradient descent cập nhật trọng số theo hướng ngược gradient.")
+        distances = [c.distance for c in result.candidates]
+        self.assertEqual(distances, sorted(distances))
+
+    def test_generate_ai_answer_queries(self):
+        llm = FakeLLM()
+        with mock.patch.object(rag_service, "get_llm", return_value=llm), \
+                mock.patch.object(rag_service, "get_query_embedding", return_value=self.q_emb):
+            with self.assertNumQueries(RETRIEVE_QUERIES):
+                answer, sources = rag_service.generate_ai_answer(self.course, "gradient descent là gì")
+        self.assertEqual(answer, llm.answer)
+        self.assertEqual(set(sources), {"Bài 1"})
+        self.assertEqual(len(llm.prompts), 1)
+
+    @override_settings(ANSWER_CACHE_ENABLED=True)
+    def test_generate_ai_answer_queries_with_answer_cache(self):
+        llm = FakeLLM()
+        with mock.patch.object(rag_service, "get_llm", return_value=llm), \
+                mock.patch.object(rag_service, "get_query_embedding", return_value=self.q_emb):
+            # miss: lookup + retrieval + lưu câu trả lời
+            with self.assertNumQueries(1 + RETRIEVE_QUERIES + 1):
+                first = rag_service.generate_ai_answer(self.course, "gradient descent là gì")
+            # hit: lookup + tăng hit_count, không retrieval, không gọi LLM
+            with self.assertNumQueries(2):
+                second = rag_service.generate_ai_answer(self.course, "Gradient descent là gì?")
+        self.assertEqual(first, second)
+        self.assertEqual(len(llm.prompts), 1)
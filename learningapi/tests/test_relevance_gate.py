@@ -0,0 +1,52 @@
+from django.test import SimpleTestCase, override_settings
+
+from learningapi.services.relevance_gate import DOCS, WEB, choose_strategy, relevance_score
+from learningapi.services.retrieval import RetrievalResult
+
+from .utils import retrieved_chunk, vector
+
+
+def candidates(*distances):
+    return [retrieved_chunk(i, vector(1), distance=d) for i, d in enumerate(distances)]
+
+
+def result(*distances):
+    chunks = candidates(*distances)
+    return RetrievalResult(candidates=chunks, chunks=chunks[:1])
+
+
+class RelevanceScoreTests(SimpleTestCase):
+    def test_mean_of_top_k_smallest_distances(self):
+        self.assertAlmostEqual(relevance_score(candidates(0.9, 0.2, 0.4, 0.3), top_k=3), 0.3)
+
+    def test_fewer_candidates_than_top_k(self):
+        self.assertAlmostEqual(relevance_score(candidates(0.5), top_k=3), 0.5)
+
+    def test_candidates_without_distance_are_ignored(self):
+        self.assertAlmostEqual(relevance_score(candidates(None, 0.2, None, 0.4), top_k=3), 0.3)
+
+    def test_no_distance_gives_none(self):
+        self.assertIsNone(relevance_score(candidates(None, None), top_k=3))
+        self.assertIsNone(relevance_score([], top_k=3))
+
+
+@override_settings(RELEVANCE_GATE_ENABLED=True, RELEVANCE_GATE_MAX_DISTANCE=0.75, RELEVANCE_GATE_TOP_K=3)
+class ChooseStrategyTests(SimpleTestCase):
+    def test_no_chunks_goes_to_web(self):
+        self.assertEqual(choose_strategy(RetrievalResult()), WEB)
+
+    def test_relevant_documents_use_docs_prompt(self):
+        self.assertEqual(choose_strategy(result(0.2, 0.3, 0.9)), DOCS)
+
+    def test_unrelated_documents_go_to_web(self):
+        self.assertEqual(choose_strategy(result(0.8, 0.85, 0.9)), WEB)
+
+    def test_score_at_threshold_uses_docs_prompt(self):
+        self.assertEqual(choose_strategy(result(0.75, 0.75, 0.75)), DOCS)
+
+    def test_full_text_only_candidates_use_docs_prompt(self):
+        self.assertEqual(choose_strategy(result(None, None)), DOCS)
+
+    @override_settings(RELEVANCE_GATE_ENABLED=False)
+    def test_disabled_gate_always_uses_docs_prompt(self):
+        self.assertEqual(choose_strategy(result(0.8, 0.85, 0.9)), DOCS)
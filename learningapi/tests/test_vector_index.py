@@ -0,0 +1,23 @@
+from django.db import connection
+from django.test import TestCase
+
+from learningapi.models import Chunk
+from learningapi.services.vector_index import CHUNK_TABLE, chunk_dimensions, reset_chunk_dimensions
+
+
+class ChunkDimensionsTests(TestCase):
+    def setUp(self):
+        reset_chunk_dimensions()
+        self.addCleanup(reset_chunk_dimensions)
+
+    def test_defaults_to_declared_dimensions(self):
+        self.assertEqual(chunk_dimensions(), Chunk._meta.get_field("embedding").dimensions)
+
+    def test_reads_live_column_after_resize(self):
+        declared = chunk_dimensions()
+        # promote_embedding_model --resize đổi cột bằng ALTER TABLE, models.py vẫn khai báo số chiều cũ
+        with connection.cursor() as cursor:
+            cursor.execute(f"ALTER TABLE {CHUNK_TABLE} ALTER COLUMN embedding TYPE vector(8) USING NULL")
+        self.assertEqual(chunk_dimensions(), declared)  # còn nhớ trong process
+        reset_chunk_dimensions()
+        self.assertEqual(chunk_dimensions(), 8)
@@ -0,0 +1,64 @@
+import uuid
+
+import numpy as np
+
+from learningapi.models import Chunk, Course, Document, User
+from learningapi.services.retrieval import RetrievedChunk
+
+DIMENSIONS = 384
+
+
+def vector(*weights) -> list:
+    """
+    Vector DIMENSIONS chiều đã chuẩn hoá, các thành phần đầu lấy từ weights (còn lại = 0).
+    """
+    v = np.zeros(DIMENSIONS, dtype=np.float32)
+    v[:len(weights)] = weights
+    return (v / np.linalg.norm(v)).tolist()
+
+
+def make_user(role="learner", **extra):
+    name = f"{role}-{uuid.uuid4().hex[:8]}"
+    return User.objects.create_user(username=name, email=f"{name}@example.com", password="test", role=role, **extra)
+
+
+def make_course(title=None):
+    return Course.objects.create(title=title or f"Khoá học {uuid.uuid4().hex[:8]}", instructor=make_user("instructor"))
+
+
+def make_document(course, title="Tài liệu"):
+    # Không có file/url → signal post_save không yêu cầu ingest
+    return Document.objects.create(course=course, title=title)
+
+
+def make_chunks(document, rows):
+    """
+    rows: [(text, embedding)] → Chunk của tài liệu (token_count ước lượng theo số từ).
+    """
+    return Chunk.objects.bulk_create([
+        Chunk(
+            course_id=document.course_id,
+            document=document,
+            text=text,
+            embedding=embedding,
+            token_count=len(text.split()),
+            meta={"source": document.title},
+        )
+        for text, embedding in rows
+    ])
+
+
+def retrieved_chunk(id, embedding, distance=None, token_count=10, rrf_score=None, title="Bài 1"):
+    """
+    RetrievedChunk dựng sẵn (không cần DB) cho test context builder / relevance gate.
+    """
+    return RetrievedChunk(
+        id=id,
+        document_id=1,
+        document_title=title,
+        embedding=np.asarray(embedding, dtype=np.float32),
+        token_count=token_count,
+        distance=distance,
+        text=f"Chunk {id}",
+        rrf_score=rrf_score,
+    )
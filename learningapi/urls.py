@@ -20,9 +20,11 @@ router.register(r'payments', views.PaymentViewSet, basename='payment')
 urlpatterns = [
     path('courses/hot/', views.CourseViewSet.as_view({'get': 'hot_courses'}), name='course-hot'),
     path('courses/suggested/', views.CourseViewSet.as_view({'get': 'suggested_courses'}), name='course-suggested'),
+    path('courses/<int:pk>/chat/async/', views.course_chat_async, name='course-chat-async'),
     path('statistics/courses/', views.CourseStatisticsView.as_view(), name='course-statistics'),
     path('statistics/instructors/', views.InstructorStatisticsView.as_view(), name='instructor-statistics'),
     path('statistics/learners/', views.LearnerStatisticsView.as_view(), name='learner-statistics'),
+    path('rag/metrics/', views.RagMetricsView.as_view(), name='rag-metrics'),
 
     path('vnpay/create_payment_url/', views.create_payment_url, name='create-payment-url'),
     path('vnpay/redirect/', views.vnpay_redirect, name='vnpay-redirect'),
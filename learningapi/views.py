@@ -3,10 +3,12 @@ import threading
 from httpcore import request
 
 logger = logging.getLogger(__name__)
-from django.http import HttpResponse, JsonResponse
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
+from rest_framework.renderers import BaseRenderer, JSONRenderer
 from rest_framework import viewsets, generics
 import urllib
 from .paginators import *
@@ -22,14 +24,49 @@ from django.views.decorators.csrf import csrf_exempt
 from django.utils import timezone
 from django.utils.timezone import localtime
 from datetime import datetime
-import os,hashlib,hmac
+import os,hashlib,hmac,json
 import uuid
 
 from rest_framework.decorators import action
 from django.shortcuts import get_object_or_404
-from .services.rag_service import generate_ai_answer
+from .services.rag_service import generate_ai_answer, stream_ai_answer
+from .services.llm import LLMUnavailable
+from .services.llm_concurrency import LLMBusy
+from .services import conversation
 
-from learningapi.tasks import ingest_document_task
+
+class EventStreamRenderer(BaseRenderer):
+	"""Cho phép client gửi Accept: text/event-stream tới các endpoint streaming"""
+	media_type = 'text/event-stream'
+	format = 'sse'
+	charset = 'utf-8'
+
+	def render(self, data, accepted_media_type=None, renderer_context=None):
+		# Chỉ dùng cho response lỗi (403, 400...), stream thật được trả bằng StreamingHttpResponse
+		return format_sse('error', data)
+
+
+def format_sse(event, data):
+	return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n".encode('utf-8')
+
+
+def llm_error_response(error, response_class=Response):
+	"""
+	503 khi LLM provider đang lỗi / circuit breaker mở, 429 khi hết slot gọi LLM (LLMBusy); kèm Retry-After nếu biết
+	"""
+	if isinstance(error, LLMBusy):
+		response = response_class(
+			{"detail": "AI tutor is busy, please try again shortly."},
+			status=status.HTTP_429_TOO_MANY_REQUESTS,
+		)
+	else:
+		response = response_class(
+			{"detail": "AI tutor is unavailable, please try again."},
+			status=status.HTTP_503_SERVICE_UNAVAILABLE,
+		)
+	if error.retry_after:
+		response['Retry-After'] = str(error.retry_after)
+	return response
 
 # Health check endpoint for Render deployment
 @csrf_exempt
@@ -274,6 +311,31 @@ class LearnerStatisticsView(APIView):
 		return Response(response_data, status=status.HTTP_200_OK)
 
 
+class RagMetricsView(APIView):
+	"""Số liệu vận hành của AI tutor (cache, embedding model) cho admin"""
+	permission_classes = [IsAdmin]
+
+	def get(self, request):
+		from .services.answer_cache import cache_stats
+		from .services.embedding_registry import registry_stats
+		from .services.embedding_models import status as embedding_models_status
+		from .services.query_embedding_cache import cache_stats as query_embedding_cache_stats
+		from .services.memory_index import index_stats as memory_index_stats
+		from .services.llm import llm_stats
+		from .services.llm_concurrency import limiter_stats
+		from .services.relevance_gate import gate_stats
+		return Response({
+			'answer_cache': cache_stats(),
+			'embedding': registry_stats(),
+			'embedding_models': embedding_models_status(),
+			'query_embedding_cache': query_embedding_cache_stats(),
+			'memory_index': memory_index_stats(),
+			'llm': llm_stats(),
+			'llm_concurrency': limiter_stats(),
+			'relevance_gate': gate_stats(),
+		}, status=status.HTTP_200_OK)
+
+
 class UserViewSet(viewsets.ViewSet, generics.CreateAPIView, generics.UpdateAPIView, generics.ListAPIView):
 	serializer_class = UserSerializer
 	queryset = User.objects.all()
@@ -526,23 +588,82 @@ class CourseViewSet(viewsets.ViewSet,generics.CreateAPIView,generics.UpdateAPIVi
 		question_text = serializer.validated_data['message']
 		allow_web = serializer.validated_data.get('allow_web', False)
 
-		# Lấy lịch sử hội thoại trước đó (ví dụ: 5 câu gần nhất)
-		questions = Question.objects.filter(
-			course=course, asked_by=request.user
-		).order_by('-created_at')[:5]
-		history = []
-		for q in reversed(questions):
-			ai_answer = q.answers.filter(is_ai=True).first()
-			if ai_answer:
-				history.append({"question": q.content, "answer": ai_answer.content})
+		history = conversation.get_history(course, request.user)
 
 		# Truyền history vào hàm generate_ai_answer
-		answer_text, sources = generate_ai_answer(course, question_text, allow_web=allow_web, history=history)
+		try:
+			answer_text, sources = generate_ai_answer(
+				course, question_text, allow_web=allow_web, history=history,
+				ef_search=serializer.validated_data.get('ef_search'),
+				probes=serializer.validated_data.get('probes'),
+			)
+		except (LLMUnavailable, LLMBusy) as e:
+			return llm_error_response(e)
+
+		self.save_chat_turn(course, request.user, question_text, answer_text)
+
+		resp_serializer = ChatResponseSerializer({'answer': answer_text, 'sources': sources})
+		return Response(resp_serializer.data)
+
+	@action(detail=True, methods=['post'], url_path='chat/stream', renderer_classes=[JSONRenderer, EventStreamRenderer])
+	def chat_stream(self, request, pk=None):
+		"""
+		Giống chat nhưng trả về Server-Sent Events: sources trước, sau đó từng token, cuối cùng là done.
+		Chạy qua ASGI thì trả về async generator: Django gom hết generator đồng bộ (sync_to_async(list)) trước khi gửi,
+		client sẽ chỉ nhận được toàn bộ câu trả lời ở cuối.
+		"""
+		course = self.get_object()
+		if not self.has_course_access(course, request.user):
+			return Response({"detail": "You do not have access to this course."}, status=403)
+		serializer = ChatRequestSerializer(data=request.data)
+		serializer.is_valid(raise_exception=True)
+		question_text = serializer.validated_data['message']
+		history = conversation.get_history(course, request.user)
+		user = request.user
+
+		options = {
+			'ef_search': serializer.validated_data.get('ef_search'),
+			'probes': serializer.validated_data.get('probes'),
+		}
+
+		def event_stream():
+			try:
+				for event, data in stream_ai_answer(course, question_text, history=history, **options):
+					if event == 'done':
+						# Lưu Question/Answer khi đã có câu trả lời hoàn chỉnh
+						self.save_chat_turn(course, user, question_text, data['answer'])
+					yield format_sse(event, data)
+			except LLMBusy as e:
+				yield format_sse('error', {'detail': 'AI tutor is busy, please try again shortly.', 'retry_after': e.retry_after})
+			except Exception as e:
+				logger.error(f"Chat stream error: {e}")
+				yield format_sse('error', {'detail': 'AI tutor is unavailable, please try again.'})
+
+		async def aevent_stream():
+			from asgiref.sync import sync_to_async
+			from .services.rag_service import astream_ai_answer
+			try:
+				async for event, data in astream_ai_answer(course, question_text, history=history, **options):
+					if event == 'done':
+						await sync_to_async(self.save_chat_turn)(course, user, question_text, data['answer'])
+					yield format_sse(event, data)
+			except LLMBusy as e:
+				yield format_sse('error', {'detail': 'AI tutor is busy, please try again shortly.', 'retry_after': e.retry_after})
+			except Exception as e:
+				logger.error(f"Chat stream error: {e}")
+				yield format_sse('error', {'detail': 'AI tutor is unavailable, please try again.'})
+
+		stream = aevent_stream() if isinstance(request._request, ASGIRequest) else event_stream()
+		response = StreamingHttpResponse(stream, content_type='text/event-stream')
+		response['Cache-Control'] = 'no-cache'
+		response['X-Accel-Buffering'] = 'no'  # không để proxy buffer toàn bộ stream
+		return response
 
+	def save_chat_turn(self, course, user, question_text, answer_text):
 		# Lưu Question và Answer như cũ
 		question = Question.objects.create(
 			course=course,
-			asked_by=request.user if request.user.is_authenticated else None,
+			asked_by=user if user.is_authenticated else None,
 			content=question_text
 		)
 		Answer.objects.create(
@@ -551,9 +672,8 @@ class CourseViewSet(viewsets.ViewSet,generics.CreateAPIView,generics.UpdateAPIVi
 			content=answer_text,
 			is_ai=True
 		)
-
-		resp_serializer = ChatResponseSerializer({'answer': answer_text, 'sources': sources})
-		return Response(resp_serializer.data)
+		conversation.record_turn(course, user, question_text, answer_text)
+		return question
 
 	@action(detail=True, methods=['get'], url_path='chat/history')
 	def chat_history(self, request, pk=None):
@@ -574,6 +694,72 @@ class CourseViewSet(viewsets.ViewSet,generics.CreateAPIView,generics.UpdateAPIVi
 				})
 		return Response(data)
 
+async def _ahas_course_access(course, user):
+	if not user.is_authenticated:
+		return False
+	if user.role in ['admin', 'center'] or course.instructor_id == user.id:
+		return True
+	return await CourseProgress.objects.filter(learner=user, course=course).aexists()
+
+
+def _authenticate(request):
+	# Dùng lại authentication của DRF (JWT / OAuth2) cho view async thuần Django
+	from rest_framework.request import Request
+	from rest_framework.settings import api_settings
+	drf_request = Request(request, authenticators=[auth() for auth in api_settings.DEFAULT_AUTHENTICATION_CLASSES])
+	try:
+		return drf_request.user
+	except Exception:
+		return None
+
+
+@csrf_exempt
+@require_http_methods(["POST"])
+async def course_chat_async(request, pk):
+	"""
+	Bản async của CourseViewSet.chat (chạy qua learning_platform/asgi.py).
+	Trong lúc chờ Gemini, worker vẫn phục vụ được các request khác.
+	"""
+	from asgiref.sync import sync_to_async
+	from .services.rag_service import agenerate_ai_answer
+
+	user = await sync_to_async(_authenticate)(request)
+	if user is None or not user.is_authenticated:
+		return JsonResponse({"detail": "Authentication credentials were not provided."}, status=401)
+	try:
+		course = await Course.objects.aget(pk=pk)
+	except Course.DoesNotExist:
+		return JsonResponse({"detail": "Not found."}, status=404)
+	if not await _ahas_course_access(course, user):
+		return JsonResponse({"detail": "You do not have access to this course."}, status=403)
+
+	try:
+		payload = json.loads(request.body or b'{}')
+	except ValueError:
+		return JsonResponse({"detail": "Invalid JSON body."}, status=400)
+	serializer = ChatRequestSerializer(data=payload)
+	if not serializer.is_valid():
+		return JsonResponse(serializer.errors, status=400)
+	question_text = serializer.validated_data['message']
+
+	history = await sync_to_async(conversation.get_history)(course, user)
+	try:
+		answer_text, sources = await agenerate_ai_answer(
+			course, question_text, history=history,
+			ef_search=serializer.validated_data.get('ef_search'),
+			probes=serializer.validated_data.get('probes'),
+		)
+	except (LLMUnavailable, LLMBusy) as e:
+		return llm_error_response(e, response_class=JsonResponse)
+
+	question = await Question.objects.acreate(course=course, asked_by=user, content=question_text)
+	await Answer.objects.acreate(question=question, answered_by=None, content=answer_text, is_ai=True)
+	await sync_to_async(conversation.record_turn)(course, user, question_text, answer_text)
+
+	resp_serializer = ChatResponseSerializer({'answer': answer_text, 'sources': sources})
+	return JsonResponse(resp_serializer.data)
+
+
 class TagViewSet(viewsets.ViewSet,generics.ListAPIView,generics.CreateAPIView,generics.UpdateAPIView,generics.DestroyAPIView):
 	serializer_class = TagSerializer
 	queryset = Tag.objects.all()
@@ -611,29 +797,14 @@ def generate_file_name(file_obj):
 	print(f"[Document] Original file name: {file_obj.name}, Generated unique name: {unique_name}")
 	return unique_name
 
-def run_ingest_document_async(instance):
-	try:
-		# Nếu có Celery broker, gọi task Celery
-		from learningapi.tasks import ingest_document_task
-		import os
-		broker_url = os.environ.get("CELERY_BROKER_URL", "")
-		if broker_url and broker_url.startswith("redis://"):
-			ingest_document_task.delay(instance.id)
-		else:
-			raise RuntimeError("No Celery broker configured")
-	except Exception as e:
-		# Nếu không có Celery hoặc lỗi, fallback sang thread cho dev
-		from .services.document_ingestion import ingest_document
-		threading.Thread(target=ingest_document, args=(instance,), daemon=True).start()
-
 class DocumentViewSet(viewsets.ViewSet,generics.ListAPIView,generics.RetrieveAPIView,generics.CreateAPIView,generics.UpdateAPIView,generics.DestroyAPIView):
 
 	serializer_class = DocumentSerializer
 
 	def get_permissions(self):
-		if self.action in ['create', 'update', 'partial_update', 'destroy', 'upload']:
+		if self.action in ['create', 'update', 'partial_update', 'destroy', 'upload', 'reingest']:
 			return [CanCRUDDocument()]
-		if self.action in [ 'retrieve','download']:
+		if self.action in [ 'retrieve','download','ingestion_status']:
 			return [CanViewDocument()]
 		if self.action in ['list']:
 			return [permissions.AllowAny()]
@@ -672,9 +843,8 @@ class DocumentViewSet(viewsets.ViewSet,generics.ListAPIView,generics.RetrieveAPI
 			print(f"[Document] Serializer errors: {serializer.errors}")
 			return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 		instance = serializer.save(uploaded_by=request.user)
+		# Ingestion được post_save signal gửi qua ingestion_coordinator
 		print(f"[Document] Document created with ID: {instance.id}")
-		print(f"[Document] Calling ingestion service for document ID: {instance.id}")
-		run_ingest_document_async(instance)
 		headers = self.get_success_headers(serializer.data)
 		return Response(self.get_serializer(instance).data, status=status.HTTP_201_CREATED, headers=headers)
 
@@ -692,8 +862,6 @@ class DocumentViewSet(viewsets.ViewSet,generics.ListAPIView,generics.RetrieveAPI
 				data[k] = v
 
 		instance = self.get_object()
-		old_file = instance.file
-		old_url = instance.url
 
 		uploaded_file = request.FILES.get('file')
 		if uploaded_file:
@@ -707,18 +875,9 @@ class DocumentViewSet(viewsets.ViewSet,generics.ListAPIView,generics.RetrieveAPI
 			print("[Document] Serializer errors:", serializer.errors)
 			return Response(serializer.errors, status=400)
 
+		# 🔑 post_save signal gửi qua ingestion_coordinator: chỉ ingest lại khi file hoặc url thay đổi
 		updated_instance = serializer.save(uploaded_by=request.user)
 
-		# 🔑 Chỉ ingest nếu file hoặc url thay đổi
-		file_changed = (uploaded_file is not None and updated_instance.file != old_file)
-		url_changed = ('url' in data and data['url'] != old_url)
-
-		if file_changed or url_changed:
-			print(f"[Document] Content changed → re-ingest {updated_instance.id}")
-			run_ingest_document_async(updated_instance)
-		else:
-			print(f"[Document] Metadata updated only → skip ingest {updated_instance.id}")
-
 		return Response(serializer.data)
 	
 	def perform_create(self, serializer):
@@ -772,15 +931,31 @@ class DocumentViewSet(viewsets.ViewSet,generics.ListAPIView,generics.RetrieveAPI
 				uploaded_by=request.user
 			)
 
-			# Gọi ingestion service
-			print(f"[Document] Calling ingestion service for document ID: {doc.id}")
-			run_ingest_document_async(doc)
-
+			# Ingestion được post_save signal gửi qua ingestion_coordinator
 			serializer = DocumentSerializer(doc)
 			return Response({"message": "Uploaded successfully", "document": serializer.data})
 		else:
 			return Response({"error": "Upload failed"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+	@action(detail=True, methods=['get'], url_path='ingestion')
+	def ingestion_status(self, request, pk=None):
+		"""Trạng thái ingest mới nhất của tài liệu (frontend poll endpoint này sau khi upload)"""
+		document = self.get_object()
+		job = document.ingestion_jobs.first()
+		if job is None:
+			return Response({'detail': 'No ingestion job for this document.'}, status=404)
+		return Response(IngestionJobSerializer(job).data)
+
+	@action(detail=True, methods=['post'], url_path='reingest')
+	def reingest(self, request, pk=None):
+		"""Tải lại nội dung ở cùng file/url (trang web đã sửa, file upload đè) và ingest lại nếu nội dung đã đổi"""
+		from .services.ingestion_coordinator import request_ingestion
+		document = self.get_object()
+		job = request_ingestion(document)
+		if job is None:
+			return Response({'detail': 'Document has no file or url to ingest.'}, status=400)
+		return Response(IngestionJobSerializer(job).data, status=status.HTTP_202_ACCEPTED)
+
 	@action(detail=True, methods=['get'], url_path='download')
 	def download(self, request, pk=None):
 		"""Serve document file through Django backend to handle authentication"""